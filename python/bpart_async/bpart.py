@@ -10,11 +10,27 @@
 # @date: 2014/05/23
 
 import config
-import urllib2
 import logging
 from btle import Peripheral
-import json
 import struct
+from bpcore import control, metrics
+from bpcore.adaptive import AdaptiveRate
+from bpcore.samples import makeSample
+from bpcore.clock import getClock
+from bpcore.sensors import SENSORS, serviceUUID
+from bpcore.sinks import getPipeline
+from bpcore.bus import getBus
+
+
+def sendSample(sample):
+    '''
+    Sends a sample to the sinks in config.SINKS, the sample bus and the control API.
+    '''
+    sampleBus = getBus(config.SAMPLE_BUS, config.SAMPLE_BUS_SLOTS)
+    if sampleBus != None:
+        sampleBus.publish(sample)
+    control.getStatus().sample(sample)
+    getPipeline(config.SINKS, config.AGGREGATION, config.SPOOL, config.DEADBAND).send(sample)
 
 
 class BPart(Peripheral):
@@ -49,6 +65,8 @@ class BPart(Peripheral):
     TEMPERATURE_SENSOR_UUID = '4b822f22-3941-4a4b-a3cc-b2602ffe0d00'
     ACCELERATION_SENSOR_UUID = '4b822f12-3941-4a4b-a3cc-b2602ffe0d00'
     LIGHT_SENSOR_UUID = '4b822f02-3941-4a4b-a3cc-b2602ffe0d00'
+
+    serviceUUIDs = [ serviceUUID(offset) for (name, offset) in SENSORS ]
     
 
     def __init__(self, deviceAddr):
@@ -59,113 +77,121 @@ class BPart(Peripheral):
         self._humidity = None
         self._acceleration = None
         self._temperature = None
+        # Monotonic time the first notification of the current set of values arrived
+        self._received = None
+
+        # Names (see bpcore.sensors.SENSORS) of the sensors switched off by a command
+        self.disabledSensors = set()
+        # Names of the sensors switched off until their next value is due (see bpcore/adaptive.py)
+        self.pausedSensors = set()
+        self.rate = AdaptiveRate(deviceAddr, config.ADAPTIVE, self.supervisor.expectedInterval)
+
+        # Called with a bpcore.samples.Sample for every complete set of values
+        self.uplink = self._sendSample
         
     def _serviceToHandle(self, hnd):
         '''
         Gets the service uuid which is associated with the given handle
         '''
         for service in self.services.values():
-            if int(hnd,16) >= int(service.hndStart,16) and int(hnd,16) <= int(service.hndEnd,16):
+            if hnd >= service.hndStart and hnd <= service.hndEnd:
                 return str(service.uuid)
 
     def _parseLight(self,data):
         '''
-        Parses the raw data (hexstring without spaces) to an int value.
+        Parses the raw data (byte string) to an int value.
         '''
-        temp = data.decode('hex')
-        return struct.unpack('<I',temp)[0]
+        return struct.unpack('<I',data[:4])[0]
 		
     def _parseTemperature(self,data):
         '''
-        Parses the raw data (hexstring without spaces) into the temperature in Celsius
+        Parses the raw data (byte string) into the temperature in Celsius
         '''
-        temp = data.decode('hex')
-        return (struct.unpack('<h',temp)[0] / 1000.0)
+        return (struct.unpack('<h',data[:2])[0] / 1000.0)
 
     def _parseHumidity(self, data):
         '''
-        Parses the raw data (hexstring without spaces).
+        Parses the raw data (byte string).
         '''
-        temp = data.decode('hex')
-        return struct.unpack('<H', temp)[0]
+        return struct.unpack('<H', data[:2])[0]
 
     def _parseAcceleration(self, data):
         '''
-        Parses the raw data (hexstring without spaces)
+        Parses the raw data (byte string)
         '''
-        temp = data.decode('hex')
-        (x,y,z) = struct.unpack('<hhh',temp)
+        (x,y,z) = struct.unpack('<hhh',data[:6])
         x = x / (1000.0 * 16)
         y = y / (1000.0 * 16)
         z = z / (1000.0 * 16)
         return (x,y,z)
         
-    def _handleNotification(self, notification):
+    def _handleNotification(self, handle, data, received):
         '''
         This function overwrites the abstract method in btle.Peripheral. It receives the notifications sent by the BPart,
         parses the data and sends the sensor values to CUMULUS.
+        The sample is stamped with the time its first notification was received.
         '''
-        splitted = notification.split(' ')
-        
-        svcuuid = self._serviceToHandle(splitted[3])
+        if self._received == None:
+            self._received = received
+        svcuuid = self._serviceToHandle(handle)
         
         # Decide which Service the data belongs to
         if svcuuid == BPart.TEMPERATURE_UUID:
             #Temperature data
-            temp = splitted[5] + splitted[6]
-            self._temperature = self._parseTemperature(temp)
+            self._temperature = self._parseTemperature(data)
             logging.debug(self.deviceAddr + ": Temperature = " + str(self._temperature))
+            self._adapt("Temperature", self._temperature, received)
         elif svcuuid == BPart.LIGHT_UUID:
             #Light data
-            temp = splitted[5] + splitted[6] + splitted[7] + splitted[8]
-            self._light = self._parseLight(temp)
+            self._light = self._parseLight(data)
             logging.debug(self.deviceAddr + ": Light = " + str(self._light))
+            self._adapt("Light", self._light, received)
         elif svcuuid == BPart.ACCELERATION_UUID:
             #Acceleration data
-            temp = splitted[5] + splitted[6] + splitted[7] + splitted[8] + splitted[9] + splitted[10]
-            self._acceleration = self._parseAcceleration(temp)
+            self._acceleration = self._parseAcceleration(data)
             logging.debug(self.deviceAddr + ": Acceleration= " + str(self._acceleration))
+            self._adapt("Acceleration", self._acceleration, received)
         elif svcuuid == BPart.HUMIDITY_UUID:
             #Humidity data
-            temp = splitted[5] + splitted[6]
-            self._humidity = self._parseHumidity(temp)
+            self._humidity = self._parseHumidity(data)
             logging.debug(self.deviceAddr + ": Humidity= " + str(self._humidity))
+            self._adapt("Humidity", self._humidity, received)
 
         # Only if all values have been received, send the data to cumulus
         if self._light and self._humidity and self._temperature and self._acceleration:
-            jsonString = self._createJSONString(self._temperature, self._humidity,self._light, self._acceleration)
-            logging.debug(self.deviceAddr + ": " + str(jsonString))
-            self._sendDataToCumulus(self.deviceAddr,jsonString)
+            fitted = self.drift.add(self._received)
+            received = fitted if config.TIMESTAMP_CORRECTION else self._received
+            self._received = None
+            sample = makeSample(self.deviceAddr, self._temperature, self._humidity, self._light, self._acceleration,
+                                timestamp=getClock().wallTime(received))
+            logging.debug(self.deviceAddr + ": " + str(sample))
+            self.uplink(sample)
             
-            #reset the temporary variables
-            self._light = None
-            self._humidity = None
-            self._temperature = None
-            self._acceleration = None
+            #reset the temporary variables, disabled and paused sensors don't notify and keep their last value
+            held = self.disabledSensors | self.pausedSensors
+            if "Light" not in held:
+                self._light = None
+            if "Humidity" not in held:
+                self._humidity = None
+            if "Temperature" not in held:
+                self._temperature = None
+            if "Acceleration" not in held:
+                self._acceleration = None
 
-    def _createJSONString(self, temperature, humidity, light,(x,y,z)):
+    def _adapt(self, name, value, received):
         '''
-        This method constructs a json string out of the data.
+        Pauses the sensor name until its next value is due once its values stopped changing.
+        Values that arrive before that (the pause is not in effect yet) are not counted.
         '''
-        jsonString = json.dumps({'data':{'Temperature':{'value':str(temperature), 'unit':'degC'},'Humidity':{'value':str(humidity), 'unit':'Percent'},'Light':{'value':str(light), 'unit':'Number'},'AccelX':{'value':str(x),'unit':'Number'},'AccelY':{'value':str(y),'unit':'Number'},'AccelZ':{'value':str(z),'unit':'Number'    }}})
-        return jsonString
+        if not self.rate.adaptive(name) or not self.rate.due(name, received):
+            return
+        interval = self.rate.update(name, value, received)
+        if interval > self.supervisor.expectedInterval:
+            self.command("pause", sensor=name)
+            self.command("resume", delay=interval - self.supervisor.expectedInterval, sensor=name)
 
-
-    def _sendDataToCumulus(self,mac,jsonString):
-        '''
-        This method sends the data to CUMULUS
-        '''
-        url = config.CUMULUS_URL+mac.replace(':','')
-        try:
-            logging.debug(self.deviceAddr + ": Created URL: {0}".format(url))
-            req = urllib2.Request(url, jsonString, {'Content-Type': 'application/x-www-form-urlencoded' })
-            req.get_method = lambda: 'PUT'
-            f = urllib2.urlopen(req)
-            response = f.read()
-            logging.debug(self.deviceAddr + ": CUMULUS Response: {0}\n".format(response))
-            f.close()
-        except urllib2.HTTPError as h:
-            logging.warning("Error while sending data to {0}: HTTP Error {1}: {2}".format(url,h.code,h.msg))
+    def _sendSample(self, sample):
+        sendSample(sample)
             
     def initialize(self):
         '''
@@ -173,76 +199,110 @@ class BPart(Peripheral):
         This method is called by the notification loop immediately after the connection has been established.
         At this time services and characteristics are already well known.
         '''
-        self.activateLightSensor()
-        self.activateHumiditySensor()
-        self.activateAccelerationSensor()
-        self.activateTemperatureSensor()
+        self.pausedSensors.clear()
+        for (name, offset) in SENSORS:
+            self.rate.forget(name)
+            self.setSensor(name, name not in self.disabledSensors)
         self.activateNotifications()
+
+    def setSensor(self, name, on):
+        '''
+        Switches the sensor name (see bpcore.sensors.SENSORS) on or off. While it is off
+        the samples carry its last value.
+        '''
+        if on:
+            self.disabledSensors.discard(name)
+            self.pausedSensors.discard(name)
+        else:
+            self.disabledSensors.add(name)
+        self._switchSensor(name, on)
+
+    def _switchSensor(self, name, on):
+        getattr(self, ("activate" if on else "deactivate") + name + "Sensor")()
+
+    def runCommand(self, requested, name, args):
+        if name in ("enable", "disable"):
+            self.setSensor(args["sensor"], name == "enable")
+        elif name == "pause":
+            # adaptive sampling, see _adapt()
+            sensor = args["sensor"]
+            if sensor not in self.disabledSensors and sensor not in self.pausedSensors:
+                self.pausedSensors.add(sensor)
+                self._switchSensor(sensor, False)
+                metrics.incr("adaptive.pauses", device=self.deviceAddr)
+        elif name == "resume":
+            sensor = args["sensor"]
+            if sensor in self.pausedSensors:
+                self.pausedSensors.discard(sensor)
+                if sensor not in self.disabledSensors:
+                    self._switchSensor(sensor, True)
+        else:
+            Peripheral.runCommand(self, requested, name, args)
             
             
     def activateLightSensor(self):
         lightSvc = self.getServiceByUUID(BPart.LIGHT_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.LIGHT_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
         
     def activateHumiditySensor(self):
         lightSvc = self.getServiceByUUID(BPart.HUMIDITY_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.HUMIDITY_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
         
     def activateAccelerationSensor(self):
         lightSvc = self.getServiceByUUID(BPart.ACCELERATION_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.ACCELERATION_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
        
     def activateTemperatureSensor(self):
         lightSvc = self.getServiceByUUID(BPart.TEMPERATURE_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.TEMPERATURE_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
         
     def deactivateLightSensor(self):
         lightSvc = self.getServiceByUUID(BPart.LIGHT_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.LIGHT_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
         
     def deactivateHumiditySensor(self):
         lightSvc = self.getServiceByUUID(BPart.HUMIDITY_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.HUMIDITY_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
         
     def deactivateAccelerationSensor(self):
         lightSvc = self.getServiceByUUID(BPart.ACCELERATION_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.ACCELERATION_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
        
     def deactivateTemperatureSensor(self):
         lightSvc = self.getServiceByUUID(BPart.TEMPERATURE_UUID)
         sensChr = lightSvc.getCharacteristics(BPart.TEMPERATURE_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
     
     
     
     def getLight(self):
         light_val = self.readCharacteristicByUUID(BPart.LIGHT_VALUE_UUID)
-        light_val = self._parseLight(light_val.replace(' ',''))
+        light_val = self._parseLight(light_val)
         # light_val is an int
         return light_val
       
     def getHumidity(self):
         humidity_val = self.readCharacteristicByUUID(BPart.HUMIDITY_VALUE_UUID)
-        humidity_val = self._parseHumidity(humidity_val.replace(' ',''))
+        humidity_val = self._parseHumidity(humidity_val)
         # humidity_val is an int value
         return humidity_val
       
     def getTemperature(self):
         temperature_val = self.readCharacteristicByUUID(BPart.TEMPERATURE_VALUE_UUID)
-        temperature_val = self._parseTemperature(temperature_val.replace(' ',''))
+        temperature_val = self._parseTemperature(temperature_val)
         # temperature_val is a double (Celsius)
         return temperature_val
       
     def getAcceleration(self):
         acceleration_val = self.readCharacteristicByUUID(BPart.ACCELERATION_VALUE_UUID)
-        acceleration_val = self._parseAcceleration(acceleration_val.replace(' ',''))
+        acceleration_val = self._parseAcceleration(acceleration_val)
         # acceleration_val is a tuple (double x, double y, double z)
         return acceleration_val
         
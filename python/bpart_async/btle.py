@@ -9,152 +9,88 @@
 # @email: strunk@teco.edu, berning@teco.edu
 # @date: 2014/05/23
 
+'''
+BLE access for the async client.
+
+The GATT model lives in bpcore.gatt; the transport backend is selected by
+config.BACKEND. Peripheral adds the connection and notification loop the
+BPart threads run in.
+'''
+
+import sys, os
 import time
+import heapq
 import random
-import binascii
-import pexpect
-from threading import Thread
+from threading import Thread, Event
+from Queue import Queue
 import logging
 
+import config
+
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), os.pardir))
+from bpcore import gatt, transport, adapters, startup, control, ingest
+from bpcore.clock import getClock, DriftEstimator
+from bpcore.gatt import BTLEException, UUID, Service, Characteristic, Descriptor
+from bpcore.supervisor import ConnectionSupervisor
+
 #Currently not used
 SEC_LEVEL_LOW    = "low"
 SEC_LEVEL_MEDIUM = "medium"
 SEC_LEVEL_HIGH   = "high"
 
- 
-class BTLEException(Exception):
-    DISCONNECTED = 1
-    COMM_ERROR = 2
-    INTERNAL_ERROR = 3
-    
-    def __init__(self, code, message):
-        self.code = code
-        self.message = message
-
-    def __str__(self):
-        return self.message
-
-
-class UUID:
-    def __init__(self, val):
-        '''We accept: 32-digit hex strings, with and without '-' characters,
-           4 to 8 digit hex strings, and integers''' 
-        if isinstance(val,int) or isinstance(val,long):
-            if (val < 0) or (val > 0xFFFFFFFF):
-                raise ValueError("Short form UUIDs must be in range 0..0xFFFFFFFF")
-            val = "%04X" % val
-        else:
-            val = str(val) # Do our best
-
-        val = val.replace("-","") 
-        if len(val) <= 8: # Short form 
-            val = ("0" * (8-len(val))) + val +"00001000800000805F9B34FB"
-
-        self.binVal = binascii.a2b_hex(val) 
-        if len(self.binVal) != 16:
-            raise ValueError("UUID must be 16 bytes, got '%s'" % val)
-
-    def __str__(self):
-        s = binascii.b2a_hex(self.binVal)
-        return "-".join([ s[0:8], s[8:12], s[12:16], s[16:20], s[20:32] ])
-
-    def __cmp__(self, other):
-        return cmp(str(self), str(other))
-
-    def __hash__(self):
-        return hash(str(self))
-
-    def friendlyName(self):
-        #TODO
-        return str(self)
+CCCD_UUID = UUID(0x2902)
+DEVICE_NAME_UUID = UUID(0x2A00)
+PROP_READ = 0x02
+PROP_NOTIFY = 0x10
+PROP_INDICATE = 0x20
 
-class Service:
-    def __init__(self, *args):
-        (self.peripheral, uuidVal, self.hndStart, self.hndEnd) = args
-        self.uuid = UUID(uuidVal)
-        self.chars = None
 
-   
-    def getCharacteristics(self, forUUID=None):
-        if not self.chars: # Unset, or empty
-            self.chars = self.peripheral.getCharacteristics(self.hndStart, self.hndEnd)
-        # Get Characteristic which corresponds with the UUID 
-        if forUUID != None:
-            u = UUID(forUUID)
-            return [ ch for ch in self.chars if ch.uuid==u ]
-        return self.chars
-
-    def __str__(self):
-        return "Service <%s>" % (str(self.uuid))
-
-class Characteristic:
-    def __init__(self, *args):
-        (self.peripheral, uuidVal, self.handle, self.properties, self.valHandle) = args
-        self.uuid = UUID(uuidVal)
-
-    def read(self):
-        return self.peripheral.readCharacteristic(self.valHandle)
-
-    def write(self,val):
-        self.peripheral.writeCharacteristic(self.valHandle,val)
-
-
-    def __str__(self):
-        return "Characteristic <%s>" % (self.uuid)
-
-
-class Peripheral(Thread):
+class Peripheral(ingest.IngestMixIn, Thread, gatt.Peripheral):
     '''
     This is an abstract class. It represents a bluetooth low energy device.
-    It uses the gatttool utility.
+    It uses the transport backend selected by config.BACKEND.
     '''
 
     INITIALIZING=0
     INITIALIZED=1
-    
+
+    # UUIDs of the services the class uses; with config.DISCOVERY = "targeted" only those are discovered.
+    # None needs all of them
+    serviceUUIDs = None
+
 
     def __init__(self, deviceAddr):
         Thread.__init__(self)
-        self._helper = None
-        self.services = {} # Indexed by UUID
-        self.discoveredAllServices = False
+        gatt.Peripheral.__init__(self, transport.getTransport(config.BACKEND, iface=config.IFACE, capture=config.CAPTURE, **config.BACKEND_OPTIONS))
         self.running = True
+        self._stopped = Event() # set with running = False, ends _sleep()
         self.initializingStatus = Peripheral.INITIALIZING
         self.connected = False
         if len( deviceAddr.split(":") ) != 6:
-            raise ValueError("Expected MAC address, got %s", repr(addr))
+            raise ValueError("Expected MAC address, got %s" % repr(deviceAddr))
         else:
             self.deviceAddr = deviceAddr
-            
-        self.notificationHandles = []
-        
-
-
-    def _startHelper(self):
-        # starts an external process which runs gatttool
-        if self._helper == None:
-            self._helper = pexpect.spawn('gatttool -I') 
-
-    def _stopHelper(self):
-        # ends the externel process
-        if self._helper != None:
-            self._helper.sendline('exit')
-            self._helper = None
-
-    def _writeCmd(self, cmd):
-        # send a command to gatttool
-        if self._helper == None:
-            raise BTLEException(BTLEException.INTERNAL_ERROR, "Helper not started (did you call connect()?)")
-        self._helper.sendline(cmd)
 
+        self.notificationHandles = []
+        self.probeHandle = None
+        self.supervisor = ConnectionSupervisor(self.deviceAddr,
+            config.NOTIFICATION_INTERVALS.get(self.deviceAddr, config.NOTIFICATION_INTERVAL),
+            probe=self._probe, silenceFactor=config.SILENCE_FACTOR,
+            reconnectBudget=config.RECONNECT_BUDGET, reconnectWindow=config.RECONNECT_WINDOW)
+        # Notification timing of the device, see bpcore/clock.py
+        self.drift = DriftEstimator(self.deviceAddr, self.supervisor.expectedInterval)
+        # bpcore.startup.StartupOrchestrator gating the connects, set by whoever starts the devices
+        self.startup = None
+        self.discoveryCached = False
+        # (time requested, name, args, due) of the commands to run, see bpcore/control.py
+        self.commands = Queue()
+        # heap of the commands due later, only touched by the device thread
+        self._scheduled = []
+        self.connectedSince = None
+        # Notifications are processed from a bpcore.ingest.RingQueue, see _ingest()
+        self._setupIngest(config.PROCESSING_THREADS, config.NOTIFICATION_QUEUE, config.QUEUE_OVERFLOW,
+                          config.DEVICE_WEIGHTS.get(self.deviceAddr, 1))
 
-    def _getResp(self, wantType, tout=3):
-        # get a response from gatttool. wantType can be either a string or a regular expression (also as string)
-        # expect() returns when either exactly the same string or a string corresponding to the regular expression
-        # has been received from gatttool
-        self._helper.expect(wantType, timeout=tout)
-        after = self._helper.after
-        return after
 
     def initialize(self):
         '''
@@ -168,59 +104,178 @@ class Peripheral(Thread):
     def connect(self):
         '''
         Connects to the device.
+        Services, characteristics and notification handles are discovered
+        over the new connection the first time.
         '''
-        # Discover services and characteristics
-        services = self.getServices()
-        for service in services:
-            service.getCharacteristics()
-        self._getNotificationHandles()
-        
-        
-        self._startHelper()
-        self._writeCmd('connect %s\n' % self.deviceAddr)
+        scheduler = adapters.getScheduler(config.IFACES, config.ADAPTER_CAPACITY)
+        if scheduler != None:
+            iface = scheduler.acquire(self.deviceAddr)
+            if iface != self.transport.iface:
+                self.transport = transport.getTransport(config.BACKEND, iface=iface, capture=config.CAPTURE, **config.BACKEND_OPTIONS)
+            try:
+                gatt.Peripheral.connect(self, self.deviceAddr)
+            except BTLEException:
+                scheduler.connectFailed(self.deviceAddr)
+                raise
+            scheduler.connected(self.deviceAddr)
+        else:
+            gatt.Peripheral.connect(self, self.deviceAddr)
         try:
-            self._getResp('Connection successful', tout=5)
-            logging.info('Connected to %s' %self.deviceAddr)
-            self.connected = True
-        except pexpect.TIMEOUT:
-            self._stopHelper()
-            raise BTLEException(BTLEException.DISCONNECTED, "Failed to connect to peripheral")
+            self._discover()
+        except BTLEException:
+            self._closeConnection()
+            raise
+        logging.info('Connected to %s on %s' % (self.deviceAddr, self.transport.iface or "default adapter"))
+        self.connected = True
+
+    def _discover(self):
+        '''
+        Discovers services, characteristics and handles. The first time they
+        are taken from config.DISCOVERY_CACHE if the device is in there.
+        '''
+        cache = startup.getDiscoveryCache(config.DISCOVERY_CACHE)
+        if not self.discoveredAllServices and cache != None:
+            entry = cache.get(self.deviceAddr)
+            if entry:
+                self._restoreDiscovery(entry)
+                self.discoveryCached = True
+                return
+        fresh = not self.services
+        if fresh:
+            if config.DISCOVERY == "targeted" and self.serviceUUIDs != None:
+                self.discoverServicesByUUID(self.serviceUUIDs)
+            else:
+                self.discoverServices()
+        self.discoverAllCharacteristics()
+        self._getNotificationHandles()
+        self._getProbeHandle()
+        if fresh and cache != None:
+            cache.put(self.deviceAddr, self._discoveryEntry())
+
+    def _discoveryEntry(self):
+        return {"services": [ [s.hndStart, s.hndEnd, str(s.uuid),
+                               [ [c.handle, c.properties, c.valHandle, str(c.uuid)] for c in s.getCharacteristics() ]]
+                              for s in self.services.values() ],
+                "complete": self.discoveredAllServices,
+                "notificationHandles": self.notificationHandles,
+                "probeHandle": self.probeHandle}
+
+    def _restoreDiscovery(self, entry):
+        self.services = {}
+        for (start, end, uuid, chars) in entry["services"]:
+            svc = Service(self, uuid, start, end)
+            svc.chars = [ Characteristic(self, u, hnd, props, vhnd) for (hnd, props, vhnd, u) in chars ]
+            self.services[svc.uuid] = svc
+        self.discoveredAllServices = entry.get("complete", True)
+        self.notificationHandles = list(entry["notificationHandles"])
+        self.probeHandle = entry["probeHandle"]
+
+    def _forgetDiscovery(self):
+        # The cached discovery did not work out, discover again on the next connect
+        startup.getDiscoveryCache(config.DISCOVERY_CACHE).drop(self.deviceAddr)
+        self.services = {}
+        self.discoveredAllServices = False
+        self.notificationHandles = []
+        self.probeHandle = None
+        self.discoveryCached = False
+
+    def stop(self):
+        '''
+        Asks the device thread to stop; it disables the notifications and
+        disconnects on its way out. Use join() to wait for that.
+        '''
+        self.running = False
+        self._stopped.set()
+        self.transport.interrupt()
+        self._closeIngest()
 
     def disconnect(self):
         '''
         Disconnects from the device.
         '''
-        
+
         self.running=False #stop the thread
+        self._stopped.set()
         self.connected = False
-        if self._helper==None:
+        if not self.transport.isConnected():
             return
 
-        self._writeCmd("disconnect")
+        self._closeConnection()
         logging.info('Disconnected from %s' %self.deviceAddr)
-        self._stopHelper()
 
-    
+    def _closeConnection(self):
+        # Closes the connection and gives its adapter slot back, the thread keeps running
+        gatt.Peripheral.disconnect(self)
+        scheduler = adapters.getScheduler(config.IFACES, config.ADAPTER_CAPACITY)
+        if scheduler != None:
+            scheduler.release(self.deviceAddr)
+
+
     def _getNotificationHandles(self):
         '''
-        Get all notification handles which can be used to activate notifications.
-        Must be run before connect().
+        Get all notification handles (client characteristic configuration
+        descriptors) which can be used to activate notifications.
+        '''
+        if self.notificationHandles:
+            return
+        if self.discoveredAllServices:
+            ranges = [ (1, 0xFFFF) ]
+        else:
+            ranges = self._descriptorRanges()
+        futures = [ self.submit("discoverDescriptors", start, end) for (start, end) in ranges ]
+        for future in futures:
+            for (hnd, u) in future.result():
+                if UUID(u) == CCCD_UUID:
+                    self.notificationHandles.append(hnd)
+
+
+    def _descriptorRanges(self):
+        # Targeted discovery: the handles between the value of every notifying characteristic
+        # of the services in use and the next characteristic, where its descriptors are
+        ranges = []
+        for svc in self.services.values():
+            chars = sorted(svc.getCharacteristics(), key=lambda c: c.handle)
+            ends = [ c.handle - 1 for c in chars[1:] ] + [ svc.hndEnd ]
+            for (c, end) in zip(chars, ends):
+                if c.properties & (PROP_NOTIFY | PROP_INDICATE) and c.valHandle < end:
+                    ranges.append((c.valHandle + 1, end))
+        return sorted(ranges)
+
+    def _getProbeHandle(self):
+        '''
+        Picks a readable characteristic to check the link with, preferably
+        the device name.
+        '''
+        if self.probeHandle != None:
+            return
+        readable = [ c for s in self.services.values() for c in s.getCharacteristics() if c.properties & PROP_READ ]
+        for c in readable:
+            if c.uuid == DEVICE_NAME_UUID:
+                self.probeHandle = c.valHandle
+                return
+        if readable:
+            self.probeHandle = readable[0].valHandle
+
+    def _probe(self):
+        '''
+        Cheap read used by the supervisor to tell a quiet device from a lost one.
         '''
-        handles = pexpect.run("gatttool --char-read --uuid=0x2902 -b " + self.deviceAddr)
-        handles = handles.splitlines()
-        for line in handles:
-          self.notificationHandles.append(line.split(' ')[1])
-          
-         
+        if self.probeHandle == None:
+            raise BTLEException(BTLEException.DISCONNECTED, "Nothing to probe")
+        self.readCharacteristic(self.probeHandle)
+
+    def _sleep(self, seconds):
+        # sleeps, but wakes up as soon as the thread is stopped
+        self._stopped.wait(seconds)
+
     def activateNotifications(self):
         '''
         Activates notifications for all notification handles.
         Must be run after _getNotificationHandles.
         '''
         for notHnd in self.notificationHandles:
-            self._writeCmd('char-write-req {0} 0100'.format(notHnd))
-            self._getResp('Characteristic value was written successfully')
-                
+            self.writeCharacteristic(notHnd, '\x01\x00', True)
+
 
     def deactivateNotifications(self):
         '''
@@ -228,179 +283,136 @@ class Peripheral(Thread):
         Must be run after _getNotificationHandles.
         '''
         for notHnd in self.notificationHandles:
-            self._writeCmd('char-write-req {0} 0100'.format(notHnd))
-            self._getResp('Characteristic value was written successfully')
-        
+            self.writeCharacteristic(notHnd, '\x00\x00', True)
+
+
+    def command(self, name, delay=0, **args):
+        '''
+        Queues a command (see bpcore/control.py); the device thread runs it once the device is connected,
+        at the earliest delay seconds from now.
+        '''
+        now = time.time()
+        self.commands.put((now, name, args, now + delay if delay else None))
 
-    def _handleNotification(self, notification):
+    def runCommand(self, requested, name, args):
+        '''
+        Runs a command in the device thread. Child classes can add commands.
+        '''
+        if name == "reconnect":
+            # requests made before the current connection are done already
+            if self.connectedSince < requested:
+                raise BTLEException(BTLEException.DISCONNECTED, "Reconnect requested")
+        else:
+            logging.warning("%s: Unknown command %s" % (self.deviceAddr, repr(name)))
+
+    def _runCommands(self):
+        while not self.commands.empty():
+            (requested, name, args, due) = self.commands.get()
+            if due != None:
+                heapq.heappush(self._scheduled, (due, requested, name, args))
+            else:
+                self.runCommand(requested, name, args)
+        now = time.time()
+        while self._scheduled and self._scheduled[0][0] <= now:
+            (due, requested, name, args) = heapq.heappop(self._scheduled)
+            self.runCommand(requested, name, args)
+
+    def _commandsDue(self):
+        # Seconds until the next scheduled command, None if there is none
+        if not self._scheduled:
+            return None
+        return max(self._scheduled[0][0] - time.time(), 0)
+
+    def _handleNotification(self, handle, data, received):
         '''
-        Abstract. Must be implemented by child classes. notification contains the complete notification message as string.
-        Example for notification: "Notification handle = 0x0019 value: 00 00 00 ff 00 43"
+        Abstract. Must be implemented by child classes. handle is the value handle (int)
+        the notification was sent for, data the raw value (byte string), received the
+        monotonic time it arrived (bpcore.clock).
         '''
         raise NotImplementedError('Child classes have to implement this method to handle notifications')
-            
+
     def run(self):
-        
+        control.getStatus().setState(self.deviceAddr, control.CONNECTING)
+
         while self.running:
             '''
             Main loop
             '''
-            while not self.connected:
+            while not self.connected and self.running:
                 # try to connect to the device
                 try:
-                    #services = self.getServices()
-                    #for service in services:
-                    #    service.getCharacteristics()
-                    #self._getNotificationHandles()
-                    self.connect()
-                except pexpect.EOF:
-                    return
-                except BTLEException:
+                    if self.startup != None:
+                        with self.startup.connecting(self.deviceAddr):
+                            if not self.running:
+                                break # stopped while waiting for the slot
+                            self.connect()
+                    else:
+                        self.connect()
+                    self.supervisor.connected()
+                    self.drift.reset()
+                except BTLEException as e:
                     logging.info(self.deviceAddr + ': Could not connect')
+                    control.getStatus().setState(self.deviceAddr, control.DISCONNECTED, str(e))
                     self.connected = False
-                    time.sleep(random.random())
+                    self._sleep(random.random() + self.supervisor.reconnectDelay())
 
-            while self.initializingStatus == Peripheral.INITIALIZING:
+            while self.initializingStatus == Peripheral.INITIALIZING and self.connected:
                 # initialize the device
                 try:
                     self.initialize()
                     self.initializingStatus = Peripheral.INITIALIZED
-                except pexpect.EOF:
-                    return
-                except pexpect.TIMEOUT:
+                    self.connectedSince = time.time()
+                    control.getStatus().setState(self.deviceAddr, control.CONNECTED)
+                    if self.startup != None:
+                        self.startup.ready(self.deviceAddr)
+                except BTLEException:
                     self.connected = False
+                    self._closeConnection()
                     logging.info(self.deviceAddr + ': Connection lost while initializing')
+                    if self.discoveryCached:
+                        self._forgetDiscovery()
 
-            if self.initializingStatus == Peripheral.INITIALIZED:
+            if self.initializingStatus == Peripheral.INITIALIZED and self.connected:
                 try:
-                    notification = self._getResp('Notification handle = .*? \r',9)
-                    self._handleNotification(notification)
-                except pexpect.TIMEOUT:
+                    self._runCommands()
+                    timeout = self.supervisor.timeout()
+                    due = self._commandsDue()
+                    notification = self.waitForNotification(timeout if due == None else min(timeout, due))
+                    received = getClock().now()
+                    if notification == None:
+                        if not self.running:
+                            break # interrupted by stop(), not a silent device
+                        if due != None and due < timeout:
+                            continue # woke up for a scheduled command, not because the device went quiet
+                        # Quiet for too long, only reconnect if the device doesn't answer either
+                        if self.supervisor.isAlive():
+                            continue
+                        raise BTLEException(BTLEException.DISCONNECTED, "No notifications and probe failed")
+                    self.supervisor.notified()
+                    (handle, data) = notification
+                    self._ingest(handle, data, received)
+                except BTLEException as e:
                     self.connected = False
                     self.initializingStatus = Peripheral.INITIALIZING
-                    logging.debug(self.deviceAddr + ": Timeout during notification loop")
+                    self._closeConnection()
+                    control.getStatus().setState(self.deviceAddr, control.DISCONNECTED, str(e))
+                    logging.debug(self.deviceAddr + ": " + str(e))
                     logging.info(self.deviceAddr + ': Connection lost')
-                except pexpect.EOF:
-                    logging.debug(self.deviceAddr + ": Helper has exited during notification loop")
-                    return
+                    self._sleep(self.supervisor.reconnectDelay())
 
-    
+        self._closeIngest()
+        self._shutdown()
 
-    def discoverServices(self):
-        '''
-        Discover all the services.
-        Must be run befor calling connect()
-        '''
-        services = pexpect.run("gatttool --primary -b " + self.deviceAddr)
-        logging.debug(self.deviceAddr + ": Services \n" + services)
-        services = services.replace(',','')
-        services = services.splitlines()
-
-        for service in services:
-            temp = service.split()
-            if len(temp) < 9:
-                raise BTLEException(BTLEException.INTERNAL_ERROR, "Error discovering devices")
-            self.services[temp[-1]] = Service(self, temp[-1], temp[3], temp[8])
-        self.discoveredAllServices = True
-        
-    def getServices(self):
-        '''
-        Gets the services
-        '''
-        if not self.discoveredAllServices:
-            self.discoverServices()
-        return self.services.values()
-
-    def getServiceByUUID(self,uuidVal):
-        uuid=UUID(uuidVal)
-        return self.services[uuid]
-
-
-    def getCharacteristics(self,startHnd=1,endHnd=0xFFFF):
-        '''
-        Gets the characteristics. Must be run befor calling connect()
-        '''
-        charStr = pexpect.run("gatttool --characteristics -s {0} -e {1} -b {2}".format(startHnd,endHnd,self.deviceAddr))
-        if not 'Discover all characteristics failed:' in charStr:
-            charStr = charStr.replace(',','')
-            charStr = charStr.splitlines()
-            chars = []
-            for char in charStr:
-                temp = char.split()
-                chars.append(Characteristic(self, temp[-1], temp[2], temp[6], temp[11]))
-            return chars
-        else:
-            raise BTLEException(BTLEException.DISCONNECTED, "Failed to get characteristics")
-
-
-    def readCharacteristic(self,handle):
-        '''
-        Reads the characteristic value described by handle.
-        Return format: 'xx xx xx ...' (x are hex values)
-        '''
-        try:
-        
-            self._writeCmd('char-read-hnd {0:0>4x}'.format(handle))
-            resp = self._getResp('Characteristic value/descriptor: .*? \r')
-            strVal = resp.replace('Characteristic value/descriptor: ','').strip()
-            return strVal
-        except pexpect.TIMEOUT:
-            self.connected = False
-            logging.debug(self.deviceAddr + ": Could not read Characteristic value")
-        except pexpect.EOF:
-            logging.debug(self.deviceAddr + ": Could not read Characteristic value, Helper has exited")
-
-
-    def readCharacteristicByUUID(self,uuid):
-        '''
-        Reads the characteristic value described by UUID.
-        Return format: 'xx xx xx ...' (x are hex values)
-        '''
-        try:
-            self._writeCmd('char-read-uuid {0}'.format(str(UUID(uuid))))
-            resp = self._getResp('handle: .*? \r')
-            strVal = resp.split(' ')
-            strVal = ' '.join(strVal[4:-1])
-            return strVal
-        except pexpect.TIMEOUT:
-            self.connected = False
-            logging.debug(self.deviceAddr + ": Could not read Characteristic value")
-        except pexpect.EOF:
-            logging.debug(self.deviceAddr + ": Could not read Characteristic value, Helper has exited")
-    
-
-    def writeCharacteristic(self,handle,val):
-        '''
-        Writes the characteristic value described by handle.
-        '''
+    def _shutdown(self):
+        # Leaves the device the way a new connection expects it: no notifications, not connected
+        if not self.connected or not self.transport.isConnected():
+            return
         try:
-            self._writeCmd('char-write-req {0:0>4x} {1}'.format(int(handle,16),val))
-            self._getResp('Characteristic value was written successfully')
-        except pexpect.TIMEOUT:
-            self.connected = False
-            logging.debug(self.deviceAddr + ": Could not write Characteristic value")
-        except pexpect.EOF:
-            logging.debug(self.deviceAddr + ": Could not write Characteristic value, Helper has exited")
-
-    def __del__(self):
-        self.disconnect()
-    
-    #The following functions can not be used, they still have to be modified to use gatttool 
-    # =================================================================================================
-    def getDescriptors(self,startHnd=1,endHnd=0xFFFF):
-        raise NotImplementedError('To be implemented in the future')
-        self._writeCmd("desc %X %X\n" % (startHnd, endHnd) )
-        resp = self._getResp('desc')
-        nDesc = len(resp['hnd'])
-        return [ Descriptor(self, resp['uuid'][i], resp['hnd'][i]) for i in range(nDesc) ]
-    
-    def setSecurityLevel(self,level):
-        raise NotImplementedError('To be implemented in the future')
-        self._writeCmd("secu %s\n" % level)
-        return self._getResp('stat')
-    
-    def setMTU(self,mtu):
-        raise NotImplementedError('To be implemented in the future')
-        self._writeCmd("mtu %x\n" % mtu)
-        return self._getResp('stat')
-    # ===================================================================================================
+            if self.initializingStatus == Peripheral.INITIALIZED:
+                self.deactivateNotifications()
+        except BTLEException as e:
+            logging.debug("%s: Could not disable notifications: %s" % (self.deviceAddr, e))
+        self.connected = False
+        self._closeConnection()
+        control.getStatus().setState(self.deviceAddr, control.DISCONNECTED, "Stopped")
+        logging.info('Disconnected from %s' % self.deviceAddr)
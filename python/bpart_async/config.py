@@ -19,9 +19,129 @@ LOGFILE = "bpart.log"
 LOGLEVEL = logging.DEBUG # must be one of the loglevels provided by the logging module
 #LOGLEVEL = logging.INFO
 
+#How to talk to the bparts (see bpcore/transport.py):
+#"gatttool" drives gatttool -I, "helper" runs bluepy-helper (see bpart_sync),
+#"att" speaks ATT directly over an L2CAP socket (Linux only, needs CAP_NET_ADMIN or root),
+#"sim" connects to simulated bparts, "replay" plays back a capture (see CAPTURE)
+BACKEND = "gatttool"
+BACKEND_OPTIONS = {} # extra arguments for the backend, e.g. {"addrType": "random"} for "att"
+
+#Records all BLE traffic into this file (see bpcore/capture.py), None records nothing.
+#Replay a capture with BACKEND = "replay", BACKEND_OPTIONS = {"path": ..., "speed": 1.0} (0 is as fast as possible)
+CAPTURE = None
+
+IFACE = None # e.g. "hci1", None uses the default adapter
+#Spread the bparts over several adapters (see bpcore/adapters.py), overrides IFACE
+IFACES = [] # e.g. ["hci0", "hci1"]
+ADAPTER_CAPACITY = 5 # simultaneous connections per adapter, or a dict e.g. {"hci0": 7}
+
+#Connection supervision (see bpcore/supervisor.py)
+#Expected time in seconds between two notifications of a bpart, per device address
+NOTIFICATION_INTERVAL = 3
+NOTIFICATION_INTERVALS = {} # e.g. {"00:07:80:78:FA:5A": 10}
+#A bpart is probed with a read after SILENCE_FACTOR expected intervals without notification
+#and only reconnected if the read fails
+SILENCE_FACTOR = 3
+#At most RECONNECT_BUDGET reconnects per RECONNECT_WINDOW seconds, further ones are delayed
+RECONNECT_BUDGET = 5
+RECONNECT_WINDOW = 300
+#Samples are stamped when their first notification is received. With TIMESTAMP_CORRECTION the reception times
+#are fitted against the notification period of the device (see bpcore/clock.py), which removes the reception jitter
+#but shifts the timestamps by up to the jitter. The measured period, drift and jitter are in the gauges device.period,
+#device.drift_ppm and device.jitter either way
+TIMESTAMP_CORRECTION = False
+#Adaptive sampling (see bpcore/adaptive.py): sensors whose values stay within a threshold are switched off between
+#two values, down to one value every "slow" seconds, and notify normally again as soon as they change.
+#None keeps all sensors notifying, e.g. {"Acceleration": {"threshold": 0.05}, "Temperature": {"threshold": 0.2, "slow": 120}}
+ADAPTIVE = None
+
+#How the values are collected: "connect" keeps a connection to every bpart,
+#"advertising" only listens to their advertisements (see bpcore/adverts.py), without connections
+INGESTION = "connect"
+#Where advertisements come from: {"type": "hcidump", "iface": "hci0"}, {"type": "file", "path": ...} or {"type": "sim"}
+SCANNER = {"type": "hcidump", "iface": "hci0"}
+#Names of the advertisement decoders to try (registered in bpcore.adverts), None tries all
+ADVERT_DECODERS = None
+#At most one sample per device and this many seconds
+ADVERT_MIN_INTERVAL = 1.0
+
+#Notifications are processed in the device threads. With PROCESSING_THREADS > 0 they are put into a bounded queue per
+#device instead and processed by that many threads taking turns between the devices (see bpcore/ingest.py), so a chatty
+#device can't starve the others
+PROCESSING_THREADS = 0
+#Notifications queued per device, and what happens when the queue is full: "drop-oldest", "drop-newest" or "block"
+#(the device thread waits)
+NOTIFICATION_QUEUE = 64
+QUEUE_OVERFLOW = "drop-oldest"
+#Notifications processed in a row per turn, per device address, default 1
+DEVICE_WEIGHTS = {} # e.g. {"00:07:80:78:FA:5A": 2}
+
+#Number of worker processes the bparts are split over (see bpcore/workers.py),
+#0 runs everything in one process, None starts one worker per core
+WORKERS = 0
+
+#At most this many devices connect (and discover) at the same time, 0 means no limit
+CONNECT_CONCURRENCY = 4
+#Seconds between the start of two connects
+CONNECT_STAGGER = 0.2
+#Discovered services and handles of every device are kept in this file so that restarts skip discovery,
+#e.g. "discovery.json" (relative to the working directory). None discovers them on every connect
+DISCOVERY_CACHE = None
+#"full" discovers all services of a device. "targeted" only discovers the services of the sensors (and their
+#characteristics and descriptors), which shortens connecting
+DISCOVERY = "full"
+
 CUMULUS_URL = 'http://cumulus.teco.edu:52001/data/'
 
+#Where the data is sent (see bpcore/sinks.py), every sink gets its own queue:
+#{"type": "http", "url": ..., "format": "json"} PUTs one CUMULUS document per sample to url + address,
+#    "format": "binary" POSTs batches as compact binary frames (see bpcore/binframe.py)
+#{"type": "mqtt", "host": ..., "port": 1883, "topic": "bpart/{device}"} publishes to a broker
+#{"type": "file", "path": ...} appends JSON lines ("format": "binary" for frames)
+#{"type": "stdout"} prints the samples
+#Options for all sinks: "batch" samples per write, "interval" seconds a batch waits, "queue" samples kept while behind
+#"timestamp": True adds the time the sample was taken to CUMULUS documents (http/mqtt "json"), otherwise CUMULUS uses the time they arrive
+SINKS = [{"type": "http", "url": CUMULUS_URL, "format": "json"}]
+
+#Edge aggregation (see bpcore/aggregate.py): instead of every sample one record per device and window is sent,
+#with the window means as values and min/max/mean/rms of every value. None sends every sample.
+#{"window": 60} tumbling windows of 60 seconds, {"window": 60, "step": 10} every 10 seconds the last 60 seconds,
+#"events": {"accelMagnitude": 1.5, "temperature": {"above": 30, "below": 5}} flags windows crossing a threshold,
+#"lateness": 1.0 seconds a window stays open after its end for samples still on their way
+AGGREGATION = None
+
+#Deadband filtering (see bpcore/deadband.py): a sample is only sent if a value moved by more than its threshold since the
+#last one sent, or after "heartbeat" seconds without one; suppressed samples are counted in deadband.suppressed.
+#A threshold is absolute or {"absolute": ..., "relative": ...}, values without one pass on any change. None sends everything.
+#e.g. {"thresholds": {"temperature": 0.1, "humidity": 1, "light": {"relative": 0.05}, "acceleration": 0.05}, "heartbeat": 300}
+DEADBAND = None
+
+#Local control/query API (see bpcore/control.py): device state, latest values, history, metrics and commands.
+#{"port": 8081} serves HTTP on 127.0.0.1:8081 ("host" to change that), {"socket": "/tmp/bpart.sock"} on a Unix socket.
+#None doesn't start it
+CONTROL = None
+
+#Every sample is also written to this shared memory file for other processes on the gateway (see bpcore/bus.py),
+#e.g. "/dev/shm/bpart.bus"; read it with bpcore.bus.BusReader or python -m bpcore.bus. None doesn't write it
+SAMPLE_BUS = None
+#Samples kept on the bus, readers falling further behind miss the oldest
+SAMPLE_BUS_SLOTS = 1024
+
+#Seconds a shutdown (Enter, SIGTERM or SIGINT) may take: the devices disconnect, then the sinks write out
+#what is queued; whatever is left is spooled (see bpcore/shutdown.py)
+SHUTDOWN_TIMEOUT = 10.0
+#File keeping the samples the sinks could not send before the shutdown deadline, they are sent first
+#on the next start, e.g. "spool.pickle" (relative to the working directory). None drops them
+SPOOL = None
+
 #List of the addresses of the bparts to which you wish to connect
 #Must be in the format "xx:xx:xx:xx:xx:xx"
 DEVICES = ["00:07:80:78:F5:C3","00:07:80:78:FA:5A","00:07:80:78:F5:C9"]
 #DEVICES = ["00:07:80:78:FA:5A"]
+
+#File with the device list, one address per line (see bpcore/registry.py). It is created from DEVICES
+#if it doesn't exist, and devices added to or removed from it are connected/disconnected while the gateway runs.
+#None uses DEVICES only
+DEVICES_FILE = None
+#How often (seconds) DEVICES_FILE is checked for changes
+DEVICES_FILE_INTERVAL = 2.0
@@ -16,37 +16,176 @@ Then it receives notifications from the connected devices which are sending thei
 These values are then send to TecO's CUMULUS
 '''
 import config
-from bpart import BPart
+from bpart import BPart, sendSample
 import logging
+import time
+from threading import Thread, Lock
+from bpcore.sinks import getPipeline
+from bpcore.startup import StartupOrchestrator
+from bpcore.registry import DeviceRegistry, loadDevices
+from bpcore import control, ingest
+from bpcore.shutdown import Shutdown
+from bpcore.capture import closeWriters
 
 
-def startBParts(macs):
+def startBParts(macs, uplink=None, orchestrator=None):
 	'''
-	Start all BParts listed in config
+	Start all BParts listed in config.
+	If uplink is given the samples are passed to it instead of being sent to the sinks in config.SINKS.
+	At most config.CONNECT_CONCURRENCY of them connect at the same time, gated by orchestrator
+	(a new StartupOrchestrator for macs if None).
 	'''
+	if orchestrator == None:
+		orchestrator = StartupOrchestrator(macs, config.CONNECT_CONCURRENCY, config.CONNECT_STAGGER)
 	bpartList = []
 	for mac in macs:
 		bpart = BPart(mac)
+		bpart.startup = orchestrator
+		if uplink != None:
+			bpart.uplink = uplink
 		bpart.start()
 		bpartList.append(bpart)
 	return bpartList
 
-def stopBParts(bpartList):
+def stopBParts(bpartList, timeout=10.0):
 	'''
-	Disconnect from all the bparts
+	Disconnect from all the bparts. They disable their notifications and disconnect in their own threads,
+	those which did not manage to within timeout seconds are disconnected from here.
 	'''
 	for bpart in bpartList:
-		bpart.disconnect()
+		bpart.stop()
+	deadline = time.time() + timeout
+	for bpart in bpartList:
+		bpart.join(max(deadline - time.time(), 0))
+		if bpart.is_alive():
+			logging.warning("%s did not stop in time" % bpart.deviceAddr)
+			bpart.disconnect()
 
-if  __name__ == "__main__":
+class Fleet(object):
+	'''
+	The running bparts by address. Bparts can be added and removed while the others keep running
+	(see bpcore/registry.py).
+	'''
+
+	def __init__(self, macs, uplink=None):
+		self.uplink = uplink
+		# Bparts added later share its connect slots, but don't count towards the startup.* gauges
+		self.orchestrator = StartupOrchestrator(macs, config.CONNECT_CONCURRENCY, config.CONNECT_STAGGER)
+		self.bparts = dict(zip(macs, startBParts(macs, uplink, self.orchestrator)))
+		self._lock = Lock()
+
+	def add(self, mac):
+		with self._lock:
+			if mac not in self.bparts:
+				self.bparts[mac] = startBParts([mac], self.uplink, self.orchestrator)[0]
+
+	def remove(self, mac):
+		with self._lock:
+			bpart = self.bparts.pop(mac, None)
+		if bpart != None:
+			stopBParts([bpart])
+			control.getStatus().forget(mac)
+
+	def command(self, mac, name, **args):
+		'''
+		Queues a command of bpcore/control.py for mac, False if mac is not running.
+		'''
+		with self._lock:
+			bpart = self.bparts.get(mac)
+		if bpart == None:
+			return False
+		bpart.command(name, **args)
+		return True
+
+	def stop(self, timeout=10.0):
+		'''
+		Stops all bparts, then processes the notifications they queued.
+		'''
+		deadline = time.time() + timeout
+		with self._lock:
+			bparts = self.bparts.values()
+			self.bparts = {}
+		stopBParts(bparts, timeout)
+		ingest.stopScheduler(max(deadline - time.time(), 0))
+
+def runShard(macs, emit):
+	'''
+	Runs the bparts of one worker process (see bpcore/workers.py).
+	The samples are sent to the sinks in config.SINKS by the parent process.
+	'''
+	return Fleet(macs, emit)
+
+def startRegistry(fleet, devices):
+	'''
+	Applies changes of config.DEVICES_FILE to fleet while it runs; None if there is no such file.
+	'''
+	if not config.DEVICES_FILE:
+		return None
+	registry = DeviceRegistry(config.DEVICES_FILE, fleet, devices, config.DEVICES_FILE_INTERVAL)
+	registry.start()
+	return registry
+
+def stopRegistry(registry):
+	if registry != None:
+		registry.stop()
+
+def setupLogging():
 	# Empty logfile
 	with open(config.LOGFILE, 'w'):
 		pass
 
 	logging.basicConfig(format="%(asctime)s:%(levelname)s:%(message)s",filename=config.LOGFILE, level=config.LOGLEVEL)
-	
-	bparts = startBParts(config.DEVICES)
-	raw_input('--> Press any Button to exit')
-	stopBParts(bparts)
+
+def main():
+	devices = config.DEVICES
+	if config.DEVICES_FILE:
+		devices = loadDevices(config.DEVICES_FILE, config.DEVICES)
+
+	shutdown = Shutdown(config.SHUTDOWN_TIMEOUT)
+	shutdown.installSignalHandlers()
+
+	if config.INGESTION == "advertising":
+		# one scanner for all devices, no connections
+		from bpcore.adverts import AdvertIngestor, makeScanner
+		ingestor = AdvertIngestor(makeScanner(config.SCANNER), sendSample,
+			devices, config.ADVERT_DECODERS, config.ADVERT_MIN_INTERVAL)
+		ingestor.start()
+		server = control.startControl(config.CONTROL)
+		shutdown.add("control API", lambda timeout: control.stopControl(server))
+		shutdown.add("scanner", ingestor.stop)
+	elif config.WORKERS != 0:
+		# the sinks are only created once the workers have been forked
+		from bpcore.workers import WorkerPool
+		pool = WorkerPool(devices, runShard, sendSample, config.WORKERS)
+		pool.start()
+		poolThread = Thread(target=pool.run)
+		poolThread.start()
+		registry = startRegistry(pool, devices)
+		server = control.startControl(config.CONTROL, pool, pool.collectMetrics)
+		shutdown.add("control API", lambda timeout: control.stopControl(server))
+		shutdown.add("device registry", lambda timeout: stopRegistry(registry))
+		def stopPool(timeout):
+			pool.running = False
+			poolThread.join()
+			pool.stop(timeout)
+		shutdown.add("workers", stopPool)
+	else:
+		fleet = Fleet(devices)
+		registry = startRegistry(fleet, devices)
+		server = control.startControl(config.CONTROL, fleet)
+		shutdown.add("control API", lambda timeout: control.stopControl(server))
+		shutdown.add("device registry", lambda timeout: stopRegistry(registry))
+		shutdown.add("bparts", fleet.stop)
+	# Send what is still batched, spool the rest
+	shutdown.add("sinks", getPipeline(config.SINKS, config.AGGREGATION, config.SPOOL, config.DEADBAND).close)
+	shutdown.add("capture", lambda timeout: closeWriters())
+
+	shutdown.wait('--> Press any Button to exit')
+	shutdown.run()
+
+
+if  __name__ == "__main__":
+	setupLogging()
+	main()
 		
 
@@ -63,17 +63,15 @@ class SensorTag(Peripheral):
         Gets the service uuid which is associated with the given handle
         '''
         for service in self.services.values():
-            if int(hnd,16) >= int(service.hndStart,16) and int(hnd,16) <= int(service.hndEnd,16):
+            if hnd >= service.hndStart and hnd <= service.hndEnd:
                 return str(service.uuid)
 
     def _parseMagnetometer(self, data):
-        temp = data.decode('hex')
-        x_y_z = struct.unpack('<hhh', temp)
+        x_y_z = struct.unpack('<hhh', data)
         return tuple([ 1000.0 * (v/32768.0) for v in x_y_z ])
         
     def _parseBarometer(self, data,(c1,c2,sensPoly,offsPoly)):
-        temp = data.decode('hex')
-        (rawT, rawP) = struct.unpack('<hH', temp)
+        (rawT, rawP) = struct.unpack('<hH', data)
         temp = (c1 * rawT) + c2
         sens = calcPoly( sensPoly, float(rawT) )
         offs = calcPoly( offsPoly, float(rawT) )
@@ -81,21 +79,19 @@ class SensorTag(Peripheral):
         return (temp,pres)
         
     def _parseGyroscope(self,data):
-        temp = data.decode('hex')
-        x_y_z = struct.unpack('<hhh', temp)
+        x_y_z = struct.unpack('<hhh', data)
         return tuple([ 250.0 * (v/32768.0) for v in x_y_z ])
        
     def _parseTemperature(self,data):
         '''
-        Parses the raw data (hexstring without spaces) into the temperature in Celsius
+        Parses the raw data (byte string) into the temperature in Celsius
         '''
         
         Apoly = [1.0,      1.75e-3, -1.678e-5]
         Bpoly = [-2.94e-5, -5.7e-7,  4.63e-9]
         Cpoly = [0.0,      1.0,      13.4]
         
-        temp = data.decode('hex')
-        (rawVobj, rawTamb) = struct.unpack('<hh', temp)
+        (rawVobj, rawTamb) = struct.unpack('<hh', data)
         tAmb = rawTamb / 128.0
         Vobj = 1.5625e-7 * rawVobj
         
@@ -109,68 +105,58 @@ class SensorTag(Peripheral):
 
     def _parseHumidity(self, data):
         '''
-        Parses the raw data (hexstring without spaces).
+        Parses the raw data (byte string).
         '''
-        temp = data.decode('hex')
-        (rawT, rawH) = struct.unpack('<HH', temp)
+        (rawT, rawH) = struct.unpack('<HH', data)
         temp = -46.85 + 175.72 * (rawT / 65536.0)
         RH = -6.0 + 125.0 * ((rawH & 0xFFFC)/65536.0)
         return (temp, RH)
 
     def _parseAcceleration(self, data):
         '''
-        Parses the raw data (hexstring without spaces)
+        Parses the raw data (byte string)
         '''
-        temp = data.decode('hex')
-        x_y_z = struct.unpack('bbb', temp)
+        x_y_z = struct.unpack('bbb', data)
         return tuple([ (val/64.0) for val in x_y_z ])
         
-    def _handleNotification(self, notification):
+    def _handleNotification(self, handle, data):
         '''
         This function overwrites the abstract method in btle.Peripheral. It receives the notifications sent by the BPart,
         parses the data and sends the sensor values to CUMULUS.
         '''
-        splitted = notification.split(' ')
-        
-        svcuuid = self._serviceToHandle(splitted[3])
+        svcuuid = self._serviceToHandle(handle)
         svcuuid = svcuuid.upper()
 
         # Decide which Service the data belongs to
         if svcuuid == SensorTag.TEMPERATURE_UUID:
             #Temperature data
-            temp = ''.join(splitted[5:-1])
-            temperature = self._parseTemperature(temp)
+            temperature = self._parseTemperature(data)
             print self.deviceAddr + ": Temperature = " + str(temperature)
         elif svcuuid == SensorTag.MAGNETOMETER_UUID:
             #Magnetometer data
-            temp = ''.join(splitted[5:-1])
-            magnetometer = self._parseMagnetometer(temp)
+            magnetometer = self._parseMagnetometer(data)
             print self.deviceAddr + ": Magnetometer = " + str(magnetometer)
         elif svcuuid == SensorTag.ACCELERATION_UUID:
             #Acceleration data
-            temp = ''.join(splitted[5:-1])
-            acceleration = self._parseAcceleration(temp)
+            acceleration = self._parseAcceleration(data)
             print self.deviceAddr + ": Acceleration = " + str(acceleration)
         elif svcuuid == SensorTag.HUMIDITY_UUID:
             #Humidity data
-            temp = ''.join(splitted[5:-1])
-            humidity = self._parseHumidity(temp)
+            humidity = self._parseHumidity(data)
             print self.deviceAddr + ": Humidity = " + str(humidity)
         elif svcuuid == SensorTag.GYROSCOPE_UUID:
-            temp = ''.join(splitted[5:-1])
-            gyro = self._parseGyroscope(temp)
+            gyro = self._parseGyroscope(data)
             print self.deviceAddr + ": Gyroscope = " + str(gyro)
         elif svcuuid == SensorTag.BAROMETER_UUID:
-            temp = ''.join(splitted[5:-1])
-            print self.deviceAddr + ": Barometer = " + str(temp)
+            print self.deviceAddr + ": Barometer = " + data.encode('hex')
 
       
             
     def activateNotifications(self):
-        self.writeCharacteristic('0x0026','0100')
-        self.writeCharacteristic('0x002e','0100')
-        self.writeCharacteristic('0x0039','0100')
-        self.writeCharacteristic('0x0041','0100')
+        self.writeCharacteristic(0x0026,'\x01\x00',True)
+        self.writeCharacteristic(0x002e,'\x01\x00',True)
+        self.writeCharacteristic(0x0039,'\x01\x00',True)
+        self.writeCharacteristic(0x0041,'\x01\x00',True)
 
         print 'Notifications activated'
 
@@ -194,98 +180,98 @@ class SensorTag(Peripheral):
     def activateMagnetometerSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.MAGNETOMETER_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.MAGNETOMETER_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
         
     def activateHumiditySensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.HUMIDITY_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.HUMIDITY_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
         
     def activateAccelerationSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.ACCELERATION_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.ACCELERATION_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
        
     def activateTemperatureSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.TEMPERATURE_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.TEMPERATURE_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
         
     def activateBarometerSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.BAROMETER_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.BAROMETER_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
         
     def activateGyroscopeSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.GYROSCOPE_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.GYROSCOPE_SENSOR_UUID)[0]
-        sensChr.write('07')
+        sensChr.write('\x07', True)
     	
     def calibrateBarometer(self):
     	svc = self.getServiceByUUID(SensorTag.BAROMETER_UUID)
         sensChr = svc.getCharacteristics(SensorTag.BAROMETER_SENSOR_UUID)[0]
-        sensChr.write('01')
+        sensChr.write('\x01', True)
     
     def deactivateMagnetometerSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.MAGNETOMETER_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.MAGNETOMETER_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
         
     def deactivateHumiditySensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.HUMIDITY_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.HUMIDITY_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
         
     def deactivateAccelerationSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.ACCELERATION_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.ACCELERATION_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
        
     def deactivateTemperatureSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.TEMPERATURE_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.TEMPERATURE_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
         
     def deactivateBarometerSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.BAROMETER_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.BAROMETER_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
         
     def deactivateGyroscopeSensor(self):
         lightSvc = self.getServiceByUUID(SensorTag.GYROSCOPE_UUID)
         sensChr = lightSvc.getCharacteristics(SensorTag.GYROSCOPE_SENSOR_UUID)[0]
-        sensChr.write('00')
+        sensChr.write('\x00', True)
     
     
     def getMagnetometer(self):
         val = self.readCharacteristicByUUID(SensorTag.MAGNETOMETER_VALUE_UUID)
-        val = self._parseMagnetometer(val.replace(' ',''))
+        val = self._parseMagnetometer(val)
         return val
       
     def getHumidity(self):
         val = self.readCharacteristicByUUID(SensorTag.HUMIDITY_VALUE_UUID)
-        val = self._parseHumidity(val.replace(' ',''))
+        val = self._parseHumidity(val)
         return val
       
     def getTemperature(self):
         val = self.readCharacteristicByUUID(SensorTag.TEMPERATURE_VALUE_UUID)
-        val = self._parseTemperature(val.replace(' ',''))
+        val = self._parseTemperature(val)
         return val
       
     def getAcceleration(self):
         val = self.readCharacteristicByUUID(SensorTag.ACCELERATION_VALUE_UUID)
-        val = self._parseAcceleration(val.replace(' ',''))
+        val = self._parseAcceleration(val)
         return val
 
     def getBarometer(self):
         val = self.readCharacteristicByUUID(SensorTag.BAROMETER_VALUE_UUID)
         calib = self.getBarometerCalib()
-        val = self._parseBarometer(val.replace(' ',''), calib)
+        val = self._parseBarometer(val, calib)
         return val
         
     def getBarometerCalib(self):
     	calib = self.readCharacteristicByUUID(SensorTag.BAROMETER_CALIB_UUID)
-        (c1,c2,c3,c4,c5,c6,c7,c8) = struct.unpack("<HHHHhhhh", calib.replace(' ','').decode('hex'))
+        (c1,c2,c3,c4,c5,c6,c7,c8) = struct.unpack("<HHHHhhhh", calib)
         c1_s = c1/float(1 << 24)
         c2_s = c2/float(1 << 10)
         sensPoly = [ c3/1.0, c4/float(1 << 17), c5/float(1<<34) ]
@@ -294,7 +280,7 @@ class SensorTag(Peripheral):
 
     def getGyroscope(self):
         val = self.readCharacteristicByUUID(SensorTag.GYROSCOPE_VALUE_UUID)
-        val = self._parseGyroscope(val.replace(' ',''))
+        val = self._parseGyroscope(val)
         return val
         
 
@@ -3,9 +3,9 @@ This module encapsulates the access to the TecO bparts.
 
 '''
 
-from btle import UUID, Peripheral
+import config
+from btle import UUID, Peripheral, BTLEException
 import struct
-import subprocess
 
 
 def _bpart_UUID(val):
@@ -30,7 +30,16 @@ class SensorBase(object):
 
 
 	def read(self):
-		return self.data.read()
+		return self.parse(self.data.read())
+
+	def parse(self, rawdata):
+		return rawdata
+
+	def switch(self, on):
+		'''
+		Switches the sensor on or off.
+		'''
+		self.service.getCharacteristics(self.configUUID)[0].write('\x01' if on else '\x00', True)
 
 
 class BPartTemperatureSensor(SensorBase):
@@ -41,15 +50,15 @@ class BPartTemperatureSensor(SensorBase):
 	
 	svcUUID = _bpart_UUID(0xF20)
 	dataUUID = _bpart_UUID(0xF21)
+	configUUID = _bpart_UUID(0xF22)
 
 	def __init__(self, periph):
 		SensorBase.__init__(self,periph)
 
-	def read(self):
+	def parse(self, rawdata):
 		'''
-		Read and parse the sensor data.
+		Parse the sensor data.
 		'''
-		rawdata = self.data.read()
 		temperature = struct.unpack('<h',rawdata)
 		return temperature[0]/1000.0
 
@@ -59,15 +68,15 @@ class BPartLightSensor(SensorBase):
 	'''
 	svcUUID = _bpart_UUID(0xF00)
 	dataUUID = _bpart_UUID(0xF01)
+	configUUID = _bpart_UUID(0xF02)
 
 	def __init__(self, periph):
 		SensorBase.__init__(self,periph)
 
-	def read(self):
+	def parse(self, rawdata):
 		'''
-		Read and parse the sensor data.
+		Parse the sensor data.
 		'''
-		rawdata = self.data.read()
 		light = struct.unpack('<I',rawdata)
 		return light[0]
 		
@@ -78,15 +87,15 @@ class BPartHumiditySensor(SensorBase):
 
 	svcUUID = _bpart_UUID(0xF30)
 	dataUUID = _bpart_UUID(0xF31)
+	configUUID = _bpart_UUID(0xF32)
 
 	def __init__(self, periph):
 		SensorBase.__init__(self,periph)
 
-	def read(self):
+	def parse(self, rawdata):
 		'''
-		Read and parse the sensor data.
+		Parse the sensor data.
 		'''
-		rawdata = self.data.read()
 		humidity = struct.unpack('<H',rawdata)
 		return humidity[0]
 		
@@ -97,15 +106,15 @@ class BPartAccelerometer(SensorBase):
 	'''
 	svcUUID = _bpart_UUID(0xF10)
 	dataUUID = _bpart_UUID(0xF11)
+	configUUID = _bpart_UUID(0xF12)
 
 	def __init__(self, periph):
 		SensorBase.__init__(self,periph)
 
-	def read(self):
+	def parse(self, rawdata):
 		'''
-		Read and parse the sensor data.
+		Parse the sensor data.
 		'''
-		rawdata = self.data.read()
 		(x,y,z) = struct.unpack('<hhh',rawdata)
 		x = x / (1000.0 * 16)
 		y = y / (1000.0 * 16)
@@ -114,6 +123,9 @@ class BPartAccelerometer(SensorBase):
 		
 
 
+SENSOR_CLASSES = [BPartTemperatureSensor, BPartLightSensor, BPartHumiditySensor, BPartAccelerometer]
+
+
 class BPart(Peripheral):
 	'''
 	This class abstracts a bpart and provides access to all it's sensor data.
@@ -121,11 +133,37 @@ class BPart(Peripheral):
 
 	def __init__(self,addr):
 		Peripheral.__init__(self,addr)
-		self.discoverServices()
-		self.Temperature = BPartTemperatureSensor(self)
-		self.Light = BPartLightSensor(self)
-		self.Humidity = BPartHumiditySensor(self)
-		self.Acceleration = BPartAccelerometer(self)
+		try:
+			if config.DISCOVERY == "targeted":
+				# only the sensor services, not GAP, GATT or device information
+				self.discoverServicesByUUID([ cls.svcUUID for cls in SENSOR_CLASSES ])
+			else:
+				self.discoverServices()
+			# one round trip for all services where the backend pipelines requests
+			self.discoverAllCharacteristics()
+			self.Temperature = BPartTemperatureSensor(self)
+			self.Light = BPartLightSensor(self)
+			self.Humidity = BPartHumiditySensor(self)
+			self.Acceleration = BPartAccelerometer(self)
+		except BTLEException:
+			# nobody else has the object to disconnect it
+			self.disconnect()
+			raise
+
+	def setSensor(self, name, on):
+		'''
+		Switches the sensor name (see bpcore.sensors.SENSORS) on or off.
+		'''
+		getattr(self, name).switch(on)
+
+	def readSensors(self, names):
+		'''
+		Reads the sensors names (see bpcore.sensors.SENSORS) with the requests pipelined,
+		returns a dict name -> value.
+		'''
+		sensors = [ getattr(self, name) for name in names ]
+		values = self.readCharacteristics([ sensor.data.valHandle for sensor in sensors ])
+		return dict([ (name, sensor.parse(value)) for (name, sensor, value) in zip(names, sensors, values) ])
 
 
 
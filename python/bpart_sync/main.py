@@ -10,13 +10,21 @@ It periodically reads out the sensor data supplied by the bparts
 
 import config
 import logging
-from threading import Thread
+from threading import Thread, Event
 from Queue import Queue
 from btle import BTLEException
 from bpart import BPart
 import time
-import json
-import urllib2
+from bpcore.dutycycle import DutyCycleScheduler
+from bpcore.samples import makeSample
+from bpcore.clock import getClock
+from bpcore.adaptive import AdaptiveRate
+from bpcore.sinks import getPipeline
+from bpcore.bus import getBus
+from bpcore.registry import DeviceRegistry, loadDevices
+from bpcore import control, metrics
+from bpcore.shutdown import Shutdown
+from bpcore.capture import closeWriters
 
 class Gateway(Thread):
 	'''
@@ -24,69 +32,138 @@ class Gateway(Thread):
 	It's thread polls the bParts.
 	'''
 
-	def __init__(self, connector=None):
+	def __init__(self, connector=None, devices=None):
 		Thread.__init__(self)
-		self.disconnectedDevices = config.DEVICES
+		self.devices = set(config.DEVICES if devices == None else devices)
 		self.connectedDevices = dict()
 		self.deviceQueue = Queue()
+		self.removeQueue = Queue()
+		# (mac, name, args) of the commands of bpcore/control.py
+		self.commandQueue = Queue()
+		# mac -> {sensor name: on} set by commands, applied whenever the device connects
+		self.sensors = dict()
+		# mac -> {sensor name: value}, switched off sensors are not read but repeat their last value
+		self.lastValues = dict()
+		# mac -> bpcore.adaptive.AdaptiveRate, when the sensors are due (config.ADAPTIVE)
+		self.rates = dict()
 		self.running = True
+		self._stopped = Event()
 		self.BTConnector = connector
+		# Called with a bpcore.samples.Sample for every set of values read
+		self.uplink = self._sendSample
 
-	def _createJSONString(self, temperature, humidity, light,(x,y,z)):
-		jsonString = json.dumps({'data':{'Temperature':{'value':str(temperature), 'unit':'degC'},'Humidity':{'value':str(humidity), 'unit':'Percent'},'Light':{'value':str(light), 'unit':'Number'},'AccelX':{'value':str(x),'unit':'Number'},'AccelY':{'value':str(y),'unit':'Number'},'AccelZ':{'value':str(z),'unit':'Number'}}})
-		return jsonString
+	def _sendSample(self, sample):
+		sendSample(sample)
 
-	def _sendDataToCumulus(self, mac,jsonString):
-		url = config.CUMULUS_URL+mac.replace(':','')
-		try:
-			logging.debug("Created URL: {0}".format(url))
-			req = urllib2.Request(url, jsonString, {'Content-Type': 'application/x-www-form-urlencoded' })
-			req.get_method = lambda: 'PUT'
-			f = urllib2.urlopen(req)
-			response = f.read()
-			logging.debug("CUMULUS Response: {0}".format(response))
-			f.close()
-		except urllib2.HTTPError as h:
-			logging.warning("Error while sending data to {0}: HTTP Error {1}: {2}".format(url,h.code,h.msg))
+	def readDevice(self, mac, device):
+		'''
+		Reads the sensors of a connected device that are due and passes the sample to the uplink.
+		The sample is stamped with the time the first read was sent.
+		'''
+		received = getClock().now()
+		sensors = self.sensors.get(mac, {})
+		last = self.lastValues.setdefault(mac, {})
+		rate = self._rate(mac)
+		# reads are only as punctual as the read loop (or the connect), half an interval early is in time
+		due = [ name for name in ("Temperature", "Humidity", "Light", "Acceleration")
+			if name not in last or (sensors.get(name, True) and rate.due(name, received, rate.fast / 2.0)) ]
+		values = device.readSensors(due)
+		for name in due:
+			last[name] = values[name]
+			rate.update(name, last[name], received)
+		if not due:
+			# nothing changes, nothing to send
+			metrics.incr("adaptive.skipped", device=mac)
+			return
+
+		sample = makeSample(mac, last["Temperature"], last["Humidity"], last["Light"], last["Acceleration"],
+			timestamp=getClock().wallTime(received))
+		logging.debug("Read {0}".format(sample))
+
+		self.uplink(sample)
+
+	def _rate(self, mac):
+		rate = self.rates.get(mac)
+		if rate == None:
+			rate = self.rates[mac] = AdaptiveRate(mac, config.ADAPTIVE, config.READ_INTERVAL)
+		return rate
 
 	def run(self):
 		logging.info("Gateway Thread Started")
 		while self.running:
 			while not self.deviceQueue.empty():
 				device = self.deviceQueue.get()
-				self.connectedDevices[device.deviceAddr] = device
+				if device.deviceAddr in self.devices:
+					self.connectedDevices[device.deviceAddr] = device
+					self._applySensors(device.deviceAddr, device)
+					control.getStatus().setState(device.deviceAddr, control.CONNECTED)
+				else:
+					# removed while it was being connected
+					self._disconnect(device.deviceAddr, device)
+			while not self.removeQueue.empty():
+				mac = self.removeQueue.get()
+				if mac in self.connectedDevices and mac not in self.devices:
+					self._disconnect(mac, self.connectedDevices.pop(mac))
+			while not self.commandQueue.empty():
+				self._runCommand(*self.commandQueue.get())
 
 			macsToDelete = []
 			for mac, device in self.connectedDevices.iteritems():
+				if not self.running:
+					break
 				try:
-					temperature = device.Temperature.read()
-					humidity = device.Humidity.read()
-					light = device.Light.read()
-					(x,y,z) = device.Acceleration.read()
-
-					jsonstring = self._createJSONString(temperature, humidity, light,(x,y,z))
-					logging.debug("Created JSON for {0}: {1}".format(mac,jsonstring))
-
-					self._sendDataToCumulus(mac,jsonstring)
-					
-					time.sleep(config.READ_INTERVAL)
-				except BTLEException:
+					self.readDevice(mac, device)
+					self._stopped.wait(config.READ_INTERVAL)
+				except BTLEException as e:
 					logging.warning("Device %s can no longer be reached" % mac)
+					control.getStatus().setState(mac, control.DISCONNECTED, str(e))
 					macsToDelete.append(mac)
 
 			
 			for mac in macsToDelete:
+				try:
+					# frees the adapter slot for the reconnect
+					self.connectedDevices[mac].disconnect()
+				except BTLEException:
+					pass
 				del self.connectedDevices[mac]
-				self.BTConnector.addDisconnectedDevice(mac)
+				if mac in self.devices:
+					self.BTConnector.addDisconnectedDevice(mac)
 		
-		#Cleanup on shutdown
+		#Cleanup on shutdown, including devices the connector passed on meanwhile
+		while not self.deviceQueue.empty():
+			device = self.deviceQueue.get()
+			self.connectedDevices[device.deviceAddr] = device
 		for mac,device in self.connectedDevices.iteritems():
-			try:
-				device.disconnect()
-				del device
-			except BTLEException:
-				logging.warning("Could not disconnect device %s" % mac)
+			self._disconnect(mac, device)
+			control.getStatus().setState(mac, control.DISCONNECTED, "Stopped")
+		logging.info("Gateway Thread Stopped")
 
+	def _applySensors(self, mac, device):
+		for (name, on) in self.sensors.get(mac, {}).items():
+			device.setSensor(name, on)
+
+	def _runCommand(self, mac, name, args):
+		if name in ("enable", "disable"):
+			self.sensors.setdefault(mac, {})[args["sensor"]] = (name == "enable")
+		device = self.connectedDevices.get(mac)
+		if device == None:
+			return # applied when it connects
+		try:
+			if name == "reconnect":
+				self._disconnect(mac, self.connectedDevices.pop(mac))
+				control.getStatus().setState(mac, control.DISCONNECTED, "Reconnect requested")
+				self.BTConnector.addDisconnectedDevice(mac)
+			elif name in ("enable", "disable"):
+				device.setSensor(args["sensor"], name == "enable")
+		except BTLEException:
+			logging.warning("Command %s failed for device %s" % (name, mac))
+
+	def _disconnect(self, mac, device):
+		try:
+			device.disconnect()
+		except BTLEException:
+			logging.warning("Could not disconnect device %s" % mac)
 
 	
 	def addConnectedDevice(self, device):
@@ -96,21 +173,64 @@ class Gateway(Thread):
 		'''
 		self.deviceQueue.put(device)
 
-	def stop(self):
+	def add(self, mac):
+		'''
+		Starts reading mac while the gateway runs.
+		'''
+		if mac not in self.devices:
+			self.devices.add(mac)
+			self.BTConnector.addDisconnectedDevice(mac)
+
+	def remove(self, mac):
+		'''
+		Disconnects mac and stops reading it.
+		'''
+		if mac in self.devices:
+			self.devices.discard(mac)
+			self.BTConnector.removeDevice(mac)
+			self.removeQueue.put(mac)
+			self.rates.pop(mac, None)
+			control.getStatus().forget(mac)
+
+	def command(self, mac, name, **args):
+		'''
+		Queues a command of bpcore/control.py for the gateway thread, False if mac is not read.
+		'''
+		if mac not in self.devices:
+			return False
+		self.commandQueue.put((mac, name, args))
+		return True
+
+	def stop(self, timeout=10.0):
+		'''
+		Stops reading and connecting; the gateway thread disconnects all devices.
+		Waits at most timeout seconds for both threads.
+		'''
+		deadline = time.time() + timeout
 		self.running = False
+		self._stopped.set()
+		if self.BTConnector != None:
+			self.BTConnector.stop()
+			if self.BTConnector.is_alive():
+				self.BTConnector.join(max(deadline - time.time(), 0))
+		if self.is_alive():
+			self.join(max(deadline - time.time(), 0))
+			if self.is_alive():
+				logging.warning("Gateway did not stop within %gs" % timeout)
 
 
 class BTDeviceConnector(Thread):
 	'''
-	This class tries to connect to alle devicse listed in config.DEVICES.
+	This class tries to connect to alle devicse listed in config.DEVICES (or devices if given).
 	Once a device has been connected it is passed to the Gateway class.
 	It never stops trying to connect to the bparts.
 	'''
 
-	def __init__(self, gateway=None):
+	def __init__(self, gateway=None, devices=None):
 		Thread.__init__(self)
-		self.disconnectedDevices = set(config.DEVICES)
+		self.disconnectedDevices = set(config.DEVICES if devices == None else devices)
 		self.deviceQueue = Queue()
+		self.removeQueue = Queue()
 		self.running = True
 		self.Gateway = gateway
 
@@ -118,21 +238,32 @@ class BTDeviceConnector(Thread):
 		logging.info("BTDeviceConnector thread started")
 		while self.running:
 			while not self.deviceQueue.empty():
-				self.disconnectedDevices.append(self.deviceQueue.get())
+				self.disconnectedDevices.add(self.deviceQueue.get())
+			while not self.removeQueue.empty():
+				self.disconnectedDevices.discard(self.removeQueue.get())
 
 			macsToRemove = []
 			for mac in self.disconnectedDevices:
+				if not self.running:
+					break
 				try:
-					device = BPart(mac)
+					device = self.connectDevice(mac)
 					self.Gateway.addConnectedDevice(device)
 					macsToRemove.append(mac)
 					logging.info("Connected to Device %s" % mac)
-				except BTLEException:
+				except BTLEException as e:
 					logging.warning("Could not connect to device %s" % mac)
+					control.getStatus().setState(mac, control.DISCONNECTED, str(e))
 
 			for mac in macsToRemove:
 				self.disconnectedDevices.remove(mac)
 	
+	def connectDevice(self, mac):
+		'''
+		Connects to a bpart and discovers its sensors. Raises BTLEException if that fails.
+		'''
+		return BPart(mac)
+
 	def addDisconnectedDevice(self, mac):
 		'''
 		This method provides an interface for the Gateway class which can pass back the mac addresses
@@ -140,6 +271,12 @@ class BTDeviceConnector(Thread):
 		'''
 		self.deviceQueue.put(mac)
 
+	def removeDevice(self, mac):
+		'''
+		Stops trying to connect to mac.
+		'''
+		self.removeQueue.put(mac)
+
 	def setGateway(self, gateway):
 		'''
 		Associate a Gateway.
@@ -153,26 +290,184 @@ class BTDeviceConnector(Thread):
 		self.running = False
 		
 
-	
-def main():
-	connector = BTDeviceConnector()
-	gateway = Gateway(connector)
+
+class DutyCycleGateway(Gateway):
+	'''
+	Reads the bparts over duty-cycled connections (see bpcore/dutycycle.py) instead of keeping them connected.
+	Every bpart is connected, read and disconnected again once per period (config.DUTY_CYCLE_PERIODS,
+	default READ_INTERVAL), using config.DUTY_CYCLE_SLOTS connections at a time.
+	The BPart objects are kept between visits, so their services and handles are only discovered once.
+	'''
+
+	def __init__(self, connector, devices=None):
+		Gateway.__init__(self, connector, devices)
+		self.knownDevices = dict()
+		self.scheduler = DutyCycleScheduler(self._visit, config.DUTY_CYCLE_SLOTS)
+		for mac in self.devices:
+			self.scheduler.add(mac, config.DUTY_CYCLE_PERIODS.get(mac, config.READ_INTERVAL))
+		self._stopTimeout = 10.0
+
+	def add(self, mac):
+		self.devices.add(mac)
+		self.scheduler.add(mac, config.DUTY_CYCLE_PERIODS.get(mac, config.READ_INTERVAL))
+
+	def remove(self, mac):
+		self.devices.discard(mac)
+		self.scheduler.remove(mac)
+		self.knownDevices.pop(mac, None)
+		self.rates.pop(mac, None)
+		control.getStatus().forget(mac)
+
+	def command(self, mac, name, **args):
+		# every visit connects anew, so there is nothing to reconnect; sensor settings apply from the next visit
+		if mac not in self.devices:
+			return False
+		if name in ("enable", "disable"):
+			self.sensors.setdefault(mac, {})[args["sensor"]] = (name == "enable")
+		return True
+
+	def _visit(self, mac):
+		try:
+			device = self.knownDevices.get(mac)
+			if device == None:
+				device = self.BTConnector.connectDevice(mac)
+				if mac in self.devices:
+					self.knownDevices[mac] = device
+			else:
+				device.connect(mac)
+		except BTLEException as e:
+			control.getStatus().setState(mac, control.DISCONNECTED, str(e))
+			raise
+		try:
+			self._applySensors(mac, device)
+			self.readDevice(mac, device)
+			control.getStatus().setState(mac, control.IDLE)
+			if config.ADAPTIVE and mac in self.devices:
+				# come back when the next sensor is due
+				self.scheduler.add(mac, self._rate(mac).interval())
+		except BTLEException as e:
+			control.getStatus().setState(mac, control.DISCONNECTED, str(e))
+			raise
+		finally:
+			try:
+				device.disconnect()
+			except BTLEException:
+				pass
+
+	def _rate(self, mac):
+		rate = self.rates.get(mac)
+		if rate == None:
+			period = config.DUTY_CYCLE_PERIODS.get(mac, config.READ_INTERVAL)
+			rate = self.rates[mac] = AdaptiveRate(mac, config.ADAPTIVE, period)
+		return rate
+
+	def run(self):
+		logging.info("Duty cycle gateway started with %d slots" % config.DUTY_CYCLE_SLOTS)
+		self.scheduler.start()
+		self._stopped.wait()
+		# the running visits are finished, they disconnect anyway
+		self.scheduler.stop(self._stopTimeout)
+
+	def stop(self, timeout=10.0):
+		self.running = False
+		self._stopTimeout = timeout
+		self._stopped.set()
+		if self.is_alive():
+			self.join(timeout)
+
+
+def startGateway(devices=None, uplink=None):
+	'''
+	Starts a Gateway and its BTDeviceConnector for devices (default config.DEVICES),
+	or a DutyCycleGateway if config.DUTY_CYCLE_SLOTS is set.
+	Returns the gateway; its stop() stops both, add(mac) and remove(mac) change the devices read.
+	'''
+	connector = BTDeviceConnector(devices=devices)
+	if config.DUTY_CYCLE_SLOTS:
+		gateway = DutyCycleGateway(connector, devices)
+	else:
+		gateway = Gateway(connector, devices)
+	if uplink != None:
+		gateway.uplink = uplink
 	connector.setGateway(gateway)
 	gateway.start()
-	connector.start()
-	# Wait for any input
-	raw_input("--> Press Any Button to exit")
-	connector.stop()
-	gateway.stop()
+	if not config.DUTY_CYCLE_SLOTS:
+		connector.start()
+	return gateway
+
+def sendSample(sample):
+	'''
+	Sends a sample of the gateway or a worker to the sinks in config.SINKS, the sample bus and the control API.
+	'''
+	sampleBus = getBus(config.SAMPLE_BUS, config.SAMPLE_BUS_SLOTS)
+	if sampleBus != None:
+		sampleBus.publish(sample)
+	control.getStatus().sample(sample)
+	getPipeline(config.SINKS, config.AGGREGATION, config.SPOOL, config.DEADBAND).send(sample)
 
+def startRegistry(fleet, devices):
+	'''
+	Applies changes of config.DEVICES_FILE to fleet while it runs; None if there is no such file.
+	'''
+	if not config.DEVICES_FILE:
+		return None
+	registry = DeviceRegistry(config.DEVICES_FILE, fleet, devices, config.DEVICES_FILE_INTERVAL)
+	registry.start()
+	return registry
 
-if __name__ == "__main__":
+def stopRegistry(registry):
+	if registry != None:
+		registry.stop()
+
+def main():
+	devices = config.DEVICES
+	if config.DEVICES_FILE:
+		devices = loadDevices(config.DEVICES_FILE, config.DEVICES)
+	shutdown = Shutdown(config.SHUTDOWN_TIMEOUT)
+	shutdown.installSignalHandlers()
+	if config.WORKERS != 0:
+		# The data is sent by this process, the workers only read the bparts
+		# the sinks are only created once the workers have been forked
+		from bpcore.workers import WorkerPool
+		pool = WorkerPool(devices, startGateway, sendSample, config.WORKERS)
+		pool.start()
+		poolThread = Thread(target=pool.run)
+		poolThread.start()
+		registry = startRegistry(pool, devices)
+		server = control.startControl(config.CONTROL, pool, pool.collectMetrics)
+		shutdown.add("control API", lambda timeout: control.stopControl(server))
+		shutdown.add("device registry", lambda timeout: stopRegistry(registry))
+		def stopPool(timeout):
+			pool.running = False
+			poolThread.join()
+			pool.stop(timeout)
+		shutdown.add("workers", stopPool)
+	else:
+		gateway = startGateway(devices)
+		registry = startRegistry(gateway, devices)
+		server = control.startControl(config.CONTROL, gateway)
+		shutdown.add("control API", lambda timeout: control.stopControl(server))
+		shutdown.add("device registry", lambda timeout: stopRegistry(registry))
+		shutdown.add("gateway", gateway.stop)
+	# Send what is still batched, spool the rest
+	shutdown.add("sinks", getPipeline(config.SINKS, config.AGGREGATION, config.SPOOL, config.DEADBAND).close)
+	shutdown.add("capture", lambda timeout: closeWriters())
+
+	# Wait for any input or a signal
+	shutdown.wait("--> Press Any Button to exit")
+	shutdown.run()
+
+
+def setupLogging():
 	#Clear the logfile
 	with open(config.LOGFILE, 'w'):
 		pass
 
 	#Initialize Logger
 	logging.basicConfig(format="%(asctime)s:%(levelname)s:%(message)s",filename=config.LOGFILE, level=config.LOGLEVEL)
-	
+
+
+if __name__ == "__main__":
+	setupLogging()
 	main()
 
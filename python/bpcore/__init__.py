@@ -0,0 +1,13 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Code shared by the bpart_sync and bpart_async clients.
+
+The client directories put their parent directory on sys.path, so the
+modules in here are imported as "bpcore.<module>".
+'''
@@ -0,0 +1,182 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Placement of devices on several local Bluetooth adapters.
+
+One controller only handles a handful of simultaneous connections, so the
+fleet is spread over all adapters in config.IFACES. Every connect asks the
+scheduler for an adapter; it picks the healthy adapter with the lowest load
+(connections relative to its capacity). An adapter on which several
+different devices failed to connect in a row is taken out of service for a
+while; its devices end up on the other adapters when they reconnect.
+'''
+
+import time
+import logging
+import threading
+
+from bpcore import metrics
+from bpcore.gatt import BTLEException
+
+# Simultaneous connections per adapter, most controllers manage 5 to 7
+DEFAULT_CAPACITY = 5
+
+
+class Adapter(object):
+    def __init__(self, iface, capacity):
+        self.iface = iface
+        self.capacity = capacity
+        self.devices = set()
+        self.failedDevices = set() # devices which failed to connect since the last success
+        self.downUntil = 0
+
+    def isUp(self, now=None):
+        return (time.time() if now == None else now) >= self.downUntil
+
+    def load(self):
+        return float(len(self.devices)) / self.capacity
+
+    def __str__(self):
+        return "%s (%d/%d)" % (self.iface, len(self.devices), self.capacity)
+
+
+class AdapterScheduler(object):
+    '''
+    Assigns devices to adapters. ifaces is a list of adapter names ("hciN");
+    capacity is either one number for all adapters or a dict iface -> number.
+    An adapter is put out of service for cooldown seconds once maxFailures
+    different devices failed to connect on it without a success in between.
+    '''
+
+    def __init__(self, ifaces, capacity=DEFAULT_CAPACITY, maxFailures=3, cooldown=60.0):
+        if not ifaces:
+            raise ValueError("Need at least one adapter")
+        self.adapters = []
+        for iface in ifaces:
+            cap = capacity.get(iface, DEFAULT_CAPACITY) if isinstance(capacity, dict) else capacity
+            self.adapters.append(Adapter(iface, cap))
+        self.maxFailures = maxFailures
+        self.cooldown = cooldown
+        self._placement = {} # device address -> Adapter
+        self._lock = threading.Lock()
+
+    def _get(self, iface):
+        for adapter in self.adapters:
+            if adapter.iface == iface:
+                return adapter
+        raise ValueError("Unknown adapter %s" % iface)
+
+    def _updateGauges(self):
+        for adapter in self.adapters:
+            metrics.setGauge("adapter.connections", len(adapter.devices), device=adapter.iface)
+            metrics.setGauge("adapter.up", int(adapter.isUp()), device=adapter.iface)
+
+    def acquire(self, addr):
+        '''
+        Returns the adapter addr should connect on and counts the connection
+        against it. Raises BTLEException if all adapters are full or down.
+        '''
+        with self._lock:
+            now = time.time()
+            current = self._placement.get(addr)
+            if current != None:
+                if current.isUp(now):
+                    return current.iface
+                current.devices.discard(addr)
+                del self._placement[addr]
+            candidates = [ a for a in self.adapters if a.isUp(now) and len(a.devices) < a.capacity ]
+            if not candidates:
+                raise BTLEException(BTLEException.DISCONNECTED, "No Bluetooth adapter available for %s" % addr)
+            # A device that just failed on an adapter tries the others first,
+            # so a dead adapter is left even before it is declared failed
+            adapter = min(candidates, key=lambda a: (addr in a.failedDevices, a.load(), len(a.failedDevices)))
+            adapter.devices.add(addr)
+            self._placement[addr] = adapter
+            self._updateGauges()
+            return adapter.iface
+
+    def release(self, addr):
+        '''
+        Must be called when the connection of addr is closed or lost.
+        '''
+        with self._lock:
+            adapter = self._placement.pop(addr, None)
+            if adapter != None:
+                adapter.devices.discard(addr)
+                self._updateGauges()
+
+    def connected(self, addr):
+        '''
+        Reports a successful connect of addr on the adapter it was given.
+        '''
+        with self._lock:
+            adapter = self._placement.get(addr)
+            if adapter != None:
+                adapter.failedDevices.clear()
+
+    def connectFailed(self, addr):
+        '''
+        Reports a failed connect of addr and releases its placement.
+        '''
+        with self._lock:
+            adapter = self._placement.pop(addr, None)
+            if adapter == None:
+                return
+            adapter.devices.discard(addr)
+            adapter.failedDevices.add(addr)
+            if len(adapter.failedDevices) >= self.maxFailures and len(self.adapters) > 1:
+                self._fail(adapter)
+            self._updateGauges()
+
+    def fail(self, iface):
+        '''
+        Takes an adapter out of service. Returns the addresses of the devices
+        still placed on it; they move to other adapters on their next connect.
+        '''
+        with self._lock:
+            moved = self._fail(self._get(iface))
+            self._updateGauges()
+            return moved
+
+    def _fail(self, adapter):
+        logging.warning("Adapter %s failed, taking it out of service for %ds" % (adapter.iface, self.cooldown))
+        metrics.incr("adapter.failures", device=adapter.iface)
+        adapter.downUntil = time.time() + self.cooldown
+        adapter.failedDevices.clear()
+        # Connected devices keep their slot until their connection is released
+        return list(adapter.devices)
+
+    def recover(self, iface):
+        '''
+        Puts a failed adapter back into service.
+        '''
+        with self._lock:
+            self._get(iface).downUntil = 0
+            self._updateGauges()
+
+    def placement(self):
+        '''
+        Returns a dict device address -> adapter name.
+        '''
+        with self._lock:
+            return dict([ (addr, adapter.iface) for (addr, adapter) in self._placement.items() ])
+
+
+_scheduler = None
+
+def getScheduler(ifaces, capacity=DEFAULT_CAPACITY):
+    '''
+    Returns the scheduler shared by all devices of the process, None if no
+    adapters are configured (then the backend's default adapter is used).
+    '''
+    global _scheduler
+    if not ifaces:
+        return None
+    if _scheduler == None or [ a.iface for a in _scheduler.adapters ] != list(ifaces):
+        _scheduler = AdapterScheduler(ifaces, capacity)
+    return _scheduler
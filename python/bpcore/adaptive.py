@@ -0,0 +1,155 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Reading sensors only as often as their values change.
+
+Every sensor with a policy (config.ADAPTIVE) gets its own interval. As
+long as its values move it is read at the fast interval; once the last
+window values stayed within threshold of their mean for hold seconds,
+the interval doubles with every further static value, up to slow. The
+first value off by more than threshold brings it back to fast at once, so
+transients cost at most one slow interval of delay.
+
+    {"Acceleration": {"threshold": 0.05}, "Temperature": {"threshold": 0.2, "slow": 120}}
+
+Policy options: threshold (in the unit of the sensor, for Acceleration the
+distance of the (x, y, z) vectors in g), window (values, default 5), hold
+(seconds, default 10), slow (seconds, default 60) and fast (seconds,
+default the normal interval of the client). Sensors without a policy are
+read at the normal interval.
+
+The sync client skips reads of sensors that are not due and only sends a
+sample when something was read; the async client switches the sensors
+off between two due values, since the bPart notifies at a fixed rate.
+'''
+
+from collections import deque
+
+from bpcore import metrics
+from bpcore.sensors import SENSORS
+
+DEFAULT_WINDOW = 5
+DEFAULT_HOLD = 10.0
+DEFAULT_SLOW = 60.0
+
+
+def _distance(a, b):
+    if isinstance(a, tuple):
+        return sum([ (x - y) ** 2 for (x, y) in zip(a, b) ]) ** 0.5
+    return abs(a - b)
+
+def _mean(values):
+    if isinstance(values[0], tuple):
+        return tuple([ sum(axis) / float(len(values)) for axis in zip(*values) ])
+    return sum(values) / float(len(values))
+
+
+class SensorPolicy(object):
+    '''
+    When a sensor counts as changing and how often it is read, see above.
+    '''
+
+    def __init__(self, threshold, window=DEFAULT_WINDOW, hold=DEFAULT_HOLD, slow=DEFAULT_SLOW, fast=None):
+        self.threshold = threshold
+        self.window = max(int(window), 2)
+        self.hold = hold
+        self.slow = slow
+        self.fast = fast
+
+
+class _SensorState(object):
+    def __init__(self, policy, fast):
+        self.values = deque(maxlen=policy.window)
+        self.interval = fast
+        self.activeUntil = None
+        self.next = None # when it is due next
+
+
+class AdaptiveRate(object):
+    '''
+    The intervals of the sensors of one device. policies maps sensor names
+    to SensorPolicy objects (or their options as a dict), fast is the
+    normal interval of the client.
+    '''
+
+    def __init__(self, name, policies, fast):
+        self.name = name
+        self.policies = {}
+        for (sensor, policy) in (policies or {}).items():
+            if isinstance(policy, dict):
+                policy = SensorPolicy(**policy)
+            self.policies[sensor] = policy
+        self.fast = fast
+        self._states = {}
+
+    def _state(self, sensor):
+        state = self._states.get(sensor)
+        if state == None:
+            policy = self.policies[sensor]
+            state = self._states[sensor] = _SensorState(policy, policy.fast or self.fast)
+        return state
+
+    def adaptive(self, sensor):
+        return sensor in self.policies
+
+    def due(self, sensor, now, slack=0):
+        '''
+        Whether sensor should be read at now, or is due within slack seconds.
+        '''
+        if sensor not in self.policies:
+            return True
+        state = self._state(sensor)
+        return state.next == None or now + slack >= state.next
+
+    def update(self, sensor, value, now):
+        '''
+        Takes a value of sensor read (or received) at now; returns the seconds until
+        it should be read again.
+        '''
+        if sensor not in self.policies:
+            return self.fast
+        policy = self.policies[sensor]
+        state = self._state(sensor)
+        fast = policy.fast or self.fast
+        # off from the previous value or the mean of the window
+        moved = state.values and max([ _distance(value, v) for v in (state.values[-1], _mean(state.values)) ]) > policy.threshold
+        if moved or not state.values:
+            if moved and state.interval > fast:
+                metrics.incr("adaptive.speedups", device=self.name)
+            state.interval = fast
+            state.activeUntil = now + policy.hold
+        elif now >= state.activeUntil:
+            state.interval = min(state.interval * 2, max(policy.slow, fast))
+        state.values.append(value)
+        state.next = now + state.interval
+        metrics.setGauge("adaptive.interval." + sensor.lower(), state.interval, device=self.name)
+        return state.interval
+
+    def interval(self):
+        '''
+        The shortest interval of all sensors, i.e. how often the device has to be read.
+        '''
+        intervals = []
+        for (sensor, offset) in SENSORS:
+            if sensor not in self.policies:
+                return self.fast
+            intervals.append(self._state(sensor).interval)
+        return min(intervals)
+
+    def nextDue(self):
+        '''
+        The earliest time any adaptive sensor is due, None if none has been read yet.
+        '''
+        times = [ s.next for s in self._states.values() if s.next != None ]
+        return min(times) if times else None
+
+    def forget(self, sensor):
+        '''
+        Reads sensor at the fast interval again, e.g. after a reconnect.
+        '''
+        self._states.pop(sensor, None)
@@ -0,0 +1,320 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Connectionless ingestion: sensor values from advertisements.
+
+A scanner yields Advertisement reports; every registered decoder gets a
+look at each one and the first that recognizes it returns the sensor
+values. One scanner serves any number of devices without connections.
+
+Scanners (config.SCANNER, a dict with a "type" like config.SINKS):
+
+    "hcidump"  {"iface": "hci0"}: runs "hcitool lescan" and parses the LE
+               advertising reports from "hcidump --raw"
+    "file"     {"path": ...}: the same from a recorded "hcidump --raw"
+               output, or "[timestamp] addr rssi hexdata" lines, for tests
+    "sim"      {"interval": 1.0}: the devices in bpcore.sim.DEVICES
+
+Decoders are functions advertisement -> (temperature, humidity, light,
+(x, y, z)) or None, registered by name with registerDecoder. The built-in
+"bpart" decoder reads manufacturer specific data (company 0xFFFF) laid out
+as "BP", version 1 and then the sensor values encoded like their GATT
+characteristics: temperature int16 (1/1000 C), humidity uint16, light
+uint32, acceleration 3 x int16 (1/16000 g), little endian.
+'''
+
+import time
+import struct
+import logging
+import binascii
+import threading
+import subprocess
+from collections import namedtuple, OrderedDict
+
+from bpcore import metrics
+from bpcore.samples import makeSample
+
+# AD types
+AD_FLAGS = 0x01
+AD_SHORT_NAME = 0x08
+AD_COMPLETE_NAME = 0x09
+AD_SERVICE_DATA = 0x16
+AD_MANUFACTURER = 0xFF
+
+Advertisement = namedtuple("Advertisement", "addr rssi timestamp data")
+
+
+def parseAdvertisingData(data):
+    '''
+    Splits advertising data into a list of (AD type, value) pairs.
+    Malformed trailing bytes are ignored.
+    '''
+    fields = []
+    pos = 0
+    while pos < len(data):
+        length = ord(data[pos])
+        if length == 0 or pos + 1 + length > len(data):
+            break
+        fields.append((ord(data[pos + 1]), data[pos + 2:pos + 1 + length]))
+        pos += 1 + length
+    return fields
+
+def adField(data, adType):
+    '''
+    Returns the value of the first AD structure of adType, None if there is none.
+    '''
+    for (t, value) in parseAdvertisingData(data):
+        if t == adType:
+            return value
+    return None
+
+def adStructure(adType, value):
+    return chr(len(value) + 1) + chr(adType) + value
+
+def _addrString(raw):
+    # HCI sends addresses least significant byte first
+    return ':'.join([ binascii.b2a_hex(c) for c in reversed(raw) ]).upper()
+
+
+def parseAdvertisingReports(event, timestamp=None):
+    '''
+    Returns the Advertisements in an HCI LE Meta event (type byte 0x04
+    included). Events other than LE Advertising Reports give [].
+    '''
+    if len(event) < 5 or event[0] != '\x04' or event[1] != '\x3e' or event[3] != '\x02':
+        return []
+    timestamp = time.time() if timestamp == None else timestamp
+    reports = []
+    pos = 5
+    for i in range(ord(event[4])):
+        # event type, address type, address, data length, data, rssi
+        if pos + 9 > len(event):
+            break
+        addr = _addrString(event[pos + 2:pos + 8])
+        length = ord(event[pos + 8])
+        data = event[pos + 9:pos + 9 + length]
+        if pos + 10 + length > len(event):
+            break
+        rssi = struct.unpack('b', event[pos + 9 + length])[0]
+        reports.append(Advertisement(addr, rssi, timestamp, data))
+        pos += 10 + length
+    return reports
+
+def parseHcidump(lines):
+    '''
+    Yields the Advertisements in "hcidump --raw" output. Packets start with
+    "> " (received) or "< " (sent), long ones continue on indented lines.
+    '''
+    packet = None
+    for line in lines:
+        if line.startswith('> ') or line.startswith('< '):
+            packet = binascii.a2b_hex(''.join(line[2:].split())) if line[0] == '>' else None
+        elif line.startswith(' ') and packet != None:
+            packet += binascii.a2b_hex(''.join(line.split()))
+        else:
+            continue
+        # events are complete once their parameter length is there, no need to wait for the next packet
+        if packet != None and len(packet) >= 3 and len(packet) >= 3 + ord(packet[2]):
+            for adv in parseAdvertisingReports(packet):
+                yield adv
+            packet = None
+
+def parseReportLine(line):
+    '''
+    Parses an "[timestamp] addr rssi hexdata" line, None for anything else.
+    '''
+    parts = line.split()
+    timestamp = None
+    try:
+        if len(parts) == 4:
+            timestamp = float(parts.pop(0))
+        if len(parts) != 3 or len(parts[0].split(':')) != 6:
+            return None
+        return Advertisement(parts[0].upper(), int(parts[1]), time.time() if timestamp == None else timestamp,
+                             binascii.a2b_hex(parts[2]))
+    except (ValueError, TypeError):
+        return None
+
+
+# Decoders ----------------------------------------------------------------
+
+DECODERS = OrderedDict()
+
+def registerDecoder(name, decoder):
+    '''
+    Registers decoder(advertisement) -> (temperature, humidity, light, (x, y, z)) or None.
+    '''
+    DECODERS[name] = decoder
+    return decoder
+
+BPART_COMPANY = 0xFFFF
+_BPART_MAGIC = "BP\x01"
+_BPART_VALUES = struct.Struct('<hHIhhh')
+
+def encodeBPartAdvert(temperature, humidity, light, (x, y, z)):
+    '''
+    The manufacturer specific data AD structure the "bpart" decoder reads.
+    '''
+    value = struct.pack('<H', BPART_COMPANY) + _BPART_MAGIC + _BPART_VALUES.pack(
+        int(round(temperature * 1000)), int(humidity), int(light),
+        int(round(x * 1000 * 16)), int(round(y * 1000 * 16)), int(round(z * 1000 * 16)))
+    return adStructure(AD_MANUFACTURER, value)
+
+def decodeBPartAdvert(adv):
+    data = adField(adv.data, AD_MANUFACTURER)
+    if data == None or len(data) < 5 + _BPART_VALUES.size or struct.unpack('<H', data[:2])[0] != BPART_COMPANY \
+            or data[2:5] != _BPART_MAGIC:
+        return None
+    (t, h, l, x, y, z) = _BPART_VALUES.unpack_from(data, 5)
+    return (t / 1000.0, h, l, (x / (1000.0 * 16), y / (1000.0 * 16), z / (1000.0 * 16)))
+
+registerDecoder("bpart", decodeBPartAdvert)
+
+
+# Scanners ----------------------------------------------------------------
+
+class Scanner(object):
+    '''
+    Base class of all scanners. reports() yields Advertisements until
+    close() is called or the source ends.
+    '''
+
+    def reports(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HcidumpScanner(Scanner):
+    def __init__(self, iface="hci0", hcitool="hcitool", hcidump="hcidump"):
+        self.iface = iface
+        self._commands = ([hcitool, "-i", iface, "lescan", "--duplicates", "--passive"],
+                          [hcidump, "-i", iface, "--raw"])
+        self._procs = []
+
+    def reports(self):
+        with open('/dev/null', 'w') as devnull:
+            self._procs = [ subprocess.Popen(self._commands[0], stdout=devnull, stderr=devnull),
+                            subprocess.Popen(self._commands[1], stdout=subprocess.PIPE, stderr=devnull) ]
+        for adv in parseHcidump(iter(self._procs[1].stdout.readline, '')):
+            yield adv
+
+    def close(self):
+        for proc in self._procs:
+            if proc.poll() == None:
+                proc.terminate()
+                proc.wait()
+        self._procs = []
+
+
+class FileScanner(Scanner):
+    def __init__(self, path):
+        self.path = path
+        self._closed = False
+
+    def reports(self):
+        with open(self.path) as f:
+            lines = [ l.rstrip('\n') for l in f ]
+        if any([ l.startswith('> ') for l in lines ]):
+            reports = parseHcidump(lines)
+        else:
+            reports = [ r for r in map(parseReportLine, lines) if r != None ]
+        for adv in reports:
+            if self._closed:
+                return
+            yield adv
+
+    def close(self):
+        self._closed = True
+
+
+class SimScanner(Scanner):
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._closed = threading.Event()
+
+    def reports(self):
+        from bpcore import sim
+        while not self._closed.is_set():
+            for device in sim.DEVICES.values():
+                if device.reachable:
+                    yield Advertisement(device.addr, -60, time.time(), device.advertisingData())
+            self._closed.wait(self.interval)
+
+    def close(self):
+        self._closed.set()
+
+
+SCANNER_TYPES = {"hcidump": HcidumpScanner, "file": FileScanner, "sim": SimScanner}
+
+def makeScanner(spec):
+    options = dict(spec)
+    scannerType = options.pop("type", "hcidump")
+    if scannerType not in SCANNER_TYPES:
+        raise ValueError("Unknown scanner type %s" % repr(scannerType))
+    return SCANNER_TYPES[scannerType](**options)
+
+
+class AdvertIngestor(threading.Thread):
+    '''
+    Turns the reports of scanner into Samples passed to uplink. Only the
+    given devices are accepted (all if it is empty), and at most one sample
+    per device and minInterval seconds.
+    '''
+
+    def __init__(self, scanner, uplink, devices=None, decoders=None, minInterval=1.0):
+        threading.Thread.__init__(self, name="advert ingestor")
+        self.daemon = True
+        self.scanner = scanner
+        self.uplink = uplink
+        self.devices = set([ d.upper() for d in devices or [] ])
+        self.decoders = [ DECODERS[name] for name in (decoders or DECODERS.keys()) ]
+        self.minInterval = minInterval
+        self.running = True
+        self._last = {} # addr -> timestamp of the last sample
+
+    def handle(self, adv):
+        '''
+        Decodes one report; returns the Sample sent, or None.
+        '''
+        metrics.incr("adverts.reports")
+        if self.devices and adv.addr not in self.devices:
+            return None
+        if adv.timestamp - self._last.get(adv.addr, float('-inf')) < self.minInterval:
+            metrics.incr("adverts.throttled")
+            return None
+        for decoder in self.decoders:
+            values = decoder(adv)
+            if values != None:
+                break
+        else:
+            metrics.incr("adverts.unknown")
+            return None
+        self._last[adv.addr] = adv.timestamp
+        metrics.incr("adverts.samples", device=adv.addr)
+        sample = makeSample(adv.addr, *values, timestamp=adv.timestamp)
+        self.uplink(sample)
+        return sample
+
+    def run(self):
+        try:
+            for adv in self.scanner.reports():
+                if not self.running:
+                    break
+                try:
+                    self.handle(adv)
+                except Exception:
+                    logging.exception("Could not handle advertisement of %s" % adv.addr)
+        finally:
+            self.scanner.close()
+
+    def stop(self, timeout=5.0):
+        self.running = False
+        self.scanner.close()
+        self.join(timeout)
@@ -0,0 +1,260 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Edge aggregation: one record per device and window instead of every sample.
+
+The Aggregator sits in front of the sinks. For every device and value it
+keeps min, max, mean and RMS of the current window, updated in O(1) per
+sample (amortized for the min/max of sliding windows). Windows are either
+tumbling (step == window) or sliding (step < window: every step seconds
+the statistics of the last window seconds are sent).
+
+Aggregates are Samples whose values are the window means, so every sink
+can send them; the full statistics and the event flags are in the extra
+fields and show up in JSON line sinks.
+'''
+
+import math
+import logging
+import threading
+from collections import namedtuple, deque
+
+from bpcore import metrics
+from bpcore.samples import Sample
+from bpcore.clock import getClock
+
+FIELDS = ("temperature", "humidity", "light", "accelX", "accelY", "accelZ", "accelMagnitude")
+
+
+class Aggregate(namedtuple("Aggregate", Sample._fields + ("window", "count", "stats", "flags"))):
+    '''
+    window is (start, end), stats a dict field -> {"min", "max", "mean",
+    "rms"}, flags a list of the events that occurred in the window.
+    '''
+    __slots__ = ()
+
+
+def _values(sample):
+    (x, y, z) = sample.acceleration
+    return (sample.temperature, sample.humidity, sample.light, x, y, z, math.sqrt(x * x + y * y + z * z))
+
+
+class WindowStats(object):
+    '''
+    Statistics of a tumbling window.
+    '''
+
+    __slots__ = ('count', 'total', 'squares', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, t, v):
+        self.count += 1
+        self.total += v
+        self.squares += v * v
+        if self.min == None or v < self.min:
+            self.min = v
+        if self.max == None or v > self.max:
+            self.max = v
+
+    def expire(self, now):
+        pass
+
+    def result(self):
+        return {"min": self.min, "max": self.max, "mean": self.total / self.count,
+                "rms": math.sqrt(self.squares / self.count)}
+
+
+class SlidingWindowStats(WindowStats):
+    '''
+    Statistics over the last length seconds. Min and max are kept with
+    monotonic queues, so every value enters and leaves each queue once.
+    '''
+
+    __slots__ = ('length', '_items', '_minq', '_maxq', '_seq')
+
+    def __init__(self, length):
+        WindowStats.__init__(self)
+        self.length = length
+        self._items = deque() # (seq, t, v)
+        self._minq = deque()  # (seq, v), v increasing
+        self._maxq = deque()  # (seq, v), v decreasing
+        self._seq = 0
+
+    def add(self, t, v):
+        self._seq += 1
+        self._items.append((self._seq, t, v))
+        self.count += 1
+        self.total += v
+        self.squares += v * v
+        while self._minq and self._minq[-1][1] >= v:
+            self._minq.pop()
+        self._minq.append((self._seq, v))
+        while self._maxq and self._maxq[-1][1] <= v:
+            self._maxq.pop()
+        self._maxq.append((self._seq, v))
+        self.min = self._minq[0][1]
+        self.max = self._maxq[0][1]
+
+    def expire(self, now):
+        while self._items and self._items[0][1] < now - self.length:
+            (seq, t, v) = self._items.popleft()
+            self.count -= 1
+            self.total -= v
+            self.squares -= v * v
+            if self._minq[0][0] == seq:
+                self._minq.popleft()
+            if self._maxq[0][0] == seq:
+                self._maxq.popleft()
+        if self.count:
+            self.min = self._minq[0][1]
+            self.max = self._maxq[0][1]
+        else:
+            # start from exact zeros again, the running sums drift
+            self.total = self.squares = 0.0
+            self.min = self.max = None
+
+    def result(self):
+        r = WindowStats.result(self)
+        r["rms"] = math.sqrt(max(self.squares, 0.0) / self.count)
+        return r
+
+
+class Aggregator(object):
+    '''
+    Aggregates samples and passes one Aggregate per device and window to
+    downstream.send(). events maps a field to a threshold (flagged when the
+    window maximum exceeds it) or to {"above": x, "below": y}.
+
+    Windows are by the time the samples were taken (bpcore.clock); a window
+    is closed lateness seconds after its end, so that samples still on
+    their way (e.g. from a worker process) make it in.
+    '''
+
+    def __init__(self, downstream, window=60.0, step=None, events=None, tick=1.0, lateness=1.0):
+        self.downstream = downstream
+        self.window = float(window)
+        self.step = float(step or window)
+        self.lateness = lateness
+        if self.step > self.window:
+            raise ValueError("step must not be longer than the window")
+        self.events = []
+        for (field, limit) in (events or {}).items():
+            if field not in FIELDS:
+                raise ValueError("Unknown field %s" % repr(field))
+            if not isinstance(limit, dict):
+                limit = {"above": limit}
+            self.events.append((field, limit.get("above"), limit.get("below")))
+        self._devices = {} # device -> (stats per field, window end)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._timer = threading.Thread(target=self._tickPeriodically, args=(tick,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    @property
+    def sliding(self):
+        return self.step < self.window
+
+    def _newStats(self):
+        if self.sliding:
+            return [ SlidingWindowStats(self.window) for f in FIELDS ]
+        return [ WindowStats() for f in FIELDS ]
+
+    def _windowEnd(self, t):
+        return (math.floor(t / self.step) + 1) * self.step
+
+    def send(self, sample):
+        metrics.incr("aggregate.samples")
+        emit = []
+        with self._lock:
+            state = self._devices.get(sample.device)
+            if state == None or sample.timestamp >= state[1]:
+                if state != None:
+                    emit.append(self._aggregate(sample.device, state))
+                if state == None or not self.sliding:
+                    state = [self._newStats(), self._windowEnd(sample.timestamp)]
+                else:
+                    state[1] = self._windowEnd(sample.timestamp)
+                self._devices[sample.device] = state
+            for (stats, v) in zip(state[0], _values(sample)):
+                stats.add(sample.timestamp, v)
+        for aggregate in emit:
+            self._emit(aggregate)
+
+    def _aggregate(self, device, state):
+        # Builds the Aggregate of the window ending at state[1], None if it is empty
+        (stats, end) = state
+        for s in stats:
+            s.expire(end)
+        if not stats[0].count:
+            return None
+        results = dict(zip(FIELDS, [ s.result() for s in stats ]))
+        flags = []
+        for (field, above, below) in self.events:
+            if above != None and results[field]["max"] > above:
+                flags.append("%s>%g" % (field, above))
+            if below != None and results[field]["min"] < below:
+                flags.append("%s<%g" % (field, below))
+        mean = lambda f: results[f]["mean"]
+        return Aggregate(device, end, mean("temperature"), mean("humidity"), mean("light"),
+                         (mean("accelX"), mean("accelY"), mean("accelZ")),
+                         (end - self.window, end), stats[0].count, results, flags)
+
+    def _emit(self, aggregate):
+        if aggregate == None:
+            return
+        metrics.incr("aggregate.windows")
+        self.downstream.send(aggregate)
+
+    def tick(self, now=None):
+        '''
+        Sends the windows that ended lateness seconds before now, also for
+        devices which went quiet.
+        '''
+        if now == None:
+            clock = getClock()
+            now = clock.wallTime(clock.now())
+        now -= self.lateness
+        emit = []
+        with self._lock:
+            for (device, state) in self._devices.items():
+                if now < state[1]:
+                    continue
+                aggregate = self._aggregate(device, state)
+                emit.append(aggregate)
+                if self.sliding and aggregate != None:
+                    state[1] = self._windowEnd(now)
+                else:
+                    del self._devices[device]
+        for aggregate in emit:
+            self._emit(aggregate)
+
+    def _tickPeriodically(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                self.tick()
+            except Exception:
+                logging.exception("Aggregation failed")
+
+    def close(self, timeout=10.0):
+        '''
+        Sends the current (incomplete) windows and closes downstream.
+        '''
+        self._closed.set()
+        with self._lock:
+            emit = [ self._aggregate(device, state) for (device, state) in self._devices.items() ]
+            self._devices = {}
+        for aggregate in emit:
+            self._emit(aggregate)
+        self.downstream.close(timeout)
@@ -0,0 +1,648 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Native ATT transport.
+
+Instead of driving gatttool or bluepy-helper, this module talks the
+Attribute Protocol directly over a Linux L2CAP socket bound to the ATT
+fixed channel (CID 4). It contains
+
+ - a minimal PDU codec (encodeXxx / decodeXxx functions),
+ - AttClient, the request/response state machine plus the GATT discovery
+   procedures built on top of it,
+ - connectL2CAP(), which opens the socket,
+ - AttTransport, the bpcore.transport backend built from the above.
+
+AttClient only needs an object with send(), recv() and fileno(), so it can
+be driven by one end of socket.socketpair(socket.AF_UNIX,
+socket.SOCK_SEQPACKET) with the other end playing the peripheral.
+'''
+
+import os
+import time
+import errno
+import fcntl
+import select
+import socket
+import struct
+import binascii
+import ctypes
+import ctypes.util
+import logging
+from collections import deque
+
+from bpcore.gatt import BTLEException
+from bpcore.transport import Transport
+
+# Attribute protocol opcodes (Bluetooth Core Spec Vol 3, Part F, 3.4.8)
+ATT_OP_ERROR_RSP = 0x01
+ATT_OP_MTU_REQ = 0x02
+ATT_OP_MTU_RSP = 0x03
+ATT_OP_FIND_INFO_REQ = 0x04
+ATT_OP_FIND_INFO_RSP = 0x05
+ATT_OP_FIND_BY_TYPE_REQ = 0x06
+ATT_OP_FIND_BY_TYPE_RSP = 0x07
+ATT_OP_READ_BY_TYPE_REQ = 0x08
+ATT_OP_READ_BY_TYPE_RSP = 0x09
+ATT_OP_READ_REQ = 0x0A
+ATT_OP_READ_RSP = 0x0B
+ATT_OP_READ_BLOB_REQ = 0x0C
+ATT_OP_READ_BLOB_RSP = 0x0D
+ATT_OP_READ_BY_GROUP_REQ = 0x10
+ATT_OP_READ_BY_GROUP_RSP = 0x11
+ATT_OP_WRITE_REQ = 0x12
+ATT_OP_WRITE_RSP = 0x13
+ATT_OP_HANDLE_NOTIFY = 0x1B
+ATT_OP_HANDLE_IND = 0x1D
+ATT_OP_HANDLE_CNF = 0x1E
+ATT_OP_WRITE_CMD = 0x52
+
+ATT_ECODE_INVALID_HANDLE = 0x01
+ATT_ECODE_REQ_NOT_SUPP = 0x06
+ATT_ECODE_ATTR_NOT_FOUND = 0x0A
+
+ATT_DEFAULT_MTU = 23
+ATT_MAX_MTU = 517
+ATT_CID = 4
+ATT_TIMEOUT = 3.0
+
+GATT_PRIM_SVC_UUID = 0x2800
+GATT_INCLUDE_UUID = 0x2802
+GATT_CHARAC_UUID = 0x2803
+GATT_CLIENT_CHARAC_CFG_UUID = 0x2902
+
+# Linux Bluetooth socket constants (not exported by the socket module unless
+# Python was built against the bluez headers)
+AF_BLUETOOTH = 31
+BTPROTO_L2CAP = 0
+BTPROTO_HCI = 1
+SOL_BLUETOOTH = 274
+BT_SECURITY = 4
+BDADDR_LE_PUBLIC = 1
+BDADDR_LE_RANDOM = 2
+HCIGETDEVINFO = 0x800448D3
+
+SECURITY_LEVELS = {"low": 1, "medium": 2, "high": 3}
+
+BASE_UUID_SUFFIX = "00001000800000805f9b34fb"
+
+
+class AttError(Exception):
+    '''
+    The peripheral answered a request with an Error Response.
+    '''
+
+    def __init__(self, reqOpcode, handle, ecode):
+        self.reqOpcode = reqOpcode
+        self.handle = handle
+        self.ecode = ecode
+
+    def __str__(self):
+        return "ATT error 0x%02X on handle 0x%04X (request 0x%02X)" % (self.ecode, self.handle, self.reqOpcode)
+
+
+class AttTimeout(Exception):
+    '''
+    The peripheral did not answer a request in time.
+    '''
+    pass
+
+
+# ---------------------------------------------------------------------------
+# UUID helpers. UUIDs are exchanged as 32 digit hex strings, which is what
+# btle.UUID accepts; on the air they are little endian, 2 or 16 bytes.
+# ---------------------------------------------------------------------------
+
+def packUUID(val):
+    '''
+    Packs an int or a hex string (with or without '-') into its ATT form.
+    UUIDs derived from the Bluetooth base UUID are sent in their 16 bit form.
+    '''
+    if isinstance(val, (int, long)):
+        return struct.pack('<H', val)
+    s = str(val).replace('-', '').lower()
+    if len(s) <= 4:
+        return struct.pack('<H', int(s, 16))
+    if len(s) <= 8:
+        s = ("0" * (8 - len(s))) + s + BASE_UUID_SUFFIX
+    if len(s) != 32:
+        raise ValueError("UUID must be 16 bytes, got '%s'" % val)
+    if s.startswith("0000") and s.endswith(BASE_UUID_SUFFIX):
+        return struct.pack('<H', int(s[4:8], 16))
+    return binascii.a2b_hex(s)[::-1]
+
+
+def unpackUUID(data):
+    '''
+    Inverse of packUUID, always returns the 32 digit hex string.
+    '''
+    if len(data) == 2:
+        return "%08x%s" % (struct.unpack('<H', data)[0], BASE_UUID_SUFFIX)
+    if len(data) == 16:
+        return binascii.b2a_hex(data[::-1])
+    raise ValueError("Invalid UUID length %d" % len(data))
+
+
+# ---------------------------------------------------------------------------
+# PDU codec. Requests are encoded by the client, responses by whatever plays
+# the peripheral (a real device, the simulator or a test stand-in).
+# ---------------------------------------------------------------------------
+
+def opcode(pdu):
+    return ord(pdu[0])
+
+def encodeErrorRsp(reqOpcode, handle, ecode):
+    return struct.pack('<BBHB', ATT_OP_ERROR_RSP, reqOpcode, handle, ecode)
+
+def decodeErrorRsp(pdu):
+    (_, reqOpcode, handle, ecode) = struct.unpack('<BBHB', pdu[:5])
+    return (reqOpcode, handle, ecode)
+
+def encodeMtuReq(mtu):
+    return struct.pack('<BH', ATT_OP_MTU_REQ, mtu)
+
+def encodeMtuRsp(mtu):
+    return struct.pack('<BH', ATT_OP_MTU_RSP, mtu)
+
+def decodeMtu(pdu):
+    return struct.unpack('<H', pdu[1:3])[0]
+
+def encodeFindInfoReq(startHnd, endHnd):
+    return struct.pack('<BHH', ATT_OP_FIND_INFO_REQ, startHnd, endHnd)
+
+def encodeFindInfoRsp(infos):
+    '''
+    infos is a list of (handle, uuid). All uuids must pack to the same size.
+    '''
+    packed = [ (hnd, packUUID(uuid)) for (hnd, uuid) in infos ]
+    fmt = 1 if len(packed[0][1]) == 2 else 2
+    return struct.pack('<BB', ATT_OP_FIND_INFO_RSP, fmt) + ''.join([ struct.pack('<H', hnd) + u for (hnd, u) in packed ])
+
+def decodeFindInfoRsp(pdu):
+    step = 2 + (2 if ord(pdu[1]) == 1 else 16)
+    return [ (struct.unpack('<H', pdu[i:i+2])[0], unpackUUID(pdu[i+2:i+step]))
+             for i in range(2, len(pdu) - step + 1, step) ]
+
+def encodeFindByTypeReq(startHnd, endHnd, attType, value):
+    return struct.pack('<BHHH', ATT_OP_FIND_BY_TYPE_REQ, startHnd, endHnd, attType) + value
+
+def decodeFindByTypeReq(pdu):
+    (startHnd, endHnd, attType) = struct.unpack('<HHH', pdu[1:7])
+    return (startHnd, endHnd, attType, pdu[7:])
+
+def encodeFindByTypeRsp(ranges):
+    return chr(ATT_OP_FIND_BY_TYPE_RSP) + ''.join([ struct.pack('<HH', s, e) for (s, e) in ranges ])
+
+def decodeFindByTypeRsp(pdu):
+    return [ struct.unpack('<HH', pdu[i:i+4]) for i in range(1, len(pdu) - 3, 4) ]
+
+def encodeReadByTypeReq(startHnd, endHnd, uuid):
+    return struct.pack('<BHH', ATT_OP_READ_BY_TYPE_REQ, startHnd, endHnd) + packUUID(uuid)
+
+def encodeReadByGroupReq(startHnd, endHnd, uuid):
+    return struct.pack('<BHH', ATT_OP_READ_BY_GROUP_REQ, startHnd, endHnd) + packUUID(uuid)
+
+def decodeRangeReq(pdu):
+    '''
+    Decodes Find Information, Read By Type and Read By Group Type requests
+    into (startHnd, endHnd, uuid). uuid is None for Find Information.
+    '''
+    (startHnd, endHnd) = struct.unpack('<HH', pdu[1:5])
+    uuid = unpackUUID(pdu[5:]) if len(pdu) > 5 else None
+    return (startHnd, endHnd, uuid)
+
+def encodeReadByTypeRsp(items):
+    '''
+    items is a list of (handle, value), all values of the same length.
+    '''
+    return struct.pack('<BB', ATT_OP_READ_BY_TYPE_RSP, 2 + len(items[0][1])) + ''.join([ struct.pack('<H', h) + v for (h, v) in items ])
+
+def decodeReadByTypeRsp(pdu):
+    step = ord(pdu[1])
+    return [ (struct.unpack('<H', pdu[i:i+2])[0], pdu[i+2:i+step])
+             for i in range(2, len(pdu) - step + 1, step) ]
+
+def encodeReadByGroupRsp(items):
+    '''
+    items is a list of (startHnd, endHnd, value), all values of the same length.
+    '''
+    return struct.pack('<BB', ATT_OP_READ_BY_GROUP_RSP, 4 + len(items[0][2])) + ''.join([ struct.pack('<HH', s, e) + v for (s, e, v) in items ])
+
+def decodeReadByGroupRsp(pdu):
+    step = ord(pdu[1])
+    return [ struct.unpack('<HH', pdu[i:i+4]) + (pdu[i+4:i+step],)
+             for i in range(2, len(pdu) - step + 1, step) ]
+
+def encodeReadReq(handle):
+    return struct.pack('<BH', ATT_OP_READ_REQ, handle)
+
+def encodeReadBlobReq(handle, offset):
+    return struct.pack('<BHH', ATT_OP_READ_BLOB_REQ, handle, offset)
+
+def encodeReadRsp(value):
+    return chr(ATT_OP_READ_RSP) + value
+
+def encodeReadBlobRsp(value):
+    return chr(ATT_OP_READ_BLOB_RSP) + value
+
+def encodeWriteReq(handle, value):
+    return struct.pack('<BH', ATT_OP_WRITE_REQ, handle) + value
+
+def encodeWriteCmd(handle, value):
+    return struct.pack('<BH', ATT_OP_WRITE_CMD, handle) + value
+
+def encodeWriteRsp():
+    return chr(ATT_OP_WRITE_RSP)
+
+def encodeNotification(handle, value):
+    return struct.pack('<BH', ATT_OP_HANDLE_NOTIFY, handle) + value
+
+def encodeIndication(handle, value):
+    return struct.pack('<BH', ATT_OP_HANDLE_IND, handle) + value
+
+def decodeHandleValue(pdu):
+    '''
+    Decodes every PDU of the form opcode, handle, value: notifications,
+    indications, Read Request (value empty) and both write types.
+    '''
+    return (struct.unpack('<H', pdu[1:3])[0], pdu[3:])
+
+
+class AttClient(object):
+    '''
+    ATT client side of one connection.
+
+    ATT allows a single outstanding request per direction, so request()
+    sends a PDU and consumes incoming PDUs until the matching response or
+    error arrives. Notifications and indications received meanwhile are
+    queued and handed out by waitForNotification().
+    '''
+
+    def __init__(self, sock, timeout=ATT_TIMEOUT):
+        self._sock = sock
+        self.timeout = timeout
+        self.mtu = ATT_DEFAULT_MTU
+        self.notifications = deque()
+        # written to by interrupt() to wake up waitForNotification
+        (self._wakeRead, self._wakeWrite) = os.pipe()
+
+    def close(self):
+        if self._sock != None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+                fds = (self._wakeRead, self._wakeWrite)
+                self._wakeRead = self._wakeWrite = None # before closing, the numbers may be reused
+                for fd in fds:
+                    os.close(fd)
+
+    def interrupt(self):
+        fd = self._wakeWrite
+        if fd != None:
+            try:
+                os.write(fd, '\x00')
+            except OSError:
+                pass
+
+    def _recv(self, timeout, wake=False):
+        # Returns the next PDU, None on timeout or (with wake) if interrupted
+        (sock, wakeFd) = (self._sock, self._wakeRead) # close() may be called from another thread
+        if sock == None or wakeFd == None:
+            raise socket.error(errno.ENOTCONN, "ATT socket closed")
+        fds = [sock, wakeFd] if wake else [sock]
+        try:
+            (r, _, _) = select.select(fds, [], [], max(timeout, 0))
+        except select.error as e:
+            raise socket.error(*e.args)
+        if wakeFd in r:
+            try:
+                os.read(wakeFd, 4096)
+            except OSError as e: # closed meanwhile
+                raise socket.error(e.errno, "ATT socket closed")
+            return None
+        if not r:
+            return None
+        pdu = sock.recv(ATT_MAX_MTU)
+        if not pdu:
+            raise socket.error(errno.ENOTCONN, "Peripheral closed the connection")
+        return pdu
+
+    def _send(self, pdu):
+        if self._sock == None:
+            raise socket.error(errno.ENOTCONN, "ATT socket closed")
+        self._sock.send(pdu)
+
+    def _queueUnsolicited(self, pdu):
+        # Returns True if pdu was a notification or indication
+        op = opcode(pdu)
+        if op == ATT_OP_HANDLE_NOTIFY:
+            self.notifications.append(decodeHandleValue(pdu))
+        elif op == ATT_OP_HANDLE_IND:
+            self.notifications.append(decodeHandleValue(pdu))
+            self._send(chr(ATT_OP_HANDLE_CNF))
+        else:
+            return False
+        return True
+
+    def request(self, pdu):
+        '''
+        Sends a request PDU and returns the response PDU.
+        Raises AttError on an Error Response and AttTimeout if nothing arrives.
+        '''
+        reqOpcode = opcode(pdu)
+        self._send(pdu)
+        deadline = time.time() + self.timeout
+        while True:
+            rsp = self._recv(deadline - time.time())
+            if rsp == None:
+                raise AttTimeout("No response to request 0x%02X" % reqOpcode)
+            if self._queueUnsolicited(rsp):
+                continue
+            op = opcode(rsp)
+            if op == ATT_OP_ERROR_RSP:
+                (errOpcode, handle, ecode) = decodeErrorRsp(rsp)
+                if errOpcode == reqOpcode:
+                    raise AttError(errOpcode, handle, ecode)
+            elif op == reqOpcode + 1:
+                return rsp
+            # Anything else is a stray response to an earlier request, skip it
+
+    def waitForNotification(self, timeout):
+        '''
+        Returns the next (handle, value) notification or None after timeout seconds.
+        '''
+        deadline = time.time() + timeout
+        while not self.notifications:
+            pdu = self._recv(deadline - time.time(), wake=True)
+            if pdu == None:
+                return None
+            self._queueUnsolicited(pdu)
+        return self.notifications.popleft()
+
+    # GATT procedures ----------------------------------------------------
+
+    def exchangeMtu(self, mtu):
+        rsp = self.request(encodeMtuReq(mtu))
+        self.mtu = max(ATT_DEFAULT_MTU, min(mtu, decodeMtu(rsp)))
+        return self.mtu
+
+    def _iterate(self, startHnd, endHnd, encode, decode, lastHandle):
+        # Runs a discovery request repeatedly until the range is exhausted
+        result = []
+        while startHnd <= endHnd:
+            try:
+                rsp = self.request(encode(startHnd, endHnd))
+            except AttError as e:
+                if e.ecode == ATT_ECODE_ATTR_NOT_FOUND:
+                    break
+                raise
+            items = decode(rsp)
+            if not items:
+                break
+            result.extend(items)
+            last = lastHandle(items[-1])
+            if last >= endHnd:
+                break
+            startHnd = last + 1
+        return result
+
+    def discoverPrimaryServices(self, startHnd=1, endHnd=0xFFFF):
+        '''
+        Returns a list of (startHnd, endHnd, uuid) for all primary services.
+        '''
+        items = self._iterate(startHnd, endHnd,
+            lambda s, e: encodeReadByGroupReq(s, e, GATT_PRIM_SVC_UUID),
+            decodeReadByGroupRsp, lambda item: item[1])
+        return [ (s, e, unpackUUID(v)) for (s, e, v) in items ]
+
+    def discoverPrimaryServiceByUUID(self, uuid, startHnd=1, endHnd=0xFFFF):
+        '''
+        Returns a list of (startHnd, endHnd) of the primary services with the given uuid.
+        '''
+        value = packUUID(uuid)
+        return self._iterate(startHnd, endHnd,
+            lambda s, e: encodeFindByTypeReq(s, e, GATT_PRIM_SVC_UUID, value),
+            decodeFindByTypeRsp, lambda item: item[1])
+
+    def discoverCharacteristics(self, startHnd=1, endHnd=0xFFFF):
+        '''
+        Returns a list of (handle, properties, valueHandle, uuid).
+        '''
+        items = self._iterate(startHnd, endHnd,
+            lambda s, e: encodeReadByTypeReq(s, e, GATT_CHARAC_UUID),
+            decodeReadByTypeRsp, lambda item: item[0])
+        chars = []
+        for (hnd, value) in items:
+            (props, valHnd) = struct.unpack('<BH', value[:3])
+            chars.append((hnd, props, valHnd, unpackUUID(value[3:])))
+        return chars
+
+    def discoverDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        '''
+        Returns a list of (handle, uuid).
+        '''
+        return self._iterate(startHnd, endHnd, encodeFindInfoReq,
+            decodeFindInfoRsp, lambda item: item[0])
+
+    def readByType(self, uuid, startHnd=1, endHnd=0xFFFF):
+        '''
+        Returns a list of (handle, value) of all attributes of the given type.
+        '''
+        return self._iterate(startHnd, endHnd,
+            lambda s, e: encodeReadByTypeReq(s, e, uuid),
+            decodeReadByTypeRsp, lambda item: item[0])
+
+    def read(self, handle):
+        value = self.request(encodeReadReq(handle))[1:]
+        # A full PDU means the value may be longer, fetch the rest with blob reads
+        while len(value) > 0 and len(value) % (self.mtu - 1) == 0:
+            try:
+                part = self.request(encodeReadBlobReq(handle, len(value)))[1:]
+            except AttError as e:
+                if e.ecode in (ATT_ECODE_REQ_NOT_SUPP, 0x07, 0x0B): # not supported, invalid offset, not long
+                    break
+                raise
+            if not part:
+                break
+            value += part
+        return value
+
+    def write(self, handle, value, withResponse=True):
+        if withResponse:
+            self.request(encodeWriteReq(handle, value))
+        else:
+            self._send(encodeWriteCmd(handle, value))
+
+
+# ---------------------------------------------------------------------------
+# L2CAP socket setup. Done through libc because the socket module can only
+# address L2CAP channels by PSM, not by the fixed ATT CID.
+# ---------------------------------------------------------------------------
+
+class _SockaddrL2(ctypes.Structure):
+    _fields_ = [ ('l2_family', ctypes.c_ushort),
+                 ('l2_psm', ctypes.c_ushort),
+                 ('l2_bdaddr', ctypes.c_ubyte * 6),
+                 ('l2_cid', ctypes.c_ushort),
+                 ('l2_bdaddr_type', ctypes.c_ubyte) ]
+
+_libc = None
+
+def _getLibc():
+    global _libc
+    if _libc == None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+def _socketError(what):
+    err = ctypes.get_errno()
+    return socket.error(err, "%s: %s" % (what, os.strerror(err)))
+
+def _bdaddr(addr):
+    if len(addr.split(":")) != 6:
+        raise ValueError("Expected MAC address, got %s" % repr(addr))
+    return (ctypes.c_ubyte * 6)(*[ int(b, 16) for b in reversed(addr.split(":")) ])
+
+def adapterAddress(iface):
+    '''
+    Returns the MAC address of an adapter given as 'hciN' or N.
+    '''
+    devId = int(str(iface).replace("hci", ""))
+    fd = _getLibc().socket(AF_BLUETOOTH, socket.SOCK_RAW, BTPROTO_HCI)
+    if fd < 0:
+        raise _socketError("HCI socket")
+    try:
+        buf = bytearray(struct.pack('<H', devId) + "\0" * 90)
+        fcntl.ioctl(fd, HCIGETDEVINFO, buf)
+    finally:
+        os.close(fd)
+    return ":".join([ "%02X" % b for b in reversed(buf[10:16]) ])
+
+def connectL2CAP(addr, addrType="public", iface=None, timeout=5.0, security=None):
+    '''
+    Opens an LE L2CAP connection on the ATT channel to addr and returns it
+    as a socket object. iface selects the local adapter ('hciN'), the kernel
+    picks one if it is None.
+    '''
+    libc = _getLibc()
+    src = _bdaddr(adapterAddress(iface)) if iface != None else (ctypes.c_ubyte * 6)()
+    dstType = BDADDR_LE_RANDOM if addrType == "random" else BDADDR_LE_PUBLIC
+
+    fd = libc.socket(AF_BLUETOOTH, socket.SOCK_SEQPACKET, BTPROTO_L2CAP)
+    if fd < 0:
+        raise _socketError("L2CAP socket")
+    try:
+        local = _SockaddrL2(AF_BLUETOOTH, 0, src, ATT_CID, BDADDR_LE_PUBLIC)
+        if libc.bind(fd, ctypes.byref(local), ctypes.sizeof(local)) < 0:
+            raise _socketError("bind")
+        sock = socket.fromfd(fd, AF_BLUETOOTH, socket.SOCK_SEQPACKET, BTPROTO_L2CAP)
+    finally:
+        os.close(fd) # fromfd made a duplicate
+    try:
+        if security != None:
+            setSecurityLevel(sock, security)
+        # Non-blocking connect so that an absent peripheral can't hang us
+        fcntl.fcntl(sock.fileno(), fcntl.F_SETFL, fcntl.fcntl(sock.fileno(), fcntl.F_GETFL) | os.O_NONBLOCK)
+        remote = _SockaddrL2(AF_BLUETOOTH, 0, _bdaddr(addr), ATT_CID, dstType)
+        if libc.connect(sock.fileno(), ctypes.byref(remote), ctypes.sizeof(remote)) < 0:
+            if ctypes.get_errno() not in (errno.EINPROGRESS, errno.EAGAIN):
+                raise _socketError("connect")
+            (_, w, _) = select.select([], [sock], [], timeout)
+            if not w:
+                raise socket.timeout("Connection to %s timed out" % addr)
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err != 0:
+                raise socket.error(err, "connect: %s" % os.strerror(err))
+        sock.setblocking(1)
+        return sock
+    except:
+        sock.close()
+        raise
+
+def setSecurityLevel(sock, level):
+    sock.setsockopt(SOL_BLUETOOTH, BT_SECURITY, struct.pack('BB', SECURITY_LEVELS[level], 0))
+
+
+class AttTransport(Transport):
+    '''
+    Transport backend speaking ATT over an L2CAP socket, no helper process involved.
+    '''
+
+    name = "att"
+
+    def __init__(self, iface=None, addrType="public", timeout=ATT_TIMEOUT, connectTimeout=5.0):
+        Transport.__init__(self, iface)
+        self.addrType = addrType
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self._att = None
+
+    def _openSocket(self, addr):
+        return connectL2CAP(addr, self.addrType, self.iface, self.connectTimeout)
+
+    def _call(self, func, *args):
+        # Runs func(AttClient, *args), mapping its errors onto BTLEException
+        client = self._att # disconnect() may be called from another thread
+        if client == None:
+            raise BTLEException(BTLEException.DISCONNECTED, "Not connected (did you call connect()?)")
+        try:
+            return func(client, *args)
+        except AttError as e:
+            raise BTLEException(BTLEException.COMM_ERROR, "Error from Bluetooth stack (%s)" % e)
+        except (AttTimeout, socket.error) as e:
+            logging.debug("ATT connection lost: %s" % e)
+            self.disconnect()
+            raise BTLEException(BTLEException.DISCONNECTED, "Device disconnected")
+
+    def connect(self, addr):
+        try:
+            sock = self._openSocket(addr)
+        except socket.error as e:
+            logging.debug("ATT connect to %s failed: %s" % (addr, e))
+            raise BTLEException(BTLEException.DISCONNECTED, "Failed to connect to peripheral")
+        self._att = AttClient(sock, self.timeout)
+
+    def disconnect(self):
+        (client, self._att) = (self._att, None)
+        if client != None:
+            client.close()
+
+    def isConnected(self):
+        return self._att != None
+
+    def discoverServices(self, uuid=None):
+        if uuid != None:
+            return [ (s, e, uuid) for (s, e) in self._call(AttClient.discoverPrimaryServiceByUUID, uuid) ]
+        return self._call(AttClient.discoverPrimaryServices)
+
+    def discoverCharacteristics(self, startHnd=1, endHnd=0xFFFF):
+        return self._call(AttClient.discoverCharacteristics, startHnd, endHnd)
+
+    def discoverDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        return self._call(AttClient.discoverDescriptors, startHnd, endHnd)
+
+    def read(self, handle):
+        return self._call(AttClient.read, handle)
+
+    def write(self, handle, value, withResponse=True):
+        self._call(AttClient.write, handle, value, withResponse)
+
+    def waitForNotification(self, timeout):
+        return self._call(AttClient.waitForNotification, timeout)
+
+    def interrupt(self):
+        client = self._att
+        if client != None:
+            client.interrupt()
+
+    def setSecurityLevel(self, level):
+        self._call(lambda client, level: setSecurityLevel(client._sock, level), level)
+
+    def setMTU(self, mtu):
+        return self._call(AttClient.exchangeMtu, mtu)
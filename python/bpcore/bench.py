@@ -0,0 +1,100 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Runs the same bPart workload against one or more transport backends and
+prints how long every phase took, e.g.
+
+    python -m bpcore.bench --addr 00:07:80:78:FA:5A helper gatttool att
+    python -m bpcore.bench sim
+'''
+
+import sys
+import time
+import argparse
+from collections import OrderedDict
+
+from bpcore.gatt import Peripheral, BTLEException, UUID
+from bpcore.transport import getTransport, TRANSPORTS
+from bpcore.sensors import SENSORS, serviceUUID, valueUUID, configUUID
+from bpcore import att
+
+
+def runWorkload(transport, addr, reads=20, notifications=20, timeout=10.0):
+    '''
+    Connects, discovers, enables all sensors, reads every value
+    characteristic reads times and waits for the given number of
+    notifications. Returns an OrderedDict phase -> seconds.
+    '''
+    timings = OrderedDict()
+    periph = Peripheral(transport)
+
+    t = time.time()
+    periph.connect(addr)
+    timings['connect'] = time.time() - t
+    try:
+        t = time.time()
+        for svc in periph.getServices():
+            svc.getCharacteristics()
+        timings['discover'] = time.time() - t
+
+        t = time.time()
+        values = []
+        for (name, offset) in SENSORS:
+            svc = periph.getServiceByUUID(serviceUUID(offset))
+            svc.getCharacteristics(configUUID(offset))[0].write('\x01', True)
+            value = svc.getCharacteristics(valueUUID(offset))[0]
+            values.append(value)
+            for desc in periph.getDescriptors(value.valHandle + 1, svc.hndEnd):
+                if desc.uuid == UUID(att.GATT_CLIENT_CHARAC_CFG_UUID):
+                    periph.writeCharacteristic(desc.handle, '\x01\x00', True)
+                    break
+        timings['enable'] = time.time() - t
+
+        t = time.time()
+        for i in range(reads):
+            for value in values:
+                value.read()
+        timings['read x%d' % (reads * len(values))] = time.time() - t
+
+        t = time.time()
+        received = 0
+        deadline = t + timeout
+        while received < notifications and time.time() < deadline:
+            if periph.waitForNotification(deadline - time.time()) != None:
+                received += 1
+        timings['notify x%d' % received] = time.time() - t
+    finally:
+        t = time.time()
+        periph.disconnect()
+        timings['disconnect'] = time.time() - t
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark bPart transport backends")
+    parser.add_argument("backends", nargs="+", choices=sorted(TRANSPORTS))
+    parser.add_argument("--addr", default="00:07:80:78:FA:5A")
+    parser.add_argument("--iface", default=None)
+    parser.add_argument("--reads", type=int, default=20)
+    parser.add_argument("--notifications", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    for backend in args.backends:
+        for i in range(args.repeat):
+            try:
+                timings = runWorkload(getTransport(backend, iface=args.iface), args.addr, args.reads, args.notifications)
+            except BTLEException as e:
+                print "%-10s failed: %s" % (backend, e)
+                continue
+            print "%-10s %s  total %.3fs" % (backend,
+                "  ".join([ "%s %.3fs" % (k, v) for (k, v) in timings.items() ]), sum(timings.values()))
+
+
+if __name__ == "__main__":
+    main()
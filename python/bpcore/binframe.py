@@ -0,0 +1,288 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Compact binary uplink frames.
+
+A frame carries a batch of samples of any number of devices:
+
+    header  "BPF", version (uint8), flags (uint8), count (uint16),
+            base time (float64, seconds since the epoch)      little endian
+    body    device count (uint8), 6 byte address per device,
+            then per sample: device index, time delta to the previous
+            sample in ms, and one delta per field of the schema to the
+            previous sample of the same device, all as varints
+
+Field values are fixed point integers (value * scale, see SCHEMAS), deltas
+are zigzag encoded so small changes in either direction take one byte.
+With FLAG_ZLIB set the body is zlib compressed. A sample takes about a
+dozen bytes instead of the ~300 of a CUMULUS JSON document.
+
+Running this module starts a receiver for testing:
+
+    python -m bpcore.binframe --port 8080
+'''
+
+import sys
+import zlib
+import json
+import struct
+import logging
+import argparse
+import binascii
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from bpcore.samples import Sample
+
+MAGIC = "BPF"
+VERSION = 1
+FLAG_ZLIB = 0x01
+
+_HEADER = struct.Struct('<3sBBHd')
+
+# version -> [(field, scale)], the field order of the frame
+SCHEMAS = {
+    1: [("temperature", 1000), ("humidity", 1), ("light", 1), ("accelX", 16000), ("accelY", 16000), ("accelZ", 16000)],
+}
+
+class FrameError(Exception):
+    pass
+
+
+def _putVarint(buf, n):
+    while n > 0x7F:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def _putSigned(buf, n):
+    _putVarint(buf, (n << 1) ^ (n >> 63))
+
+def _getVarint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        try:
+            b = data[pos]
+        except IndexError:
+            raise FrameError("Truncated frame")
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return (result, pos)
+        shift += 7
+
+def _getSigned(data, pos):
+    (n, pos) = _getVarint(data, pos)
+    return ((n >> 1) ^ -(n & 1), pos)
+
+def _fields(sample):
+    (x, y, z) = sample.acceleration
+    return (sample.temperature, sample.humidity, sample.light, x, y, z)
+
+def _addrBytes(addr):
+    return binascii.a2b_hex(addr.replace(':', ''))
+
+def _addrString(raw):
+    return ':'.join([ binascii.b2a_hex(raw[i:i + 1]).upper() for i in range(6) ])
+
+
+def encode(samples, compress=False, version=VERSION):
+    '''
+    Encodes a list of Samples into one frame (byte string).
+    '''
+    scales = [ scale for (name, scale) in SCHEMAS[version] ]
+    if len(samples) > 0xFFFF:
+        raise ValueError("Too many samples for one frame")
+    base = samples[0].timestamp if samples else 0.0
+    devices = {}
+    order = []
+    for s in samples:
+        if s.device not in devices:
+            devices[s.device] = len(order)
+            order.append(s.device)
+    if len(order) > 0xFF:
+        raise ValueError("Too many devices for one frame")
+
+    body = bytearray([len(order)])
+    for addr in order:
+        body.extend(_addrBytes(addr))
+    lastTime = int(round(base * 1000))
+    last = {}
+    for s in samples:
+        idx = devices[s.device]
+        _putVarint(body, idx)
+        t = int(round(s.timestamp * 1000))
+        _putSigned(body, t - lastTime)
+        lastTime = t
+        prev = last.get(idx, [0] * len(scales))
+        cur = [ int(round(v * scale)) for (v, scale) in zip(_fields(s), scales) ]
+        for (c, p) in zip(cur, prev):
+            _putSigned(body, c - p)
+        last[idx] = cur
+
+    flags = 0
+    body = str(body)
+    if compress:
+        body = zlib.compress(body)
+        flags |= FLAG_ZLIB
+    return _HEADER.pack(MAGIC, version, flags, len(samples), base) + body
+
+
+def decode(frame):
+    '''
+    Decodes a frame into a list of Samples. Raises FrameError on malformed input.
+    '''
+    if len(frame) < _HEADER.size:
+        raise FrameError("Frame too short")
+    (magic, version, flags, count, base) = _HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise FrameError("Not a bpart frame")
+    if version not in SCHEMAS:
+        raise FrameError("Unknown frame version %d" % version)
+    scales = [ scale for (name, scale) in SCHEMAS[version] ]
+    body = frame[_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise FrameError("Bad compressed body (%s)" % e)
+    data = bytearray(body)
+    if not data:
+        raise FrameError("Truncated frame")
+    ndev = data[0]
+    pos = 1 + 6 * ndev
+    if len(data) < pos:
+        raise FrameError("Truncated frame")
+    addrs = [ _addrString(body[1 + 6 * i:7 + 6 * i]) for i in range(ndev) ]
+
+    samples = []
+    t = int(round(base * 1000))
+    last = {}
+    for i in range(count):
+        (idx, pos) = _getVarint(data, pos)
+        if idx >= ndev:
+            raise FrameError("Bad device index %d" % idx)
+        (dt, pos) = _getSigned(data, pos)
+        t += dt
+        values = list(last.get(idx, [0] * len(scales)))
+        for j in range(len(scales)):
+            (d, pos) = _getSigned(data, pos)
+            values[j] += d
+        last[idx] = values
+        (temperature, humidity, light, x, y, z) = [ v if scale == 1 else v / float(scale)
+                                                    for (v, scale) in zip(values, scales) ]
+        samples.append(Sample(addrs[idx], t / 1000.0, temperature, humidity, light, (x, y, z)))
+    return samples
+
+
+class _ReceiverHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # POST: binary frame, PUT /<path>/<mac>: CUMULUS JSON document
+
+    protocol_version = "HTTP/1.1" # keep-alive
+    wbufsize = -1 # one send per response instead of one per header line
+    disable_nagle_algorithm = True
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        body = self._body()
+        try:
+            samples = decode(body)
+        except FrameError as e:
+            self.send_error(400, str(e))
+            return
+        self.server.received(samples, len(body), self.client_address)
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        body = self._body()
+        try:
+            data = json.loads(body)['data']
+        except (ValueError, KeyError) as e:
+            self.send_error(400, str(e))
+            return
+        mac = self.path.rstrip('/').split('/')[-1]
+        mac = ':'.join([ mac[i:i + 2] for i in range(0, 12, 2) ]).upper()
+        value = lambda name: float(data[name]['value'])
+        self.server.received([ Sample(mac, None, value('Temperature'), value('Humidity'), value('Light'),
+                                      (value('AccelX'), value('AccelY'), value('AccelZ'))) ], len(body), self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write("OK")
+
+    def log_message(self, fmt, *args):
+        logging.debug("Receiver: " + fmt % args)
+
+
+class Receiver(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Local stand-in for the uplink server, accepts binary frames (POST) and
+    CUMULUS JSON (PUT). Received samples are passed to callback(samples,
+    size) and kept in self.samples.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), callback=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _ReceiverHandler)
+        self.callback = callback
+        self.samples = []
+        self.bytes = 0
+        self.clients = set() # client addresses seen, one per connection
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%d/" % self.server_address
+
+    def received(self, samples, size, client=None):
+        with self._lock:
+            self.samples.extend(samples)
+            self.bytes += size
+            self.clients.add(client)
+        if self.callback != None:
+            self.callback(samples, size)
+
+    def start(self):
+        '''
+        Serves in a background thread.
+        '''
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receive and print bpart uplink data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    def show(samples, size):
+        print "%d samples, %d bytes" % (len(samples), size)
+        for s in samples:
+            print "  ", s
+        sys.stdout.flush()
+
+    server = Receiver((args.host, args.port), show)
+    print "Listening on %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Live samples for other processes on the gateway, through shared memory.
+
+The gateway writes every sample into a ring of fixed size records in a
+memory mapped file (config.SAMPLE_BUS, e.g. on /dev/shm); any number of
+local processes read them from there without locks, sockets or copies
+through the kernel. The file, little endian:
+
+    header  "BPBUS\\0\\0\\0", version (uint32), record size (uint32),
+            slots (uint32), 4 pad bytes, epoch (uint64, random per run),
+            head (uint64, records written so far), padded to 64 bytes
+    slot i  sequence (uint64), address (6 bytes), 2 pad bytes, timestamp,
+            temperature, humidity, light, acceleration x, y, z (float64)
+
+Record n is in slot n % slots. Its sequence is 2n+1 while it is written
+and 2n+2 once it is complete; a reader takes a copy of the record and
+accepts it if the sequence was 2n+2 before and after (a seqlock). Readers
+that fall more than slots records behind lose the oldest ones, the writer
+never waits for them. A restarted gateway writes a new file (it replaces
+the old one), readers switch over to it by themselves.
+
+Reading in Python:
+
+    reader = BusReader("/dev/shm/bpart.bus")
+    while True:
+        sample = reader.read(timeout=1.0)     # blocking, None on timeout
+                                              # (spin=0.01 for latency in microseconds)
+        ...
+    reader.readAvailable()                    # what is there, without waiting
+
+Running this module prints the samples on the bus:
+
+    python -m bpcore.bus /dev/shm/bpart.bus
+'''
+
+import os
+import sys
+import mmap
+import time
+import random
+import struct
+import binascii
+import threading
+
+from bpcore import metrics
+from bpcore.samples import Sample
+
+MAGIC = "BPBUS\0\0\0"
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIII4xQQ')
+HEADER_SIZE = 64
+_HEAD_OFFSET = 32 # offset of head in the header
+_SEQ = struct.Struct('<Q')
+_BODY = struct.Struct('<6s2xddddddd')
+RECORD_SIZE = _SEQ.size + _BODY.size
+
+# A blocking read polls the head; it spins this long before it starts sleeping between polls
+SPIN = 0.001
+POLL_INTERVAL = 0.0005
+# Seconds between two checks of an idle reader whether the file was replaced
+REOPEN_INTERVAL = 1.0
+
+
+class BusError(Exception):
+    pass
+
+
+def _addrBytes(addr):
+    return binascii.a2b_hex(addr.replace(':', ''))
+
+def _addrString(raw):
+    return ':'.join([ binascii.b2a_hex(c) for c in raw ]).upper()
+
+
+class SampleBus(object):
+    '''
+    The writing end. There must be one per file; publish() may be called
+    from several threads of the process.
+    '''
+
+    def __init__(self, path, slots=1024):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        size = HEADER_SIZE + slots * RECORD_SIZE
+        # a new file, readers still mapping the one of a previous run must not see it shrink (SIGBUS)
+        tmp = path + ".tmp"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.head = 0
+        self.epoch = random.getrandbits(64)
+        _HEADER.pack_into(self._mm, 0, MAGIC, VERSION, RECORD_SIZE, slots, self.epoch, 0)
+        os.rename(tmp, path)
+
+    def publish(self, sample):
+        (x, y, z) = sample.acceleration
+        with self._lock:
+            n = self.head
+            offset = HEADER_SIZE + (n % self.slots) * RECORD_SIZE
+            _SEQ.pack_into(self._mm, offset, 2 * n + 1)
+            _BODY.pack_into(self._mm, offset + _SEQ.size, _addrBytes(sample.device), sample.timestamp,
+                            sample.temperature, sample.humidity, sample.light, x, y, z)
+            _SEQ.pack_into(self._mm, offset, 2 * n + 2)
+            self.head = n + 1
+            _SEQ.pack_into(self._mm, _HEAD_OFFSET, n + 1)
+        metrics.incr("bus.published")
+
+    def close(self):
+        self._mm.close()
+
+
+class BusReader(object):
+    '''
+    A reading end. Starts with the next sample published, or with the
+    oldest one still on the bus if fromStart is set. missed counts the
+    samples lost by falling behind.
+    '''
+
+    def __init__(self, path, fromStart=False):
+        self.path = path
+        self.fromStart = fromStart
+        self.missed = 0
+        self._mm = None
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            self._ino = os.fstat(f.fileno()).st_ino
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._checked = time.time()
+        if len(self._mm) < HEADER_SIZE:
+            raise BusError("%s is not a sample bus" % self.path)
+        (magic, version, recordSize, slots, epoch, head) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or recordSize != RECORD_SIZE:
+            raise BusError("%s is not a sample bus of version %d" % (self.path, VERSION))
+        self.slots = slots
+        self.epoch = epoch
+        self.next = max(head - slots, 0) if self.fromStart else head
+
+    def _head(self):
+        return _SEQ.unpack_from(self._mm, _HEAD_OFFSET)[0]
+
+    def _reopenIfReplaced(self):
+        # Switches to the file of a restarted gateway; True if it did
+        if time.time() - self._checked < REOPEN_INTERVAL:
+            return False
+        self._checked = time.time()
+        try:
+            if os.stat(self.path).st_ino == self._ino:
+                return False
+            mm = self._mm
+            self.fromStart = True
+            self._open()
+        except (OSError, IOError, BusError):
+            return False # in the middle of being replaced, next time
+        mm.close()
+        return True
+
+    def _readRecord(self, n):
+        # Returns record n, None if it is not complete yet; skips ahead if it has been overwritten
+        offset = HEADER_SIZE + (n % self.slots) * RECORD_SIZE
+        before = _SEQ.unpack_from(self._mm, offset)[0]
+        body = self._mm[offset + _SEQ.size:offset + RECORD_SIZE]
+        after = _SEQ.unpack_from(self._mm, offset)[0]
+        if before == after == 2 * n + 2:
+            (addr, t, temperature, humidity, light, x, y, z) = _BODY.unpack(body)
+            return Sample(_addrString(addr), t, temperature, humidity, light, (x, y, z))
+        if before > 2 * n + 2 or after > 2 * n + 2:
+            raise IndexError(n) # overwritten
+        return None
+
+    def poll(self):
+        '''
+        Returns the next sample if there is one, otherwise None.
+        '''
+        while True:
+            head = self._head()
+            if self.next >= head:
+                if self._reopenIfReplaced():
+                    continue
+                return None
+            if head - self.next > self.slots:
+                self.missed += head - self.slots - self.next
+                self.next = head - self.slots
+            try:
+                sample = self._readRecord(self.next)
+            except IndexError:
+                self.missed += 1
+                self.next += 1
+                continue
+            if sample == None:
+                return None
+            self.next += 1
+            return sample
+
+    def read(self, timeout=None, spin=SPIN):
+        '''
+        Waits for the next sample, at most timeout seconds (None waits forever);
+        None on timeout. It polls without sleeping for the first spin seconds,
+        a longer spin gets the samples sooner for more CPU time.
+        '''
+        start = time.time()
+        while True:
+            sample = self.poll()
+            if sample != None:
+                return sample
+            waited = time.time() - start
+            if timeout != None and waited >= timeout:
+                return None
+            if waited >= spin:
+                time.sleep(POLL_INTERVAL)
+
+    def readAvailable(self):
+        '''
+        Returns all samples published since the last read, without waiting.
+        '''
+        samples = []
+        sample = self.poll()
+        while sample != None:
+            samples.append(sample)
+            sample = self.poll()
+        return samples
+
+    def close(self):
+        self._mm.close()
+
+
+_bus = None
+_lock = threading.Lock()
+
+def getBus(path, slots=1024):
+    '''
+    Returns the SampleBus of the process (config.SAMPLE_BUS), None if path is None.
+    '''
+    global _bus
+    if not path:
+        return None
+    with _lock:
+        if _bus == None:
+            _bus = SampleBus(path, slots)
+        return _bus
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Print the samples on a bpart sample bus")
+    parser.add_argument("path", nargs="?", default="/dev/shm/bpart.bus")
+    parser.add_argument("--from-start", action="store_true", help="start with the oldest sample on the bus")
+    args = parser.parse_args(argv)
+
+    reader = BusReader(args.path, args.from_start)
+    try:
+        while True:
+            sample = reader.read(1.0)
+            if sample != None:
+                print sample
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    if reader.missed:
+        print "%d samples missed" % reader.missed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Capture of the BLE traffic of a gateway, and its replay.
+
+RecordingTransport wraps any transport and logs every call, its result or
+exception with timestamps into a capture file. ReplayTransport ("replay"
+backend) plays a capture back to the same code, at the original speed,
+faster, or as fast as possible:
+
+    BACKEND = "replay"
+    BACKEND_OPTIONS = {"path": "field.bpcap", "speed": 0}
+
+Every connect() of a device starts the next recorded session of that
+address; a session ends at the next connect of the recorded transport.
+
+The file starts with "BPCAP", a version byte and the start time (float64);
+then follow records of kind (uint8), stream (uint16, one per recorded
+transport), time (float64) and length (uint32), all little endian, and a
+marshalled payload:
+
+    OPEN    (backend, iface)
+    CALL    (method, args)
+    RETURN  result
+    ERROR   (exception class name, BTLEException code or None, message)
+
+    python -m bpcore.capture field.bpcap
+prints the sessions of a capture.
+'''
+
+import sys
+import time
+import struct
+import marshal
+import logging
+import threading
+from collections import defaultdict, deque
+
+from bpcore import metrics
+from bpcore.gatt import BTLEException
+from bpcore.transport import Transport
+
+MAGIC = "BPCAP"
+VERSION = 1
+
+OPEN = 0
+CALL = 1
+RETURN = 2
+ERROR = 3
+
+_FILE_HEADER = struct.Struct('<5sBd')
+_RECORD = struct.Struct('<BHdI')
+
+FLUSH_INTERVAL = 1.0
+
+
+def _plain(value):
+    # marshal only takes builtin types; anything else is stored as its str()
+    if isinstance(value, (list, tuple)):
+        return type(value)([ _plain(v) for v in value ])
+    if value == None or isinstance(value, (bool, int, long, float, str, unicode)):
+        return value
+    return str(value)
+
+
+class CaptureWriter(object):
+    '''
+    Appends records of any number of streams to one capture file.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(_FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self._lock = threading.Lock()
+        self._streams = 0
+        self._flushed = time.time()
+
+    def openStream(self, backend, iface):
+        with self._lock:
+            self._streams += 1
+            stream = self._streams
+        self.write(OPEN, stream, (backend, iface))
+        return stream
+
+    def write(self, kind, stream, payload):
+        try:
+            data = marshal.dumps(payload)
+        except ValueError:
+            data = marshal.dumps(_plain(payload))
+        now = time.time()
+        with self._lock:
+            if self._file == None:
+                return
+            self._file.write(_RECORD.pack(kind, stream, now, len(data)) + data)
+            if now - self._flushed > FLUSH_INTERVAL:
+                self._file.flush()
+                self._flushed = now
+        metrics.incr("capture.records")
+
+    def close(self):
+        with self._lock:
+            if self._file != None:
+                self._file.close()
+                self._file = None
+
+
+def readRecords(path):
+    '''
+    Yields (kind, stream, time, payload) of every record of a capture file.
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(_FILE_HEADER.size)
+        if len(head) < _FILE_HEADER.size or _FILE_HEADER.unpack(head)[0] != MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+        (magic, version, start) = _FILE_HEADER.unpack(head)
+        if version != VERSION:
+            raise ValueError("Unknown capture version %d" % version)
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return # a truncated last record is ignored, the gateway may have been killed
+            (kind, stream, t, length) = _RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield (kind, stream, t, marshal.loads(data))
+
+
+_writers = {}
+_writersLock = threading.Lock()
+
+def getWriter(path):
+    '''
+    Returns the CaptureWriter shared by all transports of the process.
+    '''
+    with _writersLock:
+        if path not in _writers:
+            _writers[path] = CaptureWriter(path)
+        return _writers[path]
+
+def closeWriters():
+    '''
+    Closes the capture files of the process, on shutdown.
+    '''
+    with _writersLock:
+        for writer in _writers.values():
+            writer.close()
+
+
+class RecordingTransport(Transport):
+    '''
+    Passes every call on to transport and records it.
+    '''
+
+    def __init__(self, transport, writer):
+        Transport.__init__(self, transport.iface)
+        self.transport = transport
+        self.name = transport.name
+        self._writer = writer
+        self._stream = writer.openStream(transport.name, transport.iface)
+
+    def _call(self, method, *args):
+        self._writer.write(CALL, self._stream, (method, args))
+        try:
+            result = getattr(self.transport, method)(*args)
+        except Exception as e:
+            self._writer.write(ERROR, self._stream, (e.__class__.__name__, getattr(e, 'code', None), str(e)))
+            raise
+        self._writer.write(RETURN, self._stream, result)
+        return result
+
+    def connect(self, addr):
+        return self._call('connect', addr)
+
+    def disconnect(self):
+        return self._call('disconnect')
+
+    def isConnected(self):
+        return self._call('isConnected')
+
+    def discoverServices(self, uuid=None):
+        return self._call('discoverServices', uuid)
+
+    def discoverCharacteristics(self, startHnd=1, endHnd=0xFFFF):
+        return self._call('discoverCharacteristics', startHnd, endHnd)
+
+    def discoverDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        return self._call('discoverDescriptors', startHnd, endHnd)
+
+    def read(self, handle):
+        return self._call('read', handle)
+
+    def write(self, handle, value, withResponse=True):
+        return self._call('write', handle, value, withResponse)
+
+    def waitForNotification(self, timeout):
+        return self._call('waitForNotification', timeout)
+
+    def interrupt(self):
+        self.transport.interrupt() # not recorded, replays don't need it
+
+    def setSecurityLevel(self, level):
+        return self._call('setSecurityLevel', level)
+
+    def setMTU(self, mtu):
+        return self._call('setMTU', mtu)
+
+
+class Session(object):
+    '''
+    The calls of one recorded connection: a list of (method, args, start,
+    end, kind, result).
+    '''
+
+    def __init__(self, addr, start):
+        self.addr = addr
+        self.start = start
+        self.calls = []
+
+    @property
+    def duration(self):
+        return self.calls[-1][3] - self.start if self.calls else 0.0
+
+
+class Capture(object):
+    '''
+    A capture file split into sessions per device address.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.sessions = []
+        current = {}  # stream -> Session
+        pending = {}  # stream -> (method, args, start)
+        for (kind, stream, t, payload) in readRecords(path):
+            if kind == CALL:
+                (method, args) = payload
+                if method == 'connect':
+                    current[stream] = Session(args[0], t)
+                    self.sessions.append(current[stream])
+                pending[stream] = (method, tuple(args), t)
+            elif kind in (RETURN, ERROR) and stream in pending:
+                (method, args, start) = pending.pop(stream)
+                if stream in current:
+                    current[stream].calls.append((method, args, start, t, kind, payload))
+        self._queues = defaultdict(deque)
+        for session in self.sessions:
+            self._queues[session.addr].append(session)
+        self._lock = threading.Lock()
+
+    def nextSession(self, addr):
+        '''
+        Returns the next unplayed session of addr, None if there is none left.
+        '''
+        with self._lock:
+            queue = self._queues[addr]
+            return queue.popleft() if queue else None
+
+    def remaining(self):
+        with self._lock:
+            return sum([ len(q) for q in self._queues.values() ])
+
+
+_captures = {}
+_capturesLock = threading.Lock()
+
+def getCapture(path):
+    with _capturesLock:
+        if path not in _captures:
+            _captures[path] = Capture(path)
+        return _captures[path]
+
+
+class ReplayTransport(Transport):
+    '''
+    Transport backend playing back a capture. speed scales the recorded
+    timing (2.0 plays twice as fast); 0 or None plays as fast as possible.
+    Calls are matched to the recording by method; recorded calls the code
+    does not make are skipped.
+    '''
+
+    name = "replay"
+
+    def __init__(self, iface=None, path=None, speed=1.0):
+        Transport.__init__(self, iface)
+        if path == None:
+            raise BTLEException(BTLEException.INTERNAL_ERROR, "replay backend needs the path of a capture")
+        self.capture = getCapture(path)
+        self.speed = speed
+        self._session = None
+        self._pos = 0
+        self._base = 0.0
+        self._interrupted = threading.Event()
+
+    def _play(self, method):
+        if self._session == None:
+            raise BTLEException(BTLEException.DISCONNECTED, "Not connected")
+        calls = self._session.calls
+        while self._pos < len(calls) and calls[self._pos][0] != method:
+            self._pos += 1
+            metrics.incr("replay.skipped")
+        if self._pos >= len(calls):
+            self._session = None
+            raise BTLEException(BTLEException.DISCONNECTED, "End of the recorded session")
+        (method, args, start, end, kind, result) = calls[self._pos]
+        self._pos += 1
+        if self.speed:
+            delay = self._base + (end - self._session.start) / self.speed - time.time()
+            if delay > 0:
+                self._interrupted.wait(delay)
+        metrics.incr("replay.calls")
+        if kind == ERROR:
+            (clsName, code, message) = result
+            if clsName == 'BTLEException' and code == BTLEException.DISCONNECTED:
+                self._session = None
+            raise BTLEException(code if clsName == 'BTLEException' else BTLEException.INTERNAL_ERROR,
+                                message if clsName == 'BTLEException' else "%s: %s" % (clsName, message))
+        return result
+
+    def connect(self, addr):
+        self._session = self.capture.nextSession(addr)
+        if self._session == None:
+            if not self.capture.remaining():
+                logging.info("Replay of %s finished" % self.capture.path)
+            raise BTLEException(BTLEException.DISCONNECTED, "No more recorded sessions of %s" % addr)
+        self._pos = 0
+        self._base = time.time()
+        return self._play('connect')
+
+    def disconnect(self):
+        self._session = None
+
+    def isConnected(self):
+        return self._session != None
+
+    def discoverServices(self, uuid=None):
+        return self._play('discoverServices')
+
+    def discoverCharacteristics(self, startHnd=1, endHnd=0xFFFF):
+        return self._play('discoverCharacteristics')
+
+    def discoverDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        return self._play('discoverDescriptors')
+
+    def read(self, handle):
+        return self._play('read')
+
+    def write(self, handle, value, withResponse=True):
+        return self._play('write')
+
+    def waitForNotification(self, timeout):
+        if self._interrupted.is_set():
+            self._interrupted.clear()
+            return None
+        return self._play('waitForNotification')
+
+    def interrupt(self):
+        self._interrupted.set()
+
+    def setSecurityLevel(self, level):
+        return self._play('setSecurityLevel')
+
+    def setMTU(self, mtu):
+        return self._play('setMTU')
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Show the sessions of a capture file")
+    parser.add_argument("path")
+    args = parser.parse_args(argv)
+
+    capture = Capture(args.path)
+    for s in capture.sessions:
+        notifications = len([ c for c in s.calls if c[0] == 'waitForNotification' and c[4] == RETURN and c[5] ])
+        print "%s  %s  %6.1fs  %5d calls  %5d notifications" % (s.addr,
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s.start)), s.duration, len(s.calls), notifications)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
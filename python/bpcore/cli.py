@@ -0,0 +1,164 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Entry point of the gateway, for both clients.
+
+    python -m bpcore.cli sync               runs bpart_sync (python bpart-gateway sync works too)
+    python -m bpcore.cli async -b sim       runs bpart_async with another backend
+    python -m bpcore.cli async --startup-benchmark --runs=20
+
+The client is run with its own config.py, as if it was started from its
+directory. Only what the configuration uses gets imported: the backend
+when the first device connects (see bpcore/transport.py), the sinks,
+aggregation, spool, control API, workers, scanner and capture when they
+are configured. Options are parsed with getopt, argparse alone takes
+about as long to import as a whole client.
+
+The startup benchmark starts the client n times in a fresh interpreter
+(in a temporary directory, so the log file and spool of a running gateway
+are not touched) with a backend that exits on the first connection
+attempt, and prints the time from exec to that attempt.
+'''
+
+import os
+import sys
+import getopt
+
+CLIENTS = ("sync", "async")
+
+USAGE = '''usage: python -m bpcore.cli sync|async [options]
+
+  -b, --backend=NAME         overrides config.BACKEND
+  --startup-benchmark        measures the time from exec to the first connection attempt
+  -n, --runs=N               runs of the benchmark (default 10)
+  -h, --help                 prints this
+'''
+
+# Printed by the benchmark backend when it is asked to connect
+CONNECT_MARKER = "bpcore.cli: connect"
+
+
+def clientDir(client):
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bpart_" + client)
+
+
+def loadClient(client):
+    '''
+    Imports the main module of client, with its directory first on the path
+    (its modules import each other as top level modules).
+    '''
+    sys.path.insert(0, clientDir(client))
+    import importlib
+    return importlib.import_module("main")
+
+
+class _ExitOnConnect(object):
+    '''
+    The backend of a benchmark run: ends the process when a device is connected.
+    '''
+
+    name = "exit-on-connect"
+
+    def __init__(self, iface=None):
+        self.iface = iface
+
+    def connect(self, addr):
+        sys.stdout.write("\n" + CONNECT_MARKER + "\n")
+        sys.stdout.flush()
+        os._exit(0)
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    return values[n / 2] if n % 2 else (values[n / 2 - 1] + values[n / 2]) / 2.0
+
+
+def benchmark(client, runs):
+    '''
+    Returns the times (seconds) from exec to the first connection attempt of runs fresh starts of client.
+    '''
+    import time
+    import shutil
+    import tempfile
+    import subprocess
+    pythonDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([pythonDir] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    cwd = tempfile.mkdtemp(prefix="bpart-startup-")
+    times = []
+    try:
+        for i in range(runs):
+            start = time.time()
+            child = subprocess.Popen([sys.executable, "-m", "bpcore.cli", client, "--exit-on-connect"],
+                                     cwd=cwd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            # the client prints its prompt on stdout as well
+            output = ""
+            while CONNECT_MARKER not in output:
+                data = os.read(child.stdout.fileno(), 4096)
+                if not data:
+                    break
+                output += data
+            elapsed = time.time() - start
+            child.stdout.read()
+            child.wait()
+            if CONNECT_MARKER not in output:
+                raise RuntimeError("%s client exited (%d) before connecting, see %s" % (client, child.returncode, cwd))
+            times.append(elapsed)
+    except Exception:
+        cwd = None # keep the directory and its log file
+        raise
+    finally:
+        if cwd:
+            shutil.rmtree(cwd, True)
+    return times
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv == None else argv
+    try:
+        (opts, args) = getopt.gnu_getopt(argv, "b:n:h", ["backend=", "startup-benchmark", "runs=", "exit-on-connect", "help"])
+    except getopt.GetoptError, e:
+        sys.stderr.write("%s\n%s" % (e, USAGE))
+        return 2
+    opts = dict(opts)
+    if "-h" in opts or "--help" in opts:
+        sys.stdout.write(USAGE)
+        return 0
+    if len(args) != 1 or args[0] not in CLIENTS:
+        sys.stderr.write(USAGE)
+        return 2
+    client = args[0]
+
+    if "--startup-benchmark" in opts:
+        try:
+            runs = int(opts.get("-n") or opts.get("--runs") or 10)
+        except ValueError:
+            sys.stderr.write("--runs takes a number\n")
+            return 2
+        times = benchmark(client, runs)
+        ms = [ t * 1000 for t in times ]
+        print "%s: exec to first connection attempt, %d runs: min %.1f ms, median %.1f ms, max %.1f ms" % (
+            client, len(ms), min(ms), _median(ms), max(ms))
+        return 0
+
+    gateway = loadClient(client)
+    import config
+    if "--exit-on-connect" in opts:
+        from bpcore import transport
+        transport.TRANSPORTS[_ExitOnConnect.name] = "bpcore.cli._ExitOnConnect"
+        (config.BACKEND, config.BACKEND_OPTIONS, config.CAPTURE) = (_ExitOnConnect.name, {}, None)
+    elif "-b" in opts or "--backend" in opts:
+        config.BACKEND = opts.get("-b") or opts["--backend"]
+    gateway.setupLogging()
+    gateway.main()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
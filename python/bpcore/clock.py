@@ -0,0 +1,224 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Reception timestamps and notification timing.
+
+Samples are stamped when their first notification arrives (async client)
+or when their first value is read (sync client), not when they are sent:
+queueing, batching, aggregation and the spool then no longer shift them.
+The reception time is read from the monotonic clock, which NTP can't step,
+and turned into wall clock time by GatewayClock; the offset between the
+two clocks is re-read every resync seconds, so the wall clock is followed
+without samples jumping in between.
+
+A bPart notifies on its own clock, which drifts against ours. For every
+device a DriftEstimator fits a line through the reception times of its
+samples, round after round: the slope is the actual notification period,
+its deviation from the configured one the drift (ppm), the scatter around
+the line the reception jitter (connection events, scheduling). With
+correction the samples are stamped with the fitted time instead, which
+removes that jitter.
+'''
+
+import time
+import ctypes
+import logging
+import threading
+from collections import deque
+
+from bpcore import metrics
+
+# Reception times of the last DRIFT_WINDOW samples are fitted, at least DRIFT_MIN_SAMPLES of them
+DRIFT_WINDOW = 64
+DRIFT_MIN_SAMPLES = 8
+# A sample more than OUTLIER periods (or 4 jitters) off the fit is an outlier, OUTLIERS in a row restart the fit
+OUTLIER = 0.05
+OUTLIERS = 3
+
+CLOCK_MONOTONIC = 1 # linux/time.h
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _loadClockGettime():
+    # The interpreter is linked against libc, so it is usually found among its own symbols;
+    # ctypes.util.find_library (slow to import, runs ldconfig) only for librt on old glibc
+    try:
+        f = ctypes.CDLL(None, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        from ctypes.util import find_library
+        path = find_library('rt')
+        if path == None:
+            return None
+        try:
+            f = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            return None
+    f.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    return f
+
+_clockGettime = _loadClockGettime()
+
+def monotonic():
+    '''
+    Seconds of a clock that never jumps (CLOCK_MONOTONIC). Where there is
+    no clock_gettime this falls back to time.time().
+    '''
+    if _clockGettime == None:
+        return time.time()
+    t = _timespec()
+    if _clockGettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        return time.time()
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class GatewayClock(object):
+    '''
+    Maps monotonic() readings to seconds since the epoch. A change of the
+    offset by more than maxStep seconds (the wall clock was set) is logged.
+    '''
+
+    def __init__(self, resync=60.0, maxStep=0.5):
+        self.resync = resync
+        self.maxStep = maxStep
+        self._lock = threading.Lock()
+        (self._offset, self._synced) = self._readOffset()
+
+    def _readOffset(self):
+        # the smallest of a few readings is the one least disturbed by preemption
+        best = None
+        for i in range(3):
+            m1 = monotonic()
+            t = time.time()
+            m2 = monotonic()
+            if best == None or m2 - m1 < best[0]:
+                best = (m2 - m1, t - (m1 + m2) / 2, m2)
+        return best[1:]
+
+    def now(self):
+        '''
+        The monotonic time, for reception timestamps.
+        '''
+        return monotonic()
+
+    def wallTime(self, mono):
+        '''
+        Seconds since the epoch at monotonic time mono.
+        '''
+        if mono - self._synced >= self.resync:
+            self.sync()
+        return self._offset + mono
+
+    def sync(self):
+        with self._lock:
+            (offset, synced) = self._readOffset()
+            step = offset - self._offset
+            if abs(step) > self.maxStep:
+                logging.warning("Wall clock changed by %.3fs, timestamps follow it" % step)
+                metrics.incr("clock.steps")
+            (self._offset, self._synced) = (offset, synced)
+        metrics.setGauge("clock.offset_change", step)
+
+
+_clock = None
+_clockLock = threading.Lock()
+
+def getClock():
+    '''
+    Returns the GatewayClock shared by the process.
+    '''
+    global _clock
+    with _clockLock:
+        if _clock == None:
+            _clock = GatewayClock()
+        return _clock
+
+
+class DriftEstimator(object):
+    '''
+    Notification timing of one device, from the monotonic reception times
+    of its samples. nominal is the configured notification period.
+
+    After add() the estimate is in period (seconds), driftPpm and jitter
+    (standard deviation of the reception times around the fit, seconds);
+    they are None until minSamples rounds have been seen.
+    '''
+
+    def __init__(self, name, nominal, window=DRIFT_WINDOW, minSamples=DRIFT_MIN_SAMPLES):
+        self.name = name
+        self.nominal = float(nominal)
+        self.minSamples = minSamples
+        self._points = deque(maxlen=window) # (round, reception time)
+        self._fit = None # (period, intercept)
+        self._outliers = 0
+        self.period = None
+        self.driftPpm = None
+        self.jitter = None
+
+    def reset(self):
+        '''
+        Must be called when the device starts notifying anew (connect), its rounds restart.
+        '''
+        self._points.clear()
+        self._fit = None
+        self._outliers = 0
+
+    def add(self, t):
+        '''
+        Adds the reception time of a sample; returns the fitted time of its round,
+        or t as long as there is no estimate.
+        '''
+        if not self._points:
+            self._points.append((0, t))
+            return t
+        (n, last) = self._points[-1]
+        rounds = int(round((t - last) / (self.period or self.nominal)))
+        if rounds < 1:
+            return t # a split round (e.g. a sensor switched on), not a new one
+        if self._fit != None and abs(t - self._predict(n + rounds)) > max(4 * self.jitter, OUTLIER * self.nominal):
+            self._outliers += 1
+            if self._outliers < OUTLIERS:
+                return t # delivered late (retransmissions), kept out of the fit
+            # the device restarted its notifications, the old rounds don't fit anymore
+            logging.debug("%s: notification phase changed, restarting the drift estimate" % self.name)
+            self.reset()
+            self._points.append((0, t))
+            return t
+        self._outliers = 0
+        self._points.append((n + rounds, t))
+        if len(self._points) < self.minSamples:
+            return t
+        self._estimate()
+        return self._predict(n + rounds)
+
+    def _predict(self, n):
+        (period, intercept) = self._fit
+        return intercept + period * n
+
+    def _estimate(self):
+        # least squares fit of reception time over round; relative to the first point to keep the sums small
+        (n0, t0) = self._points[0]
+        count = len(self._points)
+        xs = [ n - n0 for (n, t) in self._points ]
+        ys = [ t - t0 for (n, t) in self._points ]
+        mx = sum(xs) / float(count)
+        my = sum(ys) / count
+        sxx = sum([ (x - mx) ** 2 for x in xs ])
+        if sxx == 0:
+            return
+        period = sum([ (x - mx) * (y - my) for (x, y) in zip(xs, ys) ]) / sxx
+        intercept = t0 + my - period * (mx + n0)
+        self._fit = (period, intercept)
+        residuals = [ t - (intercept + period * n) for (n, t) in self._points ]
+        self.period = period
+        self.driftPpm = (period / self.nominal - 1) * 1e6
+        self.jitter = (sum([ r * r for r in residuals ]) / count) ** 0.5
+        metrics.setGauge("device.period", period, device=self.name)
+        metrics.setGauge("device.drift_ppm", self.driftPpm, device=self.name)
+        metrics.setGauge("device.jitter", self.jitter, device=self.name)
@@ -0,0 +1,164 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Local control and query API of the gateway.
+
+The devices report their connection state and every sample to a
+DeviceStatus; the ControlServer (bpcore/controlserver.py, only loaded
+when config.CONTROL is set) answers from it without touching the radio,
+so dashboards can poll as often as they like. It is served over HTTP
+from its own threads, on a TCP port or a Unix socket (config.CONTROL,
+{"port": 8081} or {"socket": "/run/bpart.sock"}):
+
+    GET  /devices                               state and latest values of all devices
+    GET  /devices/<addr>                        the same for one device
+    GET  /devices/<addr>/history?n=20           the last n samples
+    GET  /metrics                               counters and gauges (bpcore.metrics)
+    POST /devices/<addr>/reconnect
+    POST /devices/<addr>/sensors/<name>/enable  name as in bpcore.sensors.SENSORS
+    POST /devices/<addr>/sensors/<name>/disable
+
+Commands are handed to the fleet running the devices (anything with
+command(addr, name, **args) returning False for unknown devices) and
+carried out by the device threads; the answer is 202 once they are queued.
+'''
+
+import time
+import logging
+import threading
+from collections import deque
+
+from bpcore import metrics
+from bpcore.sensors import SENSORS
+
+# Samples kept per device
+HISTORY = 100
+
+COMMANDS = ("reconnect", "enable", "disable")
+
+CONNECTED = "connected"
+CONNECTING = "connecting"
+DISCONNECTED = "disconnected"
+IDLE = "idle" # duty-cycled, between two visits
+
+
+def checkCommand(name, args):
+    '''
+    Raises ValueError if name with args is not a valid command.
+    '''
+    if name not in COMMANDS:
+        raise ValueError("Unknown command %s" % repr(name))
+    if name in ("enable", "disable") and args.get("sensor") not in [ s for (s, offset) in SENSORS ]:
+        raise ValueError("Unknown sensor %s" % repr(args.get("sensor")))
+
+def sampleDict(sample):
+    values = sample._asdict()
+    del values['device']
+    return values
+
+
+class DeviceStatus(object):
+    '''
+    Connection state, latest sample and recent history of every device.
+    The state is also kept in the gauge device.connected (0/1), which is
+    how worker processes report it to the parent.
+    '''
+
+    def __init__(self, history=HISTORY):
+        self.historySize = history
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def _entry(self, addr):
+        # with _lock held
+        entry = self._devices.get(addr)
+        if entry == None:
+            entry = {"state": None, "since": time.time(), "error": None, "samples": 0,
+                     "history": deque(maxlen=self.historySize)}
+            self._devices[addr] = entry
+        return entry
+
+    def setState(self, addr, state, error=None):
+        with self._lock:
+            entry = self._entry(addr)
+            if entry["state"] != state:
+                entry["since"] = time.time()
+            entry["state"] = state
+            entry["error"] = error
+        metrics.setGauge("device.connected", int(state == CONNECTED), device=addr)
+
+    def sample(self, sample):
+        with self._lock:
+            entry = self._entry(sample.device)
+            entry["samples"] += 1
+            entry["history"].append(sample)
+
+    def forget(self, addr):
+        with self._lock:
+            self._devices.pop(addr, None)
+        metrics.drop("device.connected", device=addr)
+
+    def device(self, addr):
+        '''
+        Returns the state of addr as a dict, None if it is unknown.
+        '''
+        with self._lock:
+            entry = self._devices.get(addr)
+            if entry == None:
+                return None
+            latest = entry["history"][-1] if entry["history"] else None
+            return {"state": entry["state"], "since": entry["since"], "error": entry["error"],
+                    "samples": entry["samples"], "latest": sampleDict(latest) if latest else None}
+
+    def devices(self):
+        with self._lock:
+            addrs = list(self._devices)
+        return dict([ (addr, self.device(addr)) for addr in addrs ])
+
+    def history(self, addr, n=None):
+        with self._lock:
+            entry = self._devices.get(addr)
+            samples = list(entry["history"]) if entry != None else []
+        if n != None:
+            samples = samples[-n:] if n > 0 else []
+        return [ sampleDict(s) for s in samples ]
+
+
+_status = None
+_statusLock = threading.Lock()
+
+def getStatus():
+    '''
+    Returns the DeviceStatus shared by the process.
+    '''
+    global _status
+    with _statusLock:
+        if _status == None:
+            _status = DeviceStatus()
+        return _status
+
+
+def startControl(spec, fleet=None, metricsSource=None):
+    '''
+    Starts the server config.CONTROL asks for; None if spec is None.
+    '''
+    if not spec:
+        return None
+    from bpcore.controlserver import ControlServer, UnixControlServer
+    if "socket" in spec:
+        server = UnixControlServer(spec["socket"], fleet, metricsSource=metricsSource)
+        where = spec["socket"]
+    else:
+        server = ControlServer((spec.get("host", "127.0.0.1"), spec.get("port", 8081)), fleet, metricsSource=metricsSource)
+        where = server.url
+    logging.info("Control API on %s" % where)
+    return server.start()
+
+def stopControl(server):
+    if server != None:
+        server.stop()
@@ -0,0 +1,175 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+The HTTP side of the control API (see bpcore/control.py), kept apart so
+that the HTTP server modules are only loaded when it is started.
+'''
+
+import os
+import json
+import logging
+import urlparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from bpcore import metrics
+from bpcore.sensors import SENSORS
+from bpcore.control import getStatus, checkCommand, CONNECTED, DISCONNECTED
+
+
+class _ControlHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1" # keep-alive
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _reply(self, code, body):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        url = urlparse.urlsplit(self.path)
+        parts = [ p for p in url.path.split('/') if p ]
+        if len(parts) > 1 and parts[0] == "devices":
+            parts[1] = parts[1].upper()
+        return (parts, urlparse.parse_qs(url.query))
+
+    def do_GET(self):
+        (parts, query) = self._route()
+        server = self.server
+        if parts == ["devices"]:
+            self._reply(200, server.devices())
+        elif len(parts) == 2 and parts[0] == "devices":
+            device = server.devices().get(parts[1])
+            if device == None:
+                self._reply(404, {"error": "Unknown device %s" % parts[1]})
+            else:
+                self._reply(200, device)
+        elif len(parts) == 3 and parts[0] == "devices" and parts[2] == "history":
+            try:
+                n = int(query["n"][0]) if "n" in query else None
+            except ValueError:
+                self._reply(400, {"error": "n must be a number"})
+                return
+            self._reply(200, server.status.history(parts[1], n))
+        elif parts == ["metrics"]:
+            self._reply(200, server.metricsSource())
+        else:
+            self._reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        (parts, query) = self._route()
+        if len(parts) == 3 and parts[0] == "devices":
+            (addr, name, args) = (parts[1], parts[2], {})
+        elif len(parts) == 5 and parts[0] == "devices" and parts[2] == "sensors":
+            sensor = dict([ (s.lower(), s) for (s, offset) in SENSORS ]).get(parts[3].lower(), parts[3])
+            (addr, name, args) = (parts[1], parts[4], {"sensor": sensor})
+        else:
+            self._reply(404, {"error": "Not found"})
+            return
+        try:
+            checkCommand(name, args)
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        if self.server.fleet == None or not self.server.fleet.command(addr, name, **args):
+            self._reply(404, {"error": "Unknown device %s" % addr})
+            return
+        metrics.incr("control.commands")
+        self._reply(202, {"device": addr, "command": name, "args": args})
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, fmt, *args):
+        logging.debug("Control: " + fmt % args)
+
+
+class _UnixControlHandler(_ControlHandler):
+
+    disable_nagle_algorithm = False # not a TCP socket
+
+
+class _ControlMixIn(SocketServer.ThreadingMixIn):
+
+    daemon_threads = True
+
+    def _setup(self, fleet, status, metricsSource):
+        self.fleet = fleet
+        self.status = status or getStatus()
+        self.metricsSource = metricsSource or metrics.snapshot
+
+    def devices(self):
+        '''
+        The state of all devices; that of devices in worker processes is only known from
+        their gauges, as of the last metrics report of the worker (see bpcore.workers).
+        '''
+        devices = self.status.devices()
+        for (key, value) in self.metricsSource().items():
+            if not key.startswith("device.connected["):
+                continue
+            addr = key[len("device.connected["):-1]
+            device = devices.setdefault(addr, {"state": None, "since": None, "error": None, "samples": 0, "latest": None})
+            if device["state"] == None:
+                device["state"] = CONNECTED if value else DISCONNECTED
+        return devices
+
+    def start(self):
+        '''
+        Serves in a background thread.
+        '''
+        t = threading.Thread(target=self.serve_forever, name="control server")
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ControlServer(_ControlMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    The API on a TCP port. fleet runs the commands, metricsSource() returns
+    the metrics (default bpcore.metrics.snapshot, WorkerPool.collectMetrics
+    with workers).
+    '''
+
+    def __init__(self, address=('127.0.0.1', 0), fleet=None, status=None, metricsSource=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _ControlHandler)
+        self._setup(fleet, status, metricsSource)
+
+    @property
+    def url(self):
+        return "http://%s:%d/" % self.server_address
+
+
+class UnixControlServer(_ControlMixIn, SocketServer.UnixStreamServer):
+    '''
+    The API on a Unix socket at path, see ControlServer.
+    '''
+
+    def __init__(self, path, fleet=None, status=None, metricsSource=None):
+        if os.path.exists(path):
+            os.remove(path) # left over from a previous run
+        SocketServer.UnixStreamServer.__init__(self, path, _UnixControlHandler)
+        self._setup(fleet, status, metricsSource)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
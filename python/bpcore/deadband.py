@@ -0,0 +1,85 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Deadband filtering: only samples that say something new reach the sinks.
+
+The DeadbandFilter sits right in front of the sinks (behind the
+aggregation, which still sees every sample). A sample of a device is
+passed on if one of its values left the deadband around the value last
+passed on, or if nothing was passed on for heartbeat seconds (so the
+receiving end can tell a quiet device from a lost one); otherwise it is
+dropped and counted in deadband.suppressed. config.DEADBAND:
+
+    {"thresholds": {"temperature": 0.1, "humidity": {"absolute": 1, "relative": 0.02},
+                    "light": {"relative": 0.05}, "acceleration": 0.05},
+     "heartbeat": 300}
+
+A threshold is a number (absolute, in the unit of the value) or a dict
+with absolute and/or relative (a fraction of the last value); with both
+the wider deadband applies, so absolute keeps relative from shrinking to
+nothing around zero. For acceleration the distance of the (x, y, z)
+vectors is compared. Values without a threshold pass on any change.
+'''
+
+import threading
+
+from bpcore import metrics
+
+FIELDS = ("temperature", "humidity", "light", "acceleration")
+
+
+def _distance(a, b):
+    if isinstance(a, tuple):
+        return sum([ (x - y) ** 2 for (x, y) in zip(a, b) ]) ** 0.5
+    return abs(a - b)
+
+def _magnitude(v):
+    if isinstance(v, tuple):
+        return sum([ x * x for x in v ]) ** 0.5
+    return abs(v)
+
+
+class DeadbandFilter(object):
+    '''
+    Passes the samples that left the deadband (or are due for a heartbeat)
+    to downstream.send(). thresholds and heartbeat as described above.
+    '''
+
+    def __init__(self, downstream, thresholds=None, heartbeat=300.0):
+        self.downstream = downstream
+        self.heartbeat = heartbeat
+        self.thresholds = {}
+        for (field, threshold) in (thresholds or {}).items():
+            if field not in FIELDS:
+                raise ValueError("Unknown field %s" % repr(field))
+            if not isinstance(threshold, dict):
+                threshold = {"absolute": threshold}
+            self.thresholds[field] = (threshold.get("absolute", 0), threshold.get("relative", 0))
+        self._last = {} # device -> last sample passed on
+        self._lock = threading.Lock()
+
+    def _changed(self, sample, last):
+        for field in FIELDS:
+            value = getattr(sample, field)
+            before = getattr(last, field)
+            (absolute, relative) = self.thresholds.get(field, (0, 0))
+            if _distance(value, before) > max(absolute, relative * _magnitude(before)):
+                return True
+        return False
+
+    def send(self, sample):
+        with self._lock:
+            last = self._last.get(sample.device)
+            if last != None and sample.timestamp - last.timestamp < self.heartbeat and not self._changed(sample, last):
+                metrics.incr("deadband.suppressed", device=sample.device)
+                return
+            self._last[sample.device] = sample
+        self.downstream.send(sample)
+
+    def close(self, timeout=10.0):
+        self.downstream.close(timeout)
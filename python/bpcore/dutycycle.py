@@ -0,0 +1,178 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Duty-cycled connections: connect, read, disconnect, next device.
+
+Every device has a period. A visit of it is released once per period and
+has to be done by the end of that period (its deadline). slots visits run
+at a time, the released visit with the earliest deadline first (EDF).
+With EDF all deadlines are met as long as the utilization, the sum of
+visit time / period over all devices divided by slots, stays below 1; it
+is kept in the gauge dutycycle.utilization. Late visits are counted in
+dutycycle.missed, and a device whose visit failed is tried again in its
+next period.
+'''
+
+import time
+import heapq
+import logging
+import threading
+
+from bpcore import metrics
+
+# Weight of the newest visit in the average visit time of a device
+COST_WEIGHT = 0.3
+
+
+class _Job(object):
+    __slots__ = ('addr', 'period', 'release', 'deadline', 'cost', 'running', 'removed')
+
+    def __init__(self, addr, period, release):
+        self.addr = addr
+        self.period = period
+        self.release = release
+        self.deadline = release + period
+        self.cost = None # average visit time
+        self.running = False
+        self.removed = False
+
+
+class DutyCycleScheduler(object):
+    '''
+    Calls visit(addr) for every device once per period, from slots
+    threads. visit raises to report a failed visit.
+    '''
+
+    def __init__(self, visit, slots=1):
+        self.visit = visit
+        self.slots = slots
+        self.running = False
+        self._jobs = {}
+        self._pending = [] # (release, seq, job) not released yet
+        self._ready = []   # (deadline, seq, job) released, not running
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def add(self, addr, period, start=None):
+        '''
+        Schedules addr every period seconds, the first visit at start
+        (default now). Changes the period if addr is already scheduled.
+        '''
+        with self._cond:
+            job = self._jobs.get(addr)
+            if job != None:
+                job.period = period
+                return
+            job = _Job(addr, period, time.time() if start == None else start)
+            self._jobs[addr] = job
+            self._push(job)
+            self._updateUtilization()
+            self._cond.notify()
+
+    def remove(self, addr):
+        '''
+        Stops visiting addr; a running visit is finished.
+        '''
+        with self._cond:
+            job = self._jobs.pop(addr, None)
+            if job != None:
+                job.removed = True # dropped from the heaps when it comes up
+                self._updateUtilization()
+
+    def devices(self):
+        with self._cond:
+            return sorted(self._jobs)
+
+    def _push(self, job):
+        self._seq += 1
+        heapq.heappush(self._pending, (job.release, self._seq, job))
+
+    def _updateUtilization(self):
+        # Devices which were not visited yet count with the average of the others
+        costs = [ j.cost for j in self._jobs.values() if j.cost != None ]
+        if not costs:
+            return
+        default = sum(costs) / len(costs)
+        load = sum([ (j.cost if j.cost != None else default) / j.period for j in self._jobs.values() ])
+        utilization = load / self.slots
+        if utilization > 1 and metrics.get("dutycycle.utilization") <= 1:
+            logging.warning("Duty cycle overloaded (utilization %.2f), deadlines will be missed" % utilization)
+        metrics.setGauge("dutycycle.utilization", utilization)
+
+    def _next(self):
+        # Waits for the released job with the earliest deadline; None when stopped
+        with self._cond:
+            while self.running:
+                now = time.time()
+                while self._pending and self._pending[0][0] <= now:
+                    (release, seq, job) = heapq.heappop(self._pending)
+                    if not job.removed:
+                        heapq.heappush(self._ready, (job.deadline, seq, job))
+                while self._ready:
+                    (deadline, seq, job) = heapq.heappop(self._ready)
+                    if not job.removed:
+                        job.running = True
+                        return job
+                timeout = self._pending[0][0] - now if self._pending else None
+                self._cond.wait(timeout)
+            return None
+
+    def _done(self, job, started, ok):
+        now = time.time()
+        with self._cond:
+            job.running = False
+            duration = now - started
+            job.cost = duration if job.cost == None else COST_WEIGHT * duration + (1 - COST_WEIGHT) * job.cost
+            metrics.incr("dutycycle.visits")
+            metrics.setGauge("dutycycle.lateness", now - job.deadline, device=job.addr)
+            if now > job.deadline:
+                metrics.incr("dutycycle.missed")
+            if not ok:
+                metrics.incr("dutycycle.failures", device=job.addr)
+            # next period; periods that could not be met anymore are skipped
+            job.release += job.period
+            if job.release + job.period < now:
+                job.release = now
+            job.deadline = job.release + job.period
+            if not job.removed:
+                self._push(job)
+            self._updateUtilization()
+            self._cond.notify()
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job == None:
+                return
+            started = time.time()
+            ok = False
+            try:
+                self.visit(job.addr)
+                ok = True
+            except Exception as e:
+                logging.warning("Visit of %s failed: %s" % (job.addr, e))
+            self._done(job, started, ok)
+
+    def start(self):
+        self.running = True
+        self._threads = [ threading.Thread(target=self._work, name="duty cycle %d" % i) for i in range(self.slots) ]
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+
+    def stop(self, timeout=10.0):
+        '''
+        Stops after the running visits.
+        '''
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(deadline - time.time(), 0))
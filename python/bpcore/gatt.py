@@ -0,0 +1,240 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Transport neutral GATT model.
+
+Peripheral, Service, Characteristic and Descriptor only ever talk to a
+bpcore.transport.Transport, so the same classes work with bluepy-helper,
+gatttool, the native ATT socket or the simulator underneath.
+Handles are ints, values are byte strings.
+'''
+
+import binascii
+
+
+class BTLEException(Exception):
+    DISCONNECTED = 1
+    COMM_ERROR = 2
+    INTERNAL_ERROR = 3
+
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class UUID:
+    def __init__(self, val):
+        '''We accept: 32-digit hex strings, with and without '-' characters,
+           4 to 8 digit hex strings, and integers'''
+        if isinstance(val,int) or isinstance(val,long):
+            if (val < 0) or (val > 0xFFFFFFFF):
+                raise ValueError("Short form UUIDs must be in range 0..0xFFFFFFFF")
+            val = "%04X" % val
+        else:
+            val = str(val) # Do our best
+
+        val = val.replace("-","")
+        if len(val) <= 8: # Short form
+            val = ("0" * (8-len(val))) + val +"00001000800000805F9B34FB"
+
+        self.binVal = binascii.a2b_hex(val)
+        if len(self.binVal) != 16:
+            raise ValueError("UUID must be 16 bytes, got '%s'" % val)
+
+    def __str__(self):
+        s = binascii.b2a_hex(self.binVal)
+        return "-".join([ s[0:8], s[8:12], s[12:16], s[16:20], s[20:32] ])
+
+    def __cmp__(self, other):
+        return cmp(str(self), str(other))
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def friendlyName(self):
+        #TODO
+        return str(self)
+
+
+class Service:
+    def __init__(self, *args):
+        (self.peripheral, uuidVal, self.hndStart, self.hndEnd) = args
+        self.uuid = UUID(uuidVal)
+        self.chars = None
+
+    def getCharacteristics(self, forUUID=None):
+        if not self.chars: # Unset, or empty
+            self.chars = self.peripheral.getCharacteristics(self.hndStart, self.hndEnd)
+        # Get Characteristic which corresponds with the UUID
+        if forUUID != None:
+            u = UUID(forUUID)
+            return [ ch for ch in self.chars if ch.uuid==u ]
+        return self.chars
+
+    def __str__(self):
+        return "Service <%s>" % str(self.uuid)
+
+
+class Characteristic:
+    def __init__(self, *args):
+        (self.peripheral, uuidVal, self.handle, self.properties, self.valHandle) = args
+        self.uuid = UUID(uuidVal)
+
+    def read(self):
+        return self.peripheral.readCharacteristic(self.valHandle)
+
+    def write(self,val,withResponse=False):
+        self.peripheral.writeCharacteristic(self.valHandle,val,withResponse)
+
+    def __str__(self):
+        return "Characteristic <%s>" % (self.uuid)
+
+
+class Descriptor:
+    def __init__(self, *args):
+        (self.peripheral, uuidVal, self.handle) = args
+        self.uuid = UUID(uuidVal)
+
+    def __str__(self):
+        return "Descriptor <%s>" % str(self.uuid)
+
+
+class Peripheral(object):
+    '''
+    A BLE peripheral accessed through a transport (see bpcore.transport).
+    '''
+
+    def __init__(self, transport, deviceAddr=None):
+        self.transport = transport
+        self.services = {} # Indexed by UUID
+        self.discoveredAllServices = False
+        if deviceAddr != None:
+            self.connect(deviceAddr)
+
+    def connect(self,addr):
+        if len( addr.split(":") ) != 6:
+            raise ValueError("Expected MAC address, got %s" % repr(addr))
+        self.deviceAddr = addr
+        self.transport.connect(addr)
+
+    def disconnect(self):
+        self.transport.disconnect()
+
+    def isConnected(self):
+        return self.transport.isConnected()
+
+    def discoverServices(self):
+        self.services = {}
+        for (start, end, uuid) in self.transport.discoverServices():
+            self.services[UUID(uuid)] = Service(self, uuid, start, end)
+        self.discoveredAllServices = True
+        return self.services
+
+    def getServices(self):
+        if not self.discoveredAllServices:
+            self.discoverServices()
+        return self.services.values()
+
+    def getServiceByUUID(self,uuidVal):
+        uuid=UUID(uuidVal)
+        if uuid in self.services:
+            return self.services[uuid]
+        found = self.transport.discoverServices(str(uuid))
+        if not found:
+            raise BTLEException(BTLEException.COMM_ERROR, "Service %s not found" % uuid)
+        svc = Service(self, uuid, found[0][0], found[0][1])
+        self.services[uuid] = svc
+        return svc
+
+    def discoverServicesByUUID(self, uuids):
+        '''
+        Discovers only the services with the given uuids (pipelined where the transport can),
+        instead of all of them. Raises BTLEException if one is missing.
+        '''
+        wanted = [ UUID(u) for u in uuids if UUID(u) not in self.services ]
+        futures = [ self.submit("discoverServices", str(u)) for u in wanted ]
+        for (u, future) in zip(wanted, futures):
+            found = future.result()
+            if not found:
+                raise BTLEException(BTLEException.COMM_ERROR, "Service %s not found" % u)
+            self.services[u] = Service(self, u, found[0][0], found[0][1])
+        return [ self.services[UUID(u)] for u in uuids ]
+
+    def getCharacteristics(self,startHnd=1,endHnd=0xFFFF, uuid=None):
+        chars = [ Characteristic(self, u, hnd, props, vhnd)
+                  for (hnd, props, vhnd, u) in self.transport.discoverCharacteristics(startHnd, endHnd) ]
+        if uuid:
+            u = UUID(uuid)
+            return [ ch for ch in chars if ch.uuid==u ]
+        return chars
+
+    def discoverAllCharacteristics(self):
+        '''
+        Discovers the characteristics of all known services at once, the requests are pipelined
+        where the transport can (see Transport.submit).
+        '''
+        services = [ svc for svc in self.services.values() if not svc.chars ]
+        futures = [ self.submit("discoverCharacteristics", svc.hndStart, svc.hndEnd) for svc in services ]
+        for (svc, future) in zip(services, futures):
+            svc.chars = [ Characteristic(self, u, hnd, props, vhnd) for (hnd, props, vhnd, u) in future.result() ]
+
+    def getDescriptors(self,startHnd=1,endHnd=0xFFFF):
+        return [ Descriptor(self, u, hnd) for (hnd, u) in self.transport.discoverDescriptors(startHnd, endHnd) ]
+
+    def getCharacteristicByUUID(self,uuidVal):
+        '''
+        Looks the characteristic up in the discovered services, discovering them if necessary.
+        '''
+        u = UUID(uuidVal)
+        for svc in self.getServices():
+            for ch in svc.getCharacteristics():
+                if ch.uuid == u:
+                    return ch
+        raise BTLEException(BTLEException.COMM_ERROR, "Characteristic %s not found" % u)
+
+    def readCharacteristic(self,handle):
+        return self.transport.read(handle)
+
+    def readCharacteristics(self, handles):
+        '''
+        Reads several characteristics at once, pipelined where the transport can; returns their values in order.
+        '''
+        futures = [ self.submit("read", handle) for handle in handles ]
+        return [ f.result() for f in futures ]
+
+    def readCharacteristicByUUID(self,uuidVal):
+        return self.getCharacteristicByUUID(uuidVal).read()
+
+    def writeCharacteristic(self,handle,val,withResponse=False):
+        self.transport.write(handle, val, withResponse)
+
+    def submit(self, method, *args):
+        '''
+        Starts a request without waiting for its response, see bpcore.transport.Transport.submit.
+        '''
+        return self.transport.submit(method, *args)
+
+    def waitForNotification(self,timeout):
+        '''
+        Returns the next (handle, value) notification, or None after timeout seconds.
+        '''
+        return self.transport.waitForNotification(timeout)
+
+    def setSecurityLevel(self,level):
+        self.transport.setSecurityLevel(level)
+
+    def setMTU(self,mtu):
+        return self.transport.setMTU(mtu)
+
+
+def strList(l, indent="  "):
+    sep = ",\n" + indent
+    return indent + (sep.join([ str(i) for i in l ]))
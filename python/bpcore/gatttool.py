@@ -0,0 +1,239 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Transport backend driving "gatttool -I" through pexpect.
+
+Everything, discovery included, runs over the one interactive session,
+so only a single connection per device is made. gatttool's output is
+read line by line; notifications that arrive while waiting for the
+answer to a command are queued instead of being lost.
+'''
+
+import re
+import time
+import binascii
+import logging
+import threading
+from collections import deque
+
+import pexpect
+
+from bpcore.gatt import BTLEException
+from bpcore.transport import Transport
+
+# gatttool colors its output and redraws the prompt around every message
+_ANSI = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+_NOTIFICATION = re.compile(r'(?:Notification|Indication)\s+handle = (0x[0-9a-fA-F]+) value: ([0-9a-fA-F ]*)')
+_ERROR = re.compile(r'(?:Error: |[Ff]ailed: )(.*)')
+_CONNECTED = re.compile(r'Connection successful')
+_PRIMARY = re.compile(r'attr handle: (0x[0-9a-f]+), end grp handle: (0x[0-9a-f]+) uuid: ([0-9a-f-]+)')
+_PRIMARY_BY_UUID = re.compile(r'Starting handle: (0x[0-9a-f]+) Ending handle: (0x[0-9a-f]+)')
+_CHARACTERISTIC = re.compile(r'handle: (0x[0-9a-f]+), char properties: (0x[0-9a-f]+), char value handle: (0x[0-9a-f]+), uuid: ([0-9a-f-]+)')
+_DESCRIPTOR = re.compile(r'handle: (0x[0-9a-f]+), uuid: ([0-9a-f-]+)')
+_VALUE = re.compile(r'Characteristic value/descriptor: ([0-9a-fA-F ]*)')
+_WRITTEN = re.compile(r'Characteristic value was written successfully')
+_MTU = re.compile(r'MTU was exchanged successfully: (\d+)')
+
+# gatttool prints discovery results in one burst; the listing is complete
+# once no further line arrived for this long
+LISTING_IDLE = 0.2
+
+# How long waitForNotification takes at most to notice interrupt()
+INTERRUPT_LATENCY = 0.5
+
+
+def _hexToBytes(s):
+    return binascii.a2b_hex(s.replace(' ', ''))
+
+
+class GatttoolTransport(Transport):
+    '''
+    Talks to the peripheral through an interactive gatttool process.
+    '''
+
+    name = "gatttool"
+
+    def __init__(self, iface=None, timeout=3, connectTimeout=5):
+        Transport.__init__(self, iface)
+        self._helper = None
+        self._connected = False
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self.notifications = deque()
+        self._interrupted = threading.Event()
+
+    def _startHelper(self):
+        # starts an external process which runs gatttool
+        if self._helper == None:
+            cmd = 'gatttool -I'
+            if self.iface != None:
+                cmd += ' -i %s' % self.iface
+            self._helper = pexpect.spawn(cmd)
+
+    def _stopHelper(self):
+        # ends the externel process
+        self._connected = False
+        if self._helper != None:
+            try:
+                self._helper.sendline('exit')
+                self._helper.close()
+            except (OSError, pexpect.ExceptionPexpect):
+                pass
+            self._helper = None
+
+    def _writeCmd(self, cmd):
+        # send a command to gatttool
+        if self._helper == None:
+            raise BTLEException(BTLEException.INTERNAL_ERROR, "Helper not started (did you call connect()?)")
+        try:
+            self._helper.sendline(cmd)
+        except (OSError, pexpect.ExceptionPexpect) as e:
+            self._stopHelper()
+            raise BTLEException(BTLEException.DISCONNECTED, "gatttool is gone (%s)" % e)
+
+    def _readLine(self, timeout):
+        # Returns the next output line without prompt and colors, None on timeout
+        helper = self._helper # disconnect() may be called from another thread
+        if helper == None:
+            raise BTLEException(BTLEException.DISCONNECTED, "gatttool is not running")
+        try:
+            helper.expect('\r\n', timeout=max(timeout, 0))
+        except pexpect.TIMEOUT:
+            return None
+        except (pexpect.EOF, OSError) as e:
+            self._stopHelper()
+            raise BTLEException(BTLEException.DISCONNECTED, "gatttool has exited")
+        line = _ANSI.sub('', helper.before)
+        # The prompt is redrawn with carriage returns, the message is what follows the last one
+        return line[line.rfind('\r') + 1:]
+
+    def _dispatch(self, line):
+        # Queues notifications and turns error messages into exceptions.
+        # Returns True if the line has been consumed.
+        m = _NOTIFICATION.search(line)
+        if m:
+            self.notifications.append((int(m.group(1), 16), _hexToBytes(m.group(2))))
+            return True
+        m = _ERROR.search(line)
+        if m:
+            msg = m.group(1).strip()
+            if 'isconnect' in msg or 'not connected' in msg.lower():
+                self._connected = False
+                raise BTLEException(BTLEException.DISCONNECTED, "Device disconnected (%s)" % msg)
+            if 'not found' in msg.lower() or "can't be found" in msg.lower():
+                return False # End of a discovery, handled by _getListing
+            raise BTLEException(BTLEException.COMM_ERROR, "Error from gatttool (%s)" % msg)
+        return False
+
+    def _getResp(self, wantType, tout=None):
+        # Waits for a line matching the compiled regular expression wantType
+        deadline = time.time() + (self.timeout if tout == None else tout)
+        while True:
+            line = self._readLine(deadline - time.time())
+            if line == None:
+                raise BTLEException(BTLEException.COMM_ERROR, "Timeout waiting for gatttool")
+            if self._dispatch(line):
+                continue
+            m = wantType.search(line)
+            if m:
+                return m
+
+    def _getListing(self, pattern):
+        # Collects all lines matching pattern that gatttool prints in answer to one command
+        deadline = time.time() + self.timeout
+        result = []
+        while True:
+            if result:
+                line = self._readLine(LISTING_IDLE)
+            else:
+                line = self._readLine(deadline - time.time())
+            if line == None:
+                return result
+            if self._dispatch(line):
+                continue
+            m = pattern.search(line)
+            if m:
+                result.append(m)
+            elif 'not found' in line.lower() or "can't be found" in line.lower():
+                return result
+
+    def connect(self, addr):
+        self._startHelper()
+        self._writeCmd('connect %s' % addr)
+        try:
+            self._getResp(_CONNECTED, tout=self.connectTimeout)
+            self._connected = True
+        except BTLEException:
+            self._stopHelper()
+            raise BTLEException(BTLEException.DISCONNECTED, "Failed to connect to peripheral")
+
+    def disconnect(self):
+        if self._helper==None:
+            return
+        try:
+            self._writeCmd("disconnect")
+        except BTLEException:
+            pass
+        self._stopHelper()
+
+    def isConnected(self):
+        return self._connected
+
+    def discoverServices(self, uuid=None):
+        if uuid != None:
+            self._writeCmd('primary %s' % uuid)
+            return [ (int(m.group(1), 16), int(m.group(2), 16), uuid) for m in self._getListing(_PRIMARY_BY_UUID) ]
+        self._writeCmd('primary')
+        return [ (int(m.group(1), 16), int(m.group(2), 16), m.group(3)) for m in self._getListing(_PRIMARY) ]
+
+    def discoverCharacteristics(self, startHnd=1, endHnd=0xFFFF):
+        self._writeCmd('characteristics 0x%04x 0x%04x' % (startHnd, endHnd))
+        return [ (int(m.group(1), 16), int(m.group(2), 16), int(m.group(3), 16), m.group(4))
+                 for m in self._getListing(_CHARACTERISTIC) ]
+
+    def discoverDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        self._writeCmd('char-desc 0x%04x 0x%04x' % (startHnd, endHnd))
+        return [ (int(m.group(1), 16), m.group(2)) for m in self._getListing(_DESCRIPTOR) ]
+
+    def read(self, handle):
+        self._writeCmd('char-read-hnd 0x%04x' % handle)
+        return _hexToBytes(self._getResp(_VALUE).group(1))
+
+    def write(self, handle, value, withResponse=True):
+        if withResponse:
+            self._writeCmd('char-write-req 0x%04x %s' % (handle, binascii.b2a_hex(value)))
+            self._getResp(_WRITTEN)
+        else:
+            self._writeCmd('char-write-cmd 0x%04x %s' % (handle, binascii.b2a_hex(value)))
+
+    def waitForNotification(self, timeout):
+        deadline = time.time() + timeout
+        while not self.notifications:
+            if self._interrupted.is_set():
+                self._interrupted.clear()
+                return None
+            # pexpect can't be woken up, wait in slices to notice interrupt()
+            line = self._readLine(min(deadline - time.time(), INTERRUPT_LATENCY))
+            if line == None:
+                if time.time() < deadline:
+                    continue
+                return None
+            if not self._dispatch(line):
+                logging.debug("gatttool: unexpected output %s" % repr(line))
+        return self.notifications.popleft()
+
+    def interrupt(self):
+        self._interrupted.set()
+
+    def setSecurityLevel(self, level):
+        self._writeCmd('sec-level %s' % level)
+
+    def setMTU(self, mtu):
+        self._writeCmd('mtu %d' % mtu)
+        return int(self._getResp(_MTU).group(1))
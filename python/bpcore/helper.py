@@ -0,0 +1,333 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Transport backend driving the bluepy-helper executable.
+
+The helper speaks a line based protocol on stdin/stdout, see
+HelperTransport.parseResp for the response format. It answers the
+commands in the order they were written and queues them itself, so
+submitted requests are written right away and their responses are
+matched to them first in, first out: the helper starts the next request
+as soon as the previous one is answered, without waiting for Python.
+'''
+
+import os
+import time
+import select
+import binascii
+import subprocess
+from collections import deque
+
+from bpcore.gatt import BTLEException
+from bpcore.transport import Transport, Future, PIPELINED
+
+Debugging = False
+
+# Requests outstanding at most, further ones wait for the oldest (the pipes to the helper must not fill up)
+PIPELINE_DEPTH = 16
+
+helperExe = os.path.join(os.path.abspath(os.path.dirname(__file__)), os.pardir, "bpart_sync", "bluepy-helper")
+
+def DBG(*args):
+    if Debugging:
+        msg = " ".join([str(a) for a in args])
+        print (msg)
+
+
+class HelperTransport(Transport):
+    '''
+    Talks to the peripheral through the bluepy-helper executable.
+    '''
+
+    name = "helper"
+
+    def __init__(self, iface=None):
+        Transport.__init__(self, iface)
+        self._helper = None
+        self._buf = ""
+        self._connected = False
+        self._wake = None # pipe written to by interrupt() while the helper runs
+        self.notifications = deque()
+        # (Future, response type, function making the result of the response) of the submitted requests, oldest first
+        self._pending = deque()
+
+    def _startHelper(self):
+        if self._helper == None:
+            if not os.path.isfile(helperExe):
+                raise BTLEException(BTLEException.INTERNAL_ERROR, "Cannot find required executable '%s'" % helperExe)
+            DBG("Running ", helperExe)
+            args = [helperExe]
+            if self.iface != None:
+                args.append(str(self.iface).replace("hci", ""))
+            self._helper = subprocess.Popen(args,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self._buf = ""
+            self._wake = os.pipe()
+
+    def _stopHelper(self):
+        self._connected = False
+        self._failPending(BTLEException(BTLEException.DISCONNECTED, "Device disconnected"))
+        if self._helper != None:
+            DBG("Stopping ", helperExe)
+            try:
+                self._helper.stdin.write("quit\n")
+                self._helper.stdin.flush()
+            except IOError:
+                pass # already gone
+            self._helper.wait()
+            self._helper = None
+        if self._wake != None:
+            (fds, self._wake) = (self._wake, None) # before closing, the numbers may be reused
+            for fd in fds:
+                os.close(fd)
+
+    def interrupt(self):
+        wake = self._wake
+        if wake != None:
+            try:
+                os.write(wake[1], '\x00')
+            except OSError:
+                pass
+
+    def _writeCmd(self, cmd):
+        if self._helper == None:
+            raise BTLEException(BTLEException.INTERNAL_ERROR, "Helper not started (did you call connect()?)")
+        DBG("Sent: ", cmd)
+        self._helper.stdin.write(cmd)
+        self._helper.stdin.flush()
+
+    def _readLine(self, timeout, wake=False):
+        # Unbuffered line reader so that select() can be used for the timeout.
+        # With wake, interrupt() makes it return None as well.
+        fd = self._helper.stdout.fileno()
+        wakeFd = self._wake[0] if wake and self._wake != None else None
+        deadline = None if timeout == None else time.time() + timeout
+        while "\n" not in self._buf:
+            remaining = None if deadline == None else max(deadline - time.time(), 0)
+            (r, _, _) = select.select([fd] if wakeFd == None else [fd, wakeFd], [], [], remaining)
+            if wakeFd in r:
+                os.read(wakeFd, 4096)
+                return None
+            if not r:
+                return None
+            data = os.read(fd, 4096)
+            if not data:
+                self._stopHelper()
+                raise BTLEException(BTLEException.INTERNAL_ERROR, "Helper exited")
+            self._buf += data
+        (line, self._buf) = self._buf.split("\n", 1)
+        return line
+
+    @staticmethod
+    def parseResp(line):
+        resp = {}
+        for item in line.rstrip().split(' '):
+            (tag,tval) = item.split('=')
+            if len(tval)==0:
+                val = None
+            elif tval[0]=="$" or tval[0]=="'":
+                # Both symbols and strings as Python strings
+                val = tval[1:]
+            elif tval[0]=="h":
+                val = int(tval[1:], 16)
+            elif tval[0]=='b':
+                val = binascii.a2b_hex(tval[1:])
+            else:
+                raise BTLEException(BTLEException.INTERNAL_ERROR,
+                             "Cannot understand response value %s" % repr(tval))
+            if tag not in resp:
+                resp[tag] = [val]
+            else:
+                resp[tag].append(val)
+        return resp
+
+    def _nextResp(self, timeout=None, wake=False):
+        # Returns the next parsed response, None on timeout
+        while True:
+            if self._helper == None:
+                raise BTLEException(BTLEException.DISCONNECTED, "Helper not running")
+            rv = self._readLine(timeout, wake)
+            DBG("Got:", repr(rv))
+            if rv == None:
+                return None
+            if not rv.startswith('#') and rv.strip():
+                return HelperTransport.parseResp(rv)
+
+    def _getResp(self, wantType):
+        while True:
+            resp = self._nextResp()
+            if 'rsp' not in resp:
+                raise BTLEException(BTLEException.INTERNAL_ERROR,
+                    "No response type indicator")
+            respType = resp['rsp'][0]
+            if respType == 'ntfy' or respType == 'ind':
+                # Arrived while waiting for something else, keep it for waitForNotification
+                self.notifications.append((resp['hnd'][0], resp['d'][0]))
+                continue
+            if respType == wantType:
+                return resp
+            elif respType == 'stat' and resp['state'][0] == 'disc':
+                self._stopHelper()
+                raise BTLEException(BTLEException.DISCONNECTED, "Device disconnected")
+            elif respType == 'err':
+                errcode=resp['code'][0]
+                raise BTLEException(BTLEException.COMM_ERROR, "Error from Bluetooth stack (%s)" % errcode)
+            else:
+                raise BTLEException(BTLEException.INTERNAL_ERROR, "Unexpected response (%s)" % respType)
+
+    def _command(self, method, *args):
+        # (command line, response type, function making the result of the response) of a PIPELINED request
+        if method == "discoverServices":
+            uuid = args[0] if args else None
+            return ("svcs %s\n" % uuid if uuid != None else "svcs\n", 'find', lambda rsp: self._services(rsp, uuid))
+        if method == "discoverCharacteristics":
+            return ("char %X %X\n" % args, 'find', self._characteristics)
+        if method == "discoverDescriptors":
+            return ("desc %X %X\n" % args, 'desc', self._descriptors)
+        if method == "read":
+            return ("rd %X\n" % args, 'rd', lambda rsp: rsp['d'][0])
+        (handle, value, withResponse) = args
+        return ("%s %X %s\n" % ("wrr" if withResponse else "wr", handle, binascii.b2a_hex(value)), 'wr', lambda rsp: None)
+
+    @staticmethod
+    def _services(rsp, uuid):
+        starts = rsp.get('hstart', [])
+        ends   = rsp.get('hend', [])
+        uuids  = rsp.get('uuid', [uuid] * len(starts))
+        assert( len(starts)==len(uuids) and len(ends)==len(uuids) )
+        return zip(starts, ends, uuids)
+
+    @staticmethod
+    def _characteristics(rsp):
+        nChars = len(rsp.get('hnd', []))
+        return [ (rsp['hnd'][i], rsp['props'][i], rsp['vhnd'][i], rsp['uuid'][i]) for i in range(nChars) ]
+
+    @staticmethod
+    def _descriptors(rsp):
+        nDesc = len(rsp.get('hnd', []))
+        return [ (rsp['hnd'][i], rsp['uuid'][i]) for i in range(nDesc) ]
+
+    def submit(self, method, *args):
+        if method not in PIPELINED:
+            raise ValueError("%s can't be submitted" % method)
+        (cmd, wantType, convert) = self._command(method, *args)
+        while len(self._pending) >= PIPELINE_DEPTH:
+            self._settle()
+        self._writeCmd(cmd)
+        future = Future(self._settle)
+        self._pending.append((future, wantType, convert))
+        return future
+
+    def _settle(self):
+        # Reads the response to the oldest outstanding request
+        (future, wantType, convert) = self._pending[0]
+        try:
+            resp = self._getResp(wantType)
+        except BTLEException as e:
+            if e.code != BTLEException.COMM_ERROR:
+                # the helper is gone or out of step, none of them will be answered
+                self._failPending(e)
+                return
+            self._pending.popleft()
+            future.fail(e)
+            return
+        self._pending.popleft()
+        future.set(convert(resp))
+
+    def _failPending(self, error):
+        while self._pending:
+            self._pending.popleft()[0].fail(error)
+
+    def _flush(self):
+        # Settles all outstanding requests, before a command that is not pipelined
+        while self._pending:
+            self._settle()
+
+    def status(self):
+        self._flush()
+        self._writeCmd("stat\n")
+        return self._getResp('stat')
+
+    def connect(self, addr):
+        self._startHelper()
+        self._flush()
+        self._writeCmd("conn %s\n" % addr)
+        rsp = self._getResp('stat')
+        while rsp['state'][0] == 'tryconn':
+            rsp = self._getResp('stat')
+        if rsp['state'][0] != 'conn':
+            self._stopHelper()
+            raise BTLEException(BTLEException.DISCONNECTED, "Failed to connect to peripheral")
+        self._connected = True
+
+    def disconnect(self):
+        if self._helper==None:
+            return
+        try:
+            self._flush()
+            self._writeCmd("disc\n")
+            self._getResp('stat')
+        except (IOError, BTLEException):
+            pass
+        self._stopHelper()
+
+    def isConnected(self):
+        return self._connected
+
+    def discoverServices(self, uuid=None):
+        return self.submit("discoverServices", uuid).result()
+
+    def _getIncludedServices(self,startHnd=1,endHnd=0xFFFF):
+        # TODO: No working example of this yet
+        self._flush()
+        self._writeCmd("incl %X %X\n" % (startHnd, endHnd) )
+        return self._getResp('find')
+
+    def discoverCharacteristics(self, startHnd=1, endHnd=0xFFFF):
+        return self.submit("discoverCharacteristics", startHnd, endHnd).result()
+
+    def discoverDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        return self.submit("discoverDescriptors", startHnd, endHnd).result()
+
+    def read(self, handle):
+        return self.submit("read", handle).result()
+
+    def _readCharacteristicByUUID(self,uuid,startHnd,endHnd):
+        # Not used at present
+        self._flush()
+        self._writeCmd("rdu %s %X %X\n" % (uuid, startHnd, endHnd) )
+        return self._getResp('rd')
+
+    def write(self, handle, value, withResponse=True):
+        self.submit("write", handle, value, withResponse).result()
+
+    def waitForNotification(self, timeout):
+        self._flush()
+        deadline = time.time() + timeout
+        while not self.notifications:
+            resp = self._nextResp(max(deadline - time.time(), 0), wake=True)
+            if resp == None:
+                return None
+            respType = resp.get('rsp', [None])[0]
+            if respType == 'ntfy' or respType == 'ind':
+                self.notifications.append((resp['hnd'][0], resp['d'][0]))
+            elif respType == 'stat' and resp['state'][0] == 'disc':
+                self._stopHelper()
+                raise BTLEException(BTLEException.DISCONNECTED, "Device disconnected")
+        return self.notifications.popleft()
+
+    def setSecurityLevel(self, level):
+        self._flush()
+        self._writeCmd("secu %s\n" % level)
+        self._getResp('stat')
+
+    def setMTU(self, mtu):
+        self._flush()
+        self._writeCmd("mtu %x\n" % mtu)
+        self._getResp('stat')
+        return mtu
@@ -0,0 +1,242 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Receiving notifications apart from processing them.
+
+The device threads only read from the radio and put what they received
+into the bounded queue of their device. A few processing threads take
+turns between the queues: a queue with weight w gets up to w items
+processed before the next queue is served, so a device notifying much
+faster than the others (or one whose processing is slow) only fills its
+own queue. What happens when a queue is full is its overflow policy:
+
+    "drop-oldest"  the oldest item makes room (the latest values win)
+    "drop-newest"  the new item is dropped
+    "block"        the device thread waits until there is room
+
+The depth of every queue is in the gauge ingest.depth, dropped items in
+the counter ingest.dropped (both per device).
+
+Device threads get their queue through IngestMixIn.
+'''
+
+import time
+import logging
+import threading
+from collections import deque
+
+from bpcore import metrics
+
+OVERFLOW = ("drop-oldest", "drop-newest", "block")
+
+
+class RingQueue(object):
+    '''
+    The queue of one device; handler(item) processes its items, one at a time.
+    Made by FairScheduler.register().
+    '''
+
+    def __init__(self, scheduler, name, handler, capacity, overflow, weight):
+        if overflow not in OVERFLOW:
+            raise ValueError("Unknown overflow policy %s" % repr(overflow))
+        self.scheduler = scheduler
+        self.name = name
+        self.handler = handler
+        self.capacity = max(int(capacity), 1)
+        self.overflow = overflow
+        self.weight = max(int(weight), 1)
+        self.items = deque()
+        self.busy = False # an item is being processed
+        self.closed = False
+
+    def put(self, item):
+        '''
+        Queues item; False if it (or an older one) was dropped.
+        '''
+        return self.scheduler._put(self, item)
+
+    def close(self):
+        '''
+        Accepts no more items; those queued are still processed.
+        '''
+        self.scheduler._close(self)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class FairScheduler(object):
+    '''
+    Processes the items of all registered queues with threads threads,
+    weighted round-robin between the queues.
+    '''
+
+    def __init__(self, threads=1):
+        self._cond = threading.Condition()
+        self._queues = []
+        self._next = 0
+        self._running = True
+        self._threads = []
+        for i in range(max(threads, 1)):
+            t = threading.Thread(target=self._work, name="processing %d" % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def register(self, name, handler, capacity=64, overflow="drop-oldest", weight=1):
+        queue = RingQueue(self, name, handler, capacity, overflow, weight)
+        with self._cond:
+            self._queues.append(queue)
+        return queue
+
+    def _put(self, queue, item):
+        with self._cond:
+            kept = True
+            while len(queue.items) >= queue.capacity and not queue.closed:
+                if queue.overflow == "drop-oldest":
+                    queue.items.popleft()
+                    kept = False
+                    break
+                if queue.overflow == "drop-newest":
+                    metrics.incr("ingest.dropped", device=queue.name)
+                    return False
+                metrics.incr("ingest.blocked", device=queue.name)
+                self._cond.wait(1.0)
+            if queue.closed:
+                metrics.incr("ingest.dropped", device=queue.name)
+                return False
+            if not kept:
+                metrics.incr("ingest.dropped", device=queue.name)
+            queue.items.append(item)
+            metrics.setGauge("ingest.depth", len(queue.items), device=queue.name)
+            self._cond.notify_all()
+            return kept
+
+    def _close(self, queue):
+        with self._cond:
+            queue.closed = True
+            self._remove(queue)
+            self._cond.notify_all()
+
+    def _remove(self, queue):
+        # with _cond held; closed queues go once they are drained
+        if queue.closed and not queue.items and not queue.busy and queue in self._queues:
+            i = self._queues.index(queue)
+            del self._queues[i]
+            if i < self._next:
+                self._next -= 1
+            metrics.drop("ingest.depth", device=queue.name)
+
+    def _take(self):
+        # with _cond held: the next queue in turn that has items and nobody working on it
+        n = len(self._queues)
+        for i in range(n):
+            queue = self._queues[(self._next + i) % n]
+            if queue.items and not queue.busy:
+                self._next = (self._next + i + 1) % n
+                items = [ queue.items.popleft() for j in range(min(queue.weight, len(queue.items))) ]
+                queue.busy = True
+                metrics.setGauge("ingest.depth", len(queue.items), device=queue.name)
+                return (queue, items)
+        return (None, None)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                (queue, items) = self._take()
+                while queue == None:
+                    if not self._running:
+                        return
+                    self._cond.wait(1.0)
+                    (queue, items) = self._take()
+                self._cond.notify_all() # room for blocked device threads
+            for item in items:
+                try:
+                    queue.handler(item)
+                except Exception:
+                    metrics.incr("ingest.errors", device=queue.name)
+                    logging.exception("Processing a notification of %s failed" % queue.name)
+            metrics.incr("ingest.processed", len(items), device=queue.name)
+            with self._cond:
+                queue.busy = False
+                self._remove(queue)
+                self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return sum([ len(q.items) for q in self._queues ])
+
+    def stop(self, timeout=10.0):
+        '''
+        Processes what is queued (for at most timeout seconds) and stops the threads.
+        '''
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(deadline - time.time(), 0))
+        left = self.pending()
+        if left:
+            logging.warning("%d notifications were not processed before the deadline" % left)
+
+
+class IngestMixIn(object):
+    '''
+    Queueing of the notifications of a device thread. The class calls
+    _setupIngest() before the thread starts, has deviceAddr and implements
+    _handleNotification(handle, data, received).
+    '''
+
+    def _setupIngest(self, threads, capacity=64, overflow="drop-oldest", weight=1):
+        # threads = 0 handles the notifications in the device thread
+        self.ingestQueue = None
+        self._ingestOptions = (threads, capacity, overflow, weight)
+
+    def _ingest(self, handle, data, received):
+        '''
+        Hands a notification to the processing threads of the shared
+        FairScheduler; without processing threads it is handled right away.
+        '''
+        (threads, capacity, overflow, weight) = self._ingestOptions
+        if not threads:
+            self._handleNotification(handle, data, received)
+            return
+        if self.ingestQueue == None:
+            self.ingestQueue = getScheduler(threads).register(self.deviceAddr,
+                lambda item: self._handleNotification(*item), capacity, overflow, weight)
+        self.ingestQueue.put((handle, data, received))
+
+    def _closeIngest(self):
+        # the queued notifications are still processed; wakes the thread if it waits for room in the queue
+        if self.ingestQueue != None:
+            self.ingestQueue.close()
+
+
+_scheduler = None
+_lock = threading.Lock()
+
+def getScheduler(threads=1):
+    '''
+    Returns the FairScheduler shared by the devices of the process.
+    '''
+    global _scheduler
+    with _lock:
+        if _scheduler == None:
+            _scheduler = FairScheduler(threads)
+        return _scheduler
+
+def stopScheduler(timeout=10.0):
+    '''
+    Stops the shared FairScheduler if there is one.
+    '''
+    global _scheduler
+    with _lock:
+        (scheduler, _scheduler) = (_scheduler, None)
+    if scheduler != None:
+        scheduler.stop(timeout)
@@ -0,0 +1,71 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Process wide counters and gauges.
+
+Names are plain strings; per device values are kept under
+"name[xx:xx:xx:xx:xx:xx]" so that a snapshot is a flat dict which can be
+logged or sent as JSON as is.
+'''
+
+import threading
+
+_lock = threading.Lock()
+_values = {}
+
+
+def _key(name, device):
+    if device == None:
+        return name
+    return "%s[%s]" % (name, device)
+
+def incr(name, n=1, device=None):
+    '''
+    Adds n to a counter.
+    '''
+    key = _key(name, device)
+    with _lock:
+        _values[key] = _values.get(key, 0) + n
+
+def setGauge(name, value, device=None):
+    '''
+    Sets a gauge to value.
+    '''
+    with _lock:
+        _values[_key(name, device)] = value
+
+def drop(name, device=None):
+    '''
+    Removes a counter or gauge, e.g. of a device that is gone.
+    '''
+    with _lock:
+        _values.pop(_key(name, device), None)
+
+def get(name, device=None, default=0):
+    with _lock:
+        return _values.get(_key(name, device), default)
+
+def snapshot():
+    '''
+    Returns a copy of all counters and gauges.
+    '''
+    with _lock:
+        return dict(_values)
+
+def reset():
+    with _lock:
+        _values.clear()
+
+def resetAfterFork():
+    '''
+    Starts over with an empty registry in a forked child, where the lock may
+    have been held by some other thread of the parent.
+    '''
+    global _lock, _values
+    _lock = threading.Lock()
+    _values = {}
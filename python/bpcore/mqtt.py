@@ -0,0 +1,206 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Just enough MQTT 3.1.1 to publish samples: a QoS 0 publishing client and
+Broker, a small in-process broker to test against. Broker accepts
+subscriptions (exact topics and a trailing "#"), forwards publishes to
+subscribers and records every message in Broker.messages.
+'''
+
+import socket
+import struct
+import threading
+import SocketServer
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+class MqttError(Exception):
+    pass
+
+
+def _string(s):
+    return struct.pack('>H', len(s)) + s
+
+def _packet(ptype, body, flags=0):
+    header = chr((ptype << 4) | flags)
+    n = len(body)
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        header += chr(b | 0x80 if n else b)
+        if not n:
+            return header + body
+
+def _recvAll(sock, n):
+    data = ''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise MqttError("Connection closed")
+        data += chunk
+    return data
+
+def readPacket(sock):
+    '''
+    Reads one packet, returns (type, flags, body).
+    '''
+    first = ord(_recvAll(sock, 1))
+    length = 0
+    for shift in range(0, 28, 7):
+        b = ord(_recvAll(sock, 1))
+        length |= (b & 0x7F) << shift
+        if not b & 0x80:
+            break
+    else:
+        raise MqttError("Bad remaining length")
+    return (first >> 4, first & 0x0F, _recvAll(sock, length))
+
+def encodeConnect(clientId, keepalive):
+    # clean session, no credentials
+    return _packet(CONNECT, _string("MQTT") + struct.pack('>BBH', 4, 0x02, keepalive) + _string(clientId))
+
+def encodePublish(topic, payload):
+    return _packet(PUBLISH, _string(topic) + payload)
+
+def decodePublish(flags, body):
+    n = struct.unpack('>H', body[:2])[0]
+    pos = 2 + n
+    if (flags >> 1) & 0x03:
+        pos += 2 # packet identifier of QoS 1/2
+    return (body[2:2 + n], body[pos:])
+
+
+class MqttClient(object):
+    '''
+    Publishes with QoS 0 over one TCP connection.
+    '''
+
+    def __init__(self, host, port=1883, clientId="bpart", keepalive=60, timeout=10):
+        self.host = host
+        self.port = port
+        self.clientId = clientId
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._sock = None
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.sendall(encodeConnect(self.clientId, self.keepalive))
+            (ptype, flags, body) = readPacket(sock)
+            if ptype != CONNACK or len(body) < 2 or ord(body[1]) != 0:
+                raise MqttError("Connection refused by broker")
+        except (socket.error, MqttError):
+            sock.close()
+            raise
+        self._sock = sock
+
+    def publish(self, topic, payload):
+        if self._sock == None:
+            self.connect()
+        try:
+            self._sock.sendall(encodePublish(topic, payload))
+        except socket.error:
+            self.close()
+            raise
+
+    def ping(self):
+        if self._sock != None:
+            self._sock.sendall(_packet(PINGREQ, ''))
+
+    def close(self):
+        if self._sock != None:
+            try:
+                self._sock.sendall(_packet(DISCONNECT, ''))
+            except socket.error:
+                pass
+            self._sock.close()
+            self._sock = None
+
+
+class _BrokerHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        broker = self.server
+        sock = self.request
+        try:
+            while True:
+                (ptype, flags, body) = readPacket(sock)
+                if ptype == CONNECT:
+                    sock.sendall(_packet(CONNACK, '\x00\x00'))
+                elif ptype == PUBLISH:
+                    (topic, payload) = decodePublish(flags, body)
+                    broker.published(topic, payload)
+                elif ptype == SUBSCRIBE:
+                    (packetId,) = struct.unpack('>H', body[:2])
+                    pos = 2
+                    granted = ''
+                    while pos < len(body):
+                        n = struct.unpack('>H', body[pos:pos + 2])[0]
+                        broker.subscribe(body[pos + 2:pos + 2 + n], sock)
+                        pos += 3 + n
+                        granted += '\x00'
+                    sock.sendall(_packet(SUBACK, struct.pack('>H', packetId) + granted))
+                elif ptype == PINGREQ:
+                    sock.sendall(_packet(PINGRESP, ''))
+                elif ptype == DISCONNECT:
+                    break
+        except (MqttError, socket.error):
+            pass
+        finally:
+            broker.unsubscribe(sock)
+
+
+class Broker(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''
+    In-process stand-in for an MQTT broker, for tests.
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        SocketServer.TCPServer.__init__(self, address, _BrokerHandler)
+        self.messages = []
+        self._subscriptions = []
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def subscribe(self, pattern, sock):
+        with self._lock:
+            self._subscriptions.append((pattern, sock))
+
+    def unsubscribe(self, sock):
+        with self._lock:
+            self._subscriptions = [ (p, s) for (p, s) in self._subscriptions if s is not sock ]
+
+    def published(self, topic, payload):
+        with self._lock:
+            self.messages.append((topic, payload))
+            targets = [ s for (p, s) in self._subscriptions
+                        if p == topic or (p.endswith('#') and topic.startswith(p[:-1])) ]
+        for sock in targets:
+            try:
+                sock.sendall(encodePublish(topic, payload))
+            except socket.error:
+                pass
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
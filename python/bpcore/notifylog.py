@@ -0,0 +1,186 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Batch decoder for captured gatttool notification lines
+
+    Notification handle = 0x001b value: 48 5f
+    ...
+
+for offline analysis. Instead of parsing line by line, a chunk of lines is
+turned into one fixed width byte matrix; handles and payloads are cut out
+of it as columns, hex digits are converted with a lookup table and the
+values are scaled like BPart does, all as NumPy array operations:
+
+    columns = decode(open("capture.txt"))
+    columns["Temperature"].values   # float64 array, degrees Celsius
+    columns["Acceleration"].values  # float64 array of shape (n, 3), g
+
+line holds the (0 based) line number of every value, to line the sensors
+up again. Running the module decodes a file and prints a summary
+(--handle overrides the handle of a sensor, e.g. for a capture of the
+simulator, which has its own layout):
+
+    python -m bpcore.notifylog capture.txt --handle Light=0x07
+'''
+
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+# sensor -> (dtype, values per notification, divisor), as parsed by bpart.BPart
+FORMATS = {
+    "Light": ('<u4', 1, None),
+    "Acceleration": ('<i2', 3, 1000.0 * 16),
+    "Temperature": ('<i2', 1, 1000.0),
+    "Humidity": ('<u2', 1, None),
+}
+
+# Value handles of the bPart firmware (as in bpart_async/btle_alt.py); pass handles= for other layouts
+HANDLES = {
+    "Light": 0x13,
+    "Acceleration": 0x17,
+    "Temperature": 0x1b,
+    "Humidity": 0x1f,
+}
+
+CHUNK = 1 << 18 # lines per matrix
+
+_MARKER = "handle = 0x"
+_MARKER_BYTES = np.frombuffer(_MARKER, dtype=np.uint8)
+_PLAIN = len("Notification ")
+_VALUE_OFFSET = len(_MARKER) + len("0000 value: ") # from the marker to the first hex digit
+
+# ASCII -> value of the hex digit
+_HEX = np.zeros(256, dtype=np.uint8)
+for (i, c) in enumerate("0123456789abcdef"):
+    _HEX[ord(c)] = i
+    _HEX[ord(c.upper())] = i
+
+Column = namedtuple("Column", ("line", "values"))
+
+
+def _hexColumns(mat, rows, start, n):
+    # Converts n hex digits per row starting at column start (per row) to their values
+    cols = start[:, None] + np.arange(n)
+    return _HEX[mat[rows[:, None], cols]]
+
+def _decodeChunk(lines, firstLine, byHandle, parts):
+    arr = np.array(lines, dtype='S')
+    width = arr.dtype.itemsize
+    mat = arr.view(np.uint8).reshape(len(lines), width)
+    lengths = np.count_nonzero(mat, axis=1)
+    # Most lines have the marker right after "Notification ", only the
+    # others (prompt or escape sequences in front) are searched
+    offsets = np.full(len(lines), -1, dtype=np.intp)
+    if width >= _PLAIN + len(_MARKER):
+        plain = (mat[:, _PLAIN:_PLAIN + len(_MARKER)] == _MARKER_BYTES).all(axis=1)
+        offsets[plain] = _PLAIN
+    else:
+        plain = np.zeros(len(lines), dtype=bool)
+    other = np.flatnonzero(~plain)
+    if len(other):
+        offsets[other] = np.char.find(arr[other], _MARKER)
+    rows = np.flatnonzero(offsets >= 0)
+    if not len(rows):
+        return
+    offsets = offsets[rows] + len(_MARKER)
+    digits = _hexColumns(mat, rows, offsets, 4).astype(np.uint16)
+    handles = (digits[:, 0] << 12) | (digits[:, 1] << 8) | (digits[:, 2] << 4) | digits[:, 3]
+    starts = offsets - len(_MARKER) + _VALUE_OFFSET
+
+    for (handle, name) in byHandle.items():
+        (dtype, count, divisor) = FORMATS[name]
+        size = np.dtype(dtype).itemsize * count
+        sel = np.flatnonzero(handles == handle)
+        # notifications with a shorter payload than the sensor's format are skipped
+        sel = sel[lengths[rows[sel]] >= starts[sel] + 3 * size - 1]
+        if not len(sel):
+            continue
+        r = rows[sel]
+        cols = starts[sel][:, None] + 3 * np.arange(size)
+        raw = (_HEX[mat[r[:, None], cols]] << 4) | _HEX[mat[r[:, None], cols + 1]]
+        values = np.ascontiguousarray(raw).view(dtype)
+        if divisor != None:
+            values = values / divisor
+        values = values.reshape(len(r), count) if count > 1 else values.ravel()
+        parts[name].append((r + firstLine, values))
+
+
+def decode(lines, handles=None, chunk=CHUNK):
+    '''
+    Decodes notification lines (a file or any iterable of strings) into a
+    dict sensor name -> Column(line, values). handles maps sensor names to
+    value handles and defaults to HANDLES. Other lines are ignored.
+    '''
+    byHandle = dict([ (h, name) for (name, h) in (handles or HANDLES).items() ])
+    parts = dict([ (name, []) for name in byHandle.values() ])
+    buf = []
+    first = 0
+    for line in lines:
+        buf.append(line)
+        if len(buf) == chunk:
+            _decodeChunk(buf, first, byHandle, parts)
+            first += len(buf)
+            buf = []
+    if buf:
+        _decodeChunk(buf, first, byHandle, parts)
+
+    columns = {}
+    for (name, chunks) in parts.items():
+        (dtype, count, divisor) = FORMATS[name]
+        if chunks:
+            columns[name] = Column(np.concatenate([ l for (l, v) in chunks ]),
+                                   np.concatenate([ v for (l, v) in chunks ]))
+        else:
+            shape = (0, count) if count > 1 else (0,)
+            columns[name] = Column(np.zeros(0, dtype=np.intp),
+                                   np.zeros(shape, dtype=np.float64 if divisor else dtype))
+    return columns
+
+
+def decodeFile(path, handles=None, chunk=CHUNK):
+    with open(path, 'rb') as f:
+        return decode(f.read().splitlines(), handles, chunk)
+
+
+def _handleArg(s):
+    (name, handle) = s.split('=', 1)
+    if name not in FORMATS:
+        raise argparse.ArgumentTypeError("Unknown sensor %s" % name)
+    return (name, int(handle, 0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode captured gatttool notification lines")
+    parser.add_argument("path")
+    parser.add_argument("--handle", type=_handleArg, action="append", default=[],
+                        help="value handle of a sensor, e.g. Temperature=0x1b")
+    args = parser.parse_args(argv)
+
+    handles = dict(HANDLES)
+    handles.update(dict(args.handle))
+    t = time.time()
+    with open(args.path, 'rb') as f:
+        lines = f.read().splitlines()
+    columns = decode(lines, handles)
+    elapsed = time.time() - t
+    for name in sorted(columns):
+        values = columns[name].values
+        if len(values):
+            print "%-13s %8d  mean %s  min %s  max %s" % (name, len(values), values.mean(axis=0),
+                                                          values.min(axis=0), values.max(axis=0))
+        else:
+            print "%-13s %8d" % (name, 0)
+    print "%d lines in %.3fs (%.0f lines/s)" % (len(lines), elapsed, len(lines) / max(elapsed, 1e-9))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+JSON payloads built from precompiled templates.
+
+The structure of a CUMULUS payload and its unit strings never change, only
+the six numbers do. A PayloadTemplate runs json.dumps once on a skeleton
+with placeholders and keeps the result as a format string, so encoding a
+sample is a single string formatting. The output is byte for byte what
+json.dumps produces for the same dict.
+
+CUMULUS stamps documents with the time they arrive. CUMULUS_TIMED adds
+the time the sample was taken (milliseconds since the epoch), so that
+samples sent late (batched, spooled) keep their time.
+'''
+
+import json
+
+_MARKER = "\x00%d\x00"
+
+
+class PayloadTemplate(object):
+    '''
+    A payload of the form {"data": {name: {"value": str(v), "unit": unit}}}.
+    fields is a list of (name, unit); encode() takes the values in this order.
+    With timeField the payload also has {timeField: t} with the number t,
+    which encode() takes before the values.
+    '''
+
+    def __init__(self, fields, timeField=None):
+        self.fields = list(fields)
+        self.timeField = timeField
+        document = {'data': dict([ (name, {'value': _MARKER % i, 'unit': unit})
+                                   for (i, (name, unit)) in enumerate(self.fields) ])}
+        # json.dumps escapes the marker bytes, find them in their escaped form
+        escaped = [ json.dumps(_MARKER % i)[1:-1] for i in range(len(self.fields)) ]
+        if timeField != None:
+            # shift the values by one, the time comes first and is a number, not a string
+            document = {'data': dict([ (name, {'value': _MARKER % (i + 1), 'unit': unit})
+                                       for (i, (name, unit)) in enumerate(self.fields) ]),
+                        timeField: _MARKER % 0}
+            escaped = [ json.dumps(_MARKER % 0) ] + [ json.dumps(_MARKER % (i + 1))[1:-1] for i in range(len(self.fields)) ]
+        skeleton = json.dumps(document)
+        positions = sorted([ (skeleton.index(m), i, m) for (i, m) in enumerate(escaped) ])
+        parts = []
+        last = 0
+        self._order = []
+        for (pos, i, m) in positions:
+            parts.append(skeleton[last:pos].replace('%', '%%'))
+            self._order.append(i)
+            last = pos + len(m)
+        parts.append(skeleton[last:].replace('%', '%%'))
+        self._format = '%s'.join(parts)
+        # fast path: values already in the order they appear in the output
+        self._inOrder = self._order == range(len(escaped))
+
+    def encode(self, *values):
+        '''
+        Returns the JSON string for one sample. Values are converted with
+        str() like the hand-written encoders did.
+        '''
+        if self._inOrder:
+            return self._format % tuple(map(str, values))
+        return self._format % tuple([ str(values[i]) for i in self._order ])
+
+    def encodeBatch(self, samples):
+        '''
+        Encodes a list of value tuples into one JSON array.
+        '''
+        return '[' + ','.join([ self.encode(*values) for values in samples ]) + ']'
+
+
+# Temperature, Humidity, Light, AccelX, AccelY, AccelZ as sent by both clients
+CUMULUS = PayloadTemplate([('Temperature', 'degC'), ('Humidity', 'Percent'), ('Light', 'Number'),
+                           ('AccelX', 'Number'), ('AccelY', 'Number'), ('AccelZ', 'Number')])
+CUMULUS_TIMED = PayloadTemplate(CUMULUS.fields, timeField='timestamp')
@@ -0,0 +1,118 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+The device list as a file that can be edited while the gateway runs.
+
+The file has one address per line; everything after a "#" is a comment.
+DeviceRegistry checks it every interval seconds and applies the difference
+to the running fleet (anything with add(addr) and remove(addr)), so only
+the devices that were added or removed are started or stopped.
+'''
+
+import os
+import logging
+import threading
+
+from bpcore import metrics
+
+
+def readDevices(path):
+    '''
+    Returns the addresses listed in path, upper case, without duplicates.
+    Raises IOError if the file can't be read.
+    '''
+    devices = []
+    with open(path) as f:
+        for (n, line) in enumerate(f):
+            addr = line.split('#', 1)[0].strip().upper()
+            if not addr:
+                continue
+            if len(addr.split(':')) != 6:
+                logging.warning("%s:%d: %s is not a device address" % (path, n + 1, repr(addr)))
+                continue
+            if addr not in devices:
+                devices.append(addr)
+    return devices
+
+def writeDevices(path, devices):
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write("# One bpart address per line, changes are applied while the gateway runs\n")
+        for addr in devices:
+            f.write(addr + "\n")
+    os.rename(tmp, path)
+
+def loadDevices(path, default):
+    '''
+    Returns the devices of path; if it doesn't exist yet it is created with default.
+    '''
+    if not os.path.exists(path):
+        writeDevices(path, default)
+    return readDevices(path)
+
+
+class DeviceRegistry(threading.Thread):
+    '''
+    Watches path and adds/removes devices of fleet accordingly. devices
+    is what fleet runs when the registry starts.
+    '''
+
+    def __init__(self, path, fleet, devices, interval=2.0):
+        threading.Thread.__init__(self, name="device registry")
+        self.daemon = True
+        self.path = path
+        self.fleet = fleet
+        self.devices = list(devices)
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._stamp = self._fileStamp()
+
+    def _fileStamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime, st.st_size, st.st_ino)
+        except OSError:
+            return None
+
+    def check(self):
+        '''
+        Applies changes of the file; returns (added, removed).
+        '''
+        stamp = self._fileStamp()
+        if stamp == None or stamp == self._stamp:
+            return ([], [])
+        try:
+            wanted = readDevices(self.path)
+        except IOError as e:
+            logging.warning("Could not read %s: %s" % (self.path, e))
+            return ([], [])
+        self._stamp = stamp
+        removed = [ addr for addr in self.devices if addr not in wanted ]
+        added = [ addr for addr in wanted if addr not in self.devices ]
+        for addr in removed:
+            logging.info("Device %s removed from %s" % (addr, self.path))
+            self.fleet.remove(addr)
+            self.devices.remove(addr)
+        for addr in added:
+            logging.info("Device %s added to %s" % (addr, self.path))
+            self.fleet.add(addr)
+            self.devices.append(addr)
+        if added or removed:
+            metrics.incr("registry.changes")
+            metrics.setGauge("registry.devices", len(self.devices))
+        return (added, removed)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logging.exception("Applying %s failed" % self.path)
+
+    def stop(self):
+        self._stopped.set()
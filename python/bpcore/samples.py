@@ -0,0 +1,20 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+The sample record both clients produce: one complete set of bPart sensor
+values. device is the address ("xx:xx:xx:xx:xx:xx"), timestamp seconds
+since the epoch, acceleration an (x, y, z) tuple in g.
+'''
+
+import time
+from collections import namedtuple
+
+Sample = namedtuple("Sample", "device timestamp temperature humidity light acceleration")
+
+def makeSample(device, temperature, humidity, light, acceleration, timestamp=None):
+    return Sample(device, time.time() if timestamp == None else timestamp, temperature, humidity, light, tuple(acceleration))
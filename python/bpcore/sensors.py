@@ -0,0 +1,39 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+GATT layout of the bPart sensors.
+
+Every sensor has its own service. The characteristic following the
+service UUID carries the value, the one after that switches the sensor
+on ('\\x01') and off ('\\x00').
+'''
+
+
+def bpartUUID(val):
+    '''
+    Utility function to calculate the UUID for a bpart.
+    '''
+    return "%08x-3941-4a4b-a3cc-b2602ffe0d00" % (0x4B822000 + val)
+
+
+# (name, service offset) for every sensor of a bPart
+SENSORS = [
+    ("Light", 0xF00),
+    ("Acceleration", 0xF10),
+    ("Temperature", 0xF20),
+    ("Humidity", 0xF30),
+]
+
+def serviceUUID(offset):
+    return bpartUUID(offset)
+
+def valueUUID(offset):
+    return bpartUUID(offset + 1)
+
+def configUUID(offset):
+    return bpartUUID(offset + 2)
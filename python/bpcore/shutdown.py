@@ -0,0 +1,99 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Stopping the gateway in order, within a deadline.
+
+The clients add their stop steps to a Shutdown as they start things, in
+the order they have to be stopped: what produces samples (control API,
+device registry, devices, workers) before what carries them away (sinks,
+capture files). wait() returns on SIGTERM, SIGINT or SIGHUP, or when Enter
+is pressed; run() then calls every step with the seconds left until the
+deadline. Steps that fail or take too long are logged and the next one
+runs anyway, so the sinks always get their chance to spool.
+'''
+
+import time
+import signal
+import logging
+import threading
+
+from bpcore import metrics
+
+SIGNALS = {signal.SIGTERM: "SIGTERM", signal.SIGINT: "SIGINT", signal.SIGHUP: "SIGHUP"}
+
+
+class Shutdown(object):
+    '''
+    The stop steps of the process and the event that starts them.
+    '''
+
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self.requested = threading.Event()
+        self.reason = None
+        self._steps = []
+
+    def add(self, name, stop):
+        '''
+        Adds stop(timeout) as the next step, timeout being the seconds left.
+        '''
+        self._steps.append((name, stop))
+
+    def request(self, reason):
+        if not self.requested.is_set():
+            self.reason = reason
+            logging.info("Shutdown requested (%s)" % reason)
+            self.requested.set()
+
+    def installSignalHandlers(self):
+        '''
+        Makes the signals in SIGNALS request the shutdown. Must be called from the main thread.
+        '''
+        for (signum, name) in SIGNALS.items():
+            signal.signal(signum, lambda signum, frame: self.request(SIGNALS[signum]))
+
+    def _readInput(self, prompt):
+        try:
+            raw_input(prompt)
+        except EOFError:
+            return # no terminal (e.g. run as a service), only signals stop us
+        self.request("input")
+
+    def wait(self, prompt=None):
+        '''
+        Waits until the shutdown is requested; with prompt also by pressing Enter.
+        '''
+        if prompt != None:
+            t = threading.Thread(target=self._readInput, args=(prompt,), name="shutdown prompt")
+            t.daemon = True
+            t.start()
+        while not self.requested.is_set():
+            # Python 2 only handles signals between waits
+            self.requested.wait(1.0)
+
+    def run(self):
+        '''
+        Runs the steps; returns False if the deadline was missed.
+        '''
+        self.request("run")
+        started = time.time()
+        deadline = started + self.timeout
+        for (name, stop) in self._steps:
+            t = time.time()
+            try:
+                stop(max(deadline - t, 0))
+            except Exception:
+                logging.exception("Stopping %s failed" % name)
+            logging.info("Stopped %s in %.2fs" % (name, time.time() - t))
+        took = time.time() - started
+        metrics.setGauge("shutdown.seconds", took)
+        if took > self.timeout:
+            logging.warning("Shutdown took %.1fs, %.1fs were allowed" % (took, self.timeout))
+            return False
+        logging.info("Shutdown complete after %.2fs" % took)
+        return True
@@ -0,0 +1,364 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Simulator backend.
+
+SimulatedBPart is an in-process bPart: a GATT database with the four
+sensor services and a sensor model, served over ATT. SimTransport connects
+to it through a socketpair and reuses the AttClient of the native backend,
+so everything above the radio runs exactly as with real hardware.
+
+Devices are looked up by address in DEVICES; unknown addresses get a
+default SimulatedBPart, so any config.DEVICES list can be simulated.
+Transports created with an iface connect through the SimulatedAdapter of
+that name in ADAPTERS, which limits the number of connections and can be
+made to fail.
+'''
+
+import time
+import errno
+import random
+import select
+import socket
+import struct
+import threading
+import logging
+
+from bpcore import att
+from bpcore.att import AttTransport
+from bpcore.sensors import SENSORS, serviceUUID, valueUUID, configUUID
+
+PROP_READ = 0x02
+PROP_WRITE_NO_RSP = 0x04
+PROP_WRITE = 0x08
+PROP_NOTIFY = 0x10
+
+SIM_MTU = 247
+SIM_ADAPTER_CAPACITY = 5
+
+
+def _norm(uuid):
+    return att.unpackUUID(att.packUUID(uuid))
+
+PRIMARY = _norm(att.GATT_PRIM_SVC_UUID)
+CHARACTERISTIC = _norm(att.GATT_CHARAC_UUID)
+CCCD = _norm(att.GATT_CLIENT_CHARAC_CFG_UUID)
+
+
+class _Attribute(object):
+    __slots__ = ('handle', 'type', 'value')
+
+    def __init__(self, handle, attType, value):
+        self.handle = handle
+        self.type = attType
+        self.value = value
+
+
+class SimulatedBPart(object):
+    '''
+    A simulated bPart. interval is the time between two notification rounds
+    while sensors and notifications are enabled; latency is added before
+    every response to model the radio round trip.
+    '''
+
+    def __init__(self, addr, interval=1.0, latency=0.0, connectLatency=0.0, seed=None):
+        self.addr = addr
+        self.interval = interval
+        self.latency = latency
+        self.connectLatency = connectLatency
+        self.reachable = True
+        self._rand = random.Random(addr if seed == None else seed)
+        self._attrs = []
+        self._sensors = {}
+        self._socks = []
+        self._lock = threading.Lock()
+        self._state = {"Light": 600.0, "Acceleration": (0.0, 0.0, 1.0), "Temperature": 25.0, "Humidity": 23.0}
+        self._build()
+
+    # GATT database ------------------------------------------------------
+
+    def _add(self, attType, value):
+        attr = _Attribute(len(self._attrs) + 1, _norm(attType), value)
+        self._attrs.append(attr)
+        return attr
+
+    def _addCharacteristic(self, uuid, props, value):
+        handle = len(self._attrs) + 1
+        self._add(att.GATT_CHARAC_UUID, struct.pack('<BH', props, handle + 1) + att.packUUID(uuid))
+        return self._add(uuid, value)
+
+    def _build(self):
+        self._add(att.GATT_PRIM_SVC_UUID, att.packUUID(0x1800))
+        self._addCharacteristic(0x2A00, PROP_READ, "bPart")
+        self._add(att.GATT_PRIM_SVC_UUID, att.packUUID(0x1801))
+        for (name, offset) in SENSORS:
+            self._add(att.GATT_PRIM_SVC_UUID, att.packUUID(serviceUUID(offset)))
+            value = self._addCharacteristic(valueUUID(offset), PROP_READ | PROP_NOTIFY, self._reading(name))
+            cccd = self._add(att.GATT_CLIENT_CHARAC_CFG_UUID, '\x00\x00')
+            config = self._addCharacteristic(configUUID(offset), PROP_READ | PROP_WRITE, '\x00')
+            self._sensors[name] = (value, cccd, config)
+
+    def _groupEnd(self, attr):
+        for other in self._attrs[attr.handle:]:
+            if other.type == PRIMARY:
+                return other.handle - 1
+        return 0xFFFF
+
+    def _inRange(self, startHnd, endHnd):
+        return self._attrs[max(startHnd, 1) - 1:min(endHnd, len(self._attrs))]
+
+    # Sensor model -------------------------------------------------------
+
+    def _reading(self, name):
+        # Random walk around the current state, encoded like the firmware does
+        r = self._rand
+        if name == "Light":
+            self._state[name] = max(0.0, self._state[name] + r.gauss(0, 5))
+            return struct.pack('<I', int(self._state[name]))
+        if name == "Acceleration":
+            (x, y, z) = [ v + r.gauss(0, 0.005) for v in self._state[name] ]
+            return struct.pack('<hhh', *[ int(v * 1000 * 16) for v in (x, y, z) ])
+        if name == "Temperature":
+            self._state[name] += r.gauss(0, 0.01)
+            return struct.pack('<h', int(self._state[name] * 1000))
+        self._state[name] = min(100.0, max(0.0, self._state[name] + r.gauss(0, 0.1)))
+        return struct.pack('<H', int(self._state[name]))
+
+    def _notifications(self):
+        pdus = []
+        for (name, (value, cccd, config)) in self._sensors.items():
+            if config.value == '\x01' and ord(cccd.value[0]) & 0x01:
+                value.value = self._reading(name)
+                pdus.append(att.encodeNotification(value.handle, value.value))
+        return pdus
+
+    # ATT server ---------------------------------------------------------
+
+    def _handle(self, pdu, conn):
+        op = att.opcode(pdu)
+        mtu = conn['mtu']
+        if op == att.ATT_OP_MTU_REQ:
+            conn['mtu'] = max(att.ATT_DEFAULT_MTU, min(att.decodeMtu(pdu), SIM_MTU))
+            return att.encodeMtuRsp(SIM_MTU)
+        if op in (att.ATT_OP_READ_BY_GROUP_REQ, att.ATT_OP_READ_BY_TYPE_REQ, att.ATT_OP_FIND_INFO_REQ):
+            (startHnd, endHnd, uuid) = att.decodeRangeReq(pdu)
+            if startHnd == 0 or startHnd > endHnd:
+                return att.encodeErrorRsp(op, startHnd, att.ATT_ECODE_INVALID_HANDLE)
+            attrs = self._inRange(startHnd, endHnd)
+            if op == att.ATT_OP_READ_BY_GROUP_REQ:
+                items = [ (a.handle, self._groupEnd(a), a.value) for a in attrs if a.type == uuid ]
+                items = [ i for i in items if len(i[2]) == len(items[0][2]) ] if items else []
+                items = items[:(mtu - 2) // (4 + len(items[0][2]))] if items else []
+                rsp = att.encodeReadByGroupRsp(items) if items else None
+            elif op == att.ATT_OP_READ_BY_TYPE_REQ:
+                items = [ (a.handle, a.value[:mtu - 4]) for a in attrs if a.type == uuid ]
+                items = [ i for i in items if len(i[1]) == len(items[0][1]) ] if items else []
+                items = items[:(mtu - 2) // (2 + len(items[0][1]))] if items else []
+                rsp = att.encodeReadByTypeRsp(items) if items else None
+            else:
+                items = [ (a.handle, a.type) for a in attrs ]
+                items = [ i for i in items if len(att.packUUID(i[1])) == len(att.packUUID(items[0][1])) ] if items else []
+                items = items[:(mtu - 2) // (2 + len(att.packUUID(items[0][1])))] if items else []
+                rsp = att.encodeFindInfoRsp(items) if items else None
+            return rsp or att.encodeErrorRsp(op, startHnd, att.ATT_ECODE_ATTR_NOT_FOUND)
+        if op == att.ATT_OP_FIND_BY_TYPE_REQ:
+            (startHnd, endHnd, attType, value) = att.decodeFindByTypeReq(pdu)
+            ranges = [ (a.handle, self._groupEnd(a)) for a in self._inRange(startHnd, endHnd)
+                       if a.type == _norm(attType) and a.value == value ]
+            if not ranges:
+                return att.encodeErrorRsp(op, startHnd, att.ATT_ECODE_ATTR_NOT_FOUND)
+            return att.encodeFindByTypeRsp(ranges[:(mtu - 1) // 4])
+        if op in (att.ATT_OP_READ_REQ, att.ATT_OP_READ_BLOB_REQ, att.ATT_OP_WRITE_REQ, att.ATT_OP_WRITE_CMD):
+            (handle, data) = att.decodeHandleValue(pdu)
+            if handle == 0 or handle > len(self._attrs):
+                if op == att.ATT_OP_WRITE_CMD:
+                    return None
+                return att.encodeErrorRsp(op, handle, att.ATT_ECODE_INVALID_HANDLE)
+            attr = self._attrs[handle - 1]
+            if op == att.ATT_OP_READ_REQ:
+                return att.encodeReadRsp(attr.value[:mtu - 1])
+            if op == att.ATT_OP_READ_BLOB_REQ:
+                offset = struct.unpack('<H', data[:2])[0]
+                return att.encodeReadBlobRsp(attr.value[offset:offset + mtu - 1])
+            attr.value = data
+            return att.encodeWriteRsp() if op == att.ATT_OP_WRITE_REQ else None
+        if op == att.ATT_OP_HANDLE_CNF or op & 0x40:
+            return None # confirmations and commands get no answer
+        return att.encodeErrorRsp(op, 0, att.ATT_ECODE_REQ_NOT_SUPP)
+
+    def _serve(self, sock, adapter):
+        conn = {'mtu': att.ATT_DEFAULT_MTU}
+        nextRound = time.time() + self.interval
+        try:
+            while True:
+                (r, _, _) = select.select([sock], [], [], max(nextRound - time.time(), 0))
+                if r:
+                    pdu = sock.recv(att.ATT_MAX_MTU)
+                    if not pdu:
+                        break
+                    with self._lock:
+                        rsp = self._handle(pdu, conn)
+                    if rsp != None:
+                        if self.latency:
+                            time.sleep(self.latency)
+                        sock.send(rsp)
+                if time.time() >= nextRound:
+                    with self._lock:
+                        pdus = self._notifications()
+                    for pdu in pdus:
+                        sock.send(pdu)
+                    nextRound = max(nextRound + self.interval, time.time())
+        except (socket.error, select.error) as e:
+            logging.debug("Simulated %s: connection closed (%s)" % (self.addr, e))
+        finally:
+            with self._lock:
+                if sock in self._socks:
+                    self._socks.remove(sock)
+            if adapter != None:
+                adapter.detach(sock)
+            sock.close()
+
+    def accept(self, sock, adapter=None):
+        '''
+        Serves one connection on sock in a background thread.
+        '''
+        with self._lock:
+            # Client characteristic configuration is per connection
+            for (value, cccd, config) in self._sensors.values():
+                cccd.value = '\x00\x00'
+            self._socks.append(sock)
+        t = threading.Thread(target=self._serve, args=(sock, adapter))
+        t.daemon = True
+        t.start()
+
+    def advertisingData(self):
+        '''
+        Current advertising data: flags, the sensor values as read by the
+        "bpart" decoder of bpcore.adverts, and the name.
+        '''
+        from bpcore.adverts import adStructure, encodeBPartAdvert, AD_FLAGS, AD_COMPLETE_NAME
+        with self._lock:
+            for (name, offset) in SENSORS:
+                self._reading(name) # next step of the random walk
+            state = dict(self._state)
+        values = encodeBPartAdvert(state["Temperature"], state["Humidity"], state["Light"], state["Acceleration"])
+        return adStructure(AD_FLAGS, '\x06') + values + adStructure(AD_COMPLETE_NAME, "bPart")
+
+    def dropConnections(self):
+        '''
+        Simulates a link loss on all open connections.
+        '''
+        with self._lock:
+            socks = list(self._socks)
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    @property
+    def connections(self):
+        return len(self._socks)
+
+
+class SimulatedAdapter(object):
+    '''
+    A simulated local adapter which accepts at most capacity connections.
+    '''
+
+    def __init__(self, iface, capacity=SIM_ADAPTER_CAPACITY):
+        self.iface = iface
+        self.capacity = capacity
+        self.up = True
+        self._socks = []
+        self._lock = threading.Lock()
+
+    def attach(self, sock):
+        with self._lock:
+            if not self.up:
+                raise socket.error(errno.ENODEV, "Simulated %s is down" % self.iface)
+            if len(self._socks) >= self.capacity:
+                raise socket.error(errno.EBUSY, "Simulated %s has no free connection slot" % self.iface)
+            self._socks.append(sock)
+
+    def detach(self, sock):
+        with self._lock:
+            if sock in self._socks:
+                self._socks.remove(sock)
+
+    def fail(self):
+        '''
+        Simulates a dead adapter: all its connections drop, new ones fail.
+        '''
+        with self._lock:
+            self.up = False
+            socks = list(self._socks)
+        for sock in socks:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def recover(self):
+        self.up = True
+
+    @property
+    def connections(self):
+        return len(self._socks)
+
+
+DEVICES = {}
+ADAPTERS = {}
+
+def addDevice(device):
+    DEVICES[device.addr] = device
+    return device
+
+def getDevice(addr):
+    if addr not in DEVICES:
+        addDevice(SimulatedBPart(addr))
+    return DEVICES[addr]
+
+def addAdapter(adapter):
+    ADAPTERS[adapter.iface] = adapter
+    return adapter
+
+def getAdapter(iface):
+    if iface not in ADAPTERS:
+        addAdapter(SimulatedAdapter(iface))
+    return ADAPTERS[iface]
+
+
+class SimTransport(AttTransport):
+    '''
+    Transport backend connected to a SimulatedBPart instead of a radio.
+    '''
+
+    name = "sim"
+
+    def _openSocket(self, addr):
+        device = getDevice(addr)
+        if device.connectLatency:
+            time.sleep(device.connectLatency)
+        if not device.reachable:
+            raise socket.error(errno.EHOSTUNREACH, "Simulated %s is not reachable" % addr)
+        (local, remote) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        adapter = None
+        if self.iface != None:
+            adapter = getAdapter(self.iface)
+            try:
+                adapter.attach(remote)
+            except socket.error:
+                local.close()
+                remote.close()
+                raise
+        device.accept(remote, adapter)
+        return local
+
+    def setSecurityLevel(self, level):
+        pass
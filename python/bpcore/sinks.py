@@ -0,0 +1,510 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Where samples go.
+
+Every sample is passed to all sinks in config.SINKS. Each sink has its own
+bounded queue and thread, which hands the samples to Sink.write() in
+batches, so a slow or unreachable sink only delays (and at worst drops)
+its own samples. config.SINKS is a list of dicts with a "type":
+
+    "http"    {"url": ..., "format": "json"}: one CUMULUS document per
+              sample, PUT to url + address; "format": "binary": batches as
+              binary frames (see bpcore.binframe) POSTed to url. The
+              connection is kept alive between requests.
+    "mqtt"    {"host": ..., "port": 1883, "topic": "bpart/{device}"}:
+              publishes the CUMULUS document of each sample, or with
+              "format": "binary" one frame per batch
+    "file"    {"path": ...}: appends one JSON line per sample, or with
+              "format": "binary" length prefixed frames
+    "stdout"  one line per sample
+
+Options for all sinks: "batch" (samples per write), "interval" (seconds an
+incomplete batch waits) and "queue" (samples kept while the sink is behind).
+CUMULUS documents ("http" and "mqtt" with "format": "json") carry the time
+the sample was taken with "timestamp": True, otherwise the server's time of
+arrival applies; frames and JSON lines always have it.
+
+On close the sinks get a deadline to write out their queues. Whatever is
+left then, or could not be written, goes to the spool file if there is one
+(config.SPOOL) and is sent first when the next Pipeline starts.
+'''
+
+import os
+import sys
+import json
+import cPickle
+import time
+import struct
+import logging
+import threading
+from collections import deque
+
+from bpcore import payload, metrics
+
+# The HTTP client modules, bpcore.binframe and bpcore.mqtt are imported by the sinks that need them,
+# a gateway only loads what config.SINKS uses
+
+DEFAULT_BATCH = 50
+DEFAULT_INTERVAL = 1.0
+DEFAULT_QUEUE = 10000
+
+
+def cumulusJSON(sample, timestamp=False):
+    (x, y, z) = sample.acceleration
+    if timestamp:
+        return payload.CUMULUS_TIMED.encode(int(round(sample.timestamp * 1000)),
+                                            sample.temperature, sample.humidity, sample.light, x, y, z)
+    return payload.CUMULUS.encode(sample.temperature, sample.humidity, sample.light, x, y, z)
+
+def jsonLine(sample):
+    return json.dumps(sample._asdict()) + "\n"
+
+
+class PartialWrite(Exception):
+    '''
+    Raised by Sink.write() when it failed after the first sent samples of the batch.
+    '''
+
+    def __init__(self, sent, error):
+        Exception.__init__(self, str(error))
+        self.sent = sent
+
+
+class Sink(object):
+    '''
+    Base class of all sinks. write(samples) is called from the sink's own
+    thread with up to batch samples; exceptions are logged and the batch is
+    dropped. A sink that writes the samples one by one raises PartialWrite,
+    so that only those not written are dropped (or spooled on close).
+    idle() is called when interval passed without samples.
+    '''
+
+    def __init__(self, batch=DEFAULT_BATCH, interval=DEFAULT_INTERVAL, queue=DEFAULT_QUEUE):
+        self.batch = batch
+        self.interval = interval
+        self.queue = queue
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    def write(self, samples):
+        raise NotImplementedError
+
+    def idle(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _writeEach(self, samples, write):
+        # write(sample) for every sample, PartialWrite tells how far it got
+        for (i, sample) in enumerate(samples):
+            try:
+                write(sample)
+            except Exception as e:
+                raise PartialWrite(i, e)
+
+
+class HttpSink(Sink):
+    def __init__(self, url, format="json", compress=True, timeout=10, timestamp=False, **options):
+        Sink.__init__(self, **options)
+        if format not in ("json", "binary"):
+            raise ValueError("Unknown format %s" % repr(format))
+        self.url = url
+        self.format = format
+        self.compress = compress
+        self.timestamp = timestamp
+        self.timeout = timeout
+        import urlparse
+        parts = urlparse.urlsplit(url)
+        self._https = parts.scheme == "https"
+        self._netloc = parts.netloc
+        self._path = parts.path or "/"
+        self._conn = None
+
+    @property
+    def name(self):
+        return self.url
+
+    def _request(self, method, path, body, headers):
+        # Reuses the connection; a request on a connection the server closed
+        # in the meantime is retried once on a new one if sending it twice does
+        # no harm (PUT) or it did not get out. 5xx raise, the samples are
+        # dropped or spooled like on a network error; 4xx are only counted,
+        # the server would reject them again
+        import socket
+        import httplib
+        for attempt in (0, 1):
+            reused = self._conn != None
+            if not reused:
+                cls = httplib.HTTPSConnection if self._https else httplib.HTTPConnection
+                self._conn = cls(self._netloc, timeout=self.timeout)
+            sent = False
+            try:
+                self._conn.request(method, path, body, headers)
+                sent = True
+                resp = self._conn.getresponse()
+                resp.read()
+            except (httplib.HTTPException, socket.error):
+                self._conn.close()
+                self._conn = None
+                if reused and attempt == 0 and (method == 'PUT' or not sent):
+                    continue
+                raise
+            if resp.getheader('connection', '').lower() == 'close':
+                self._conn.close()
+                self._conn = None
+            if resp.status >= 500:
+                raise IOError("HTTP Error {0}: {1}".format(resp.status, resp.reason))
+            if resp.status >= 400:
+                metrics.incr("sinks.errors", device=self.name)
+                logging.warning("Error while sending data to {0}: HTTP Error {1}: {2}".format(self.url + path, resp.status, resp.reason))
+            return
+
+    def write(self, samples):
+        if self.format == "binary":
+            from bpcore import binframe
+            frame = binframe.encode(samples, self.compress)
+            self._request('POST', self._path, frame, {'Content-Type': 'application/octet-stream'})
+            metrics.incr("sinks.bytes", len(frame), device=self.name)
+            return
+        self._writeEach(samples, self._put)
+
+    def _put(self, sample):
+        data = cumulusJSON(sample, self.timestamp)
+        self._request('PUT', self._path + sample.device.replace(':', ''), data,
+                      {'Content-Type': 'application/x-www-form-urlencoded'})
+        metrics.incr("sinks.bytes", len(data), device=self.name)
+
+    def close(self):
+        if self._conn != None:
+            self._conn.close()
+            self._conn = None
+
+
+class MqttSink(Sink):
+    def __init__(self, host, port=1883, topic="bpart/{device}", format="json", compress=True,
+                 clientId="bpart-gateway", keepalive=60, timestamp=False, **options):
+        Sink.__init__(self, **options)
+        if format not in ("json", "binary"):
+            raise ValueError("Unknown format %s" % repr(format))
+        self.topic = topic
+        self.format = format
+        self.compress = compress
+        self.timestamp = timestamp
+        from bpcore.mqtt import MqttClient
+        self._client = MqttClient(host, port, clientId, keepalive)
+        self._lastSent = time.time()
+
+    @property
+    def name(self):
+        return "mqtt://%s:%d" % (self._client.host, self._client.port)
+
+    def _publish(self, topic, data):
+        import socket
+        from bpcore.mqtt import MqttError
+        try:
+            self._client.publish(topic, data)
+        except (socket.error, MqttError):
+            # the broker may have dropped an idle connection, try once more
+            self._client.close()
+            self._client.publish(topic, data)
+        self._lastSent = time.time()
+        metrics.incr("sinks.bytes", len(data), device=self.name)
+
+    def write(self, samples):
+        if self.format == "binary":
+            from bpcore import binframe
+            self._publish(self.topic.format(device="all"), binframe.encode(samples, self.compress))
+            return
+        self._writeEach(samples, self._publishJSON)
+
+    def _publishJSON(self, sample):
+        self._publish(self.topic.format(device=sample.device.replace(':', '')), cumulusJSON(sample, self.timestamp))
+
+    def idle(self):
+        if time.time() - self._lastSent > self._client.keepalive / 2:
+            import socket
+            try:
+                self._client.ping()
+            except socket.error:
+                self._client.close()
+            self._lastSent = time.time()
+
+    def close(self):
+        self._client.close()
+
+
+class FileSink(Sink):
+    def __init__(self, path, format="jsonl", compress=False, **options):
+        Sink.__init__(self, **options)
+        if format not in ("jsonl", "binary"):
+            raise ValueError("Unknown format %s" % repr(format))
+        self.path = path
+        self.format = format
+        self.compress = compress
+        self._file = open(path, 'ab')
+
+    @property
+    def name(self):
+        return self.path
+
+    def write(self, samples):
+        if self.format == "binary":
+            from bpcore import binframe
+            frame = binframe.encode(samples, self.compress)
+            self._file.write(struct.pack('<I', len(frame)) + frame)
+        else:
+            self._file.write(''.join([ jsonLine(s) for s in samples ]))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def readFrames(path):
+    '''
+    Returns the samples of a file written by a binary FileSink.
+    '''
+    from bpcore import binframe
+    samples = []
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(4)
+            if len(head) < 4:
+                return samples
+            samples.extend(binframe.decode(f.read(struct.unpack('<I', head)[0])))
+
+
+class StdoutSink(Sink):
+    def __init__(self, format="text", **options):
+        Sink.__init__(self, **options)
+        self.format = format
+
+    def write(self, samples):
+        if self.format == "jsonl":
+            sys.stdout.write(''.join([ jsonLine(s) for s in samples ]))
+        else:
+            sys.stdout.write(''.join([ "%s %s T=%s H=%s L=%s A=%s\n" % (s.device,
+                time.strftime("%H:%M:%S", time.localtime(s.timestamp)), s.temperature, s.humidity, s.light, s.acceleration)
+                for s in samples ]))
+        sys.stdout.flush()
+
+
+SINK_TYPES = {"http": HttpSink, "mqtt": MqttSink, "file": FileSink, "stdout": StdoutSink}
+
+def makeSink(spec):
+    options = dict(spec)
+    sinkType = options.pop("type", "http")
+    if sinkType not in SINK_TYPES:
+        raise ValueError("Unknown sink type %s" % repr(sinkType))
+    return SINK_TYPES[sinkType](**options)
+
+
+class _SinkRunner(threading.Thread):
+    # The queue and thread of one sink
+
+    def __init__(self, sink):
+        threading.Thread.__init__(self, name="sink %s" % sink.name)
+        self.daemon = True
+        self.sink = sink
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+
+    def put(self, sample):
+        with self._cond:
+            if len(self._queue) >= self.sink.queue:
+                metrics.incr("sinks.dropped", device=self.sink.name)
+                return
+            self._queue.append(sample)
+            if len(self._queue) >= self.sink.batch:
+                self._cond.notify()
+
+    def requeue(self, samples):
+        '''
+        Puts samples in front of the queue, e.g. those spooled by the last run.
+        '''
+        with self._cond:
+            self._queue.extendleft(reversed(samples))
+            while len(self._queue) > self.sink.queue:
+                self._queue.pop()
+                metrics.incr("sinks.dropped", device=self.sink.name)
+            self._cond.notify()
+
+    def leftover(self):
+        '''
+        Takes the samples still queued.
+        '''
+        with self._cond:
+            samples = list(self._queue)
+            self._queue.clear()
+            return samples
+
+    def _take(self):
+        # Waits for a full batch, interval or close; returns the batch (maybe empty), None when done
+        with self._cond:
+            deadline = time.time() + self.sink.interval
+            while len(self._queue) < self.sink.batch and not self._closing and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+            if not self._queue and self._closing:
+                return None
+            n = min(len(self._queue), self.sink.batch)
+            return [ self._queue.popleft() for i in range(n) ]
+
+    def run(self):
+        while True:
+            batch = self._take()
+            if batch == None:
+                break
+            try:
+                if batch:
+                    self.sink.write(batch)
+                    metrics.incr("sinks.written", len(batch), device=self.sink.name)
+                else:
+                    self.sink.idle()
+            except Exception as e:
+                sent = e.sent if isinstance(e, PartialWrite) else 0
+                if sent:
+                    metrics.incr("sinks.written", sent, device=self.sink.name)
+                metrics.incr("sinks.errors", device=self.sink.name)
+                logging.warning("Error while sending data to %s: %s" % (self.sink.name, e))
+                if self._closing:
+                    # no time to wait for the sink to come back, the rest is spooled
+                    self.requeue(batch[sent:])
+                    break
+                metrics.incr("sinks.dropped", len(batch) - sent, device=self.sink.name)
+        try:
+            self.sink.close()
+        except Exception as e:
+            logging.warning("Error while closing %s: %s" % (self.sink.name, e))
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+
+
+def readSpool(path):
+    '''
+    Returns the {sink key: [sample, ...]} spooled in path, {} if there is none.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            return cPickle.load(f)
+    except IOError:
+        return {}
+    except Exception as e:
+        logging.warning("Could not read spool %s: %s" % (path, e))
+        return {}
+
+def writeSpool(path, spooled):
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        cPickle.dump(spooled, f, cPickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+class Pipeline(object):
+    '''
+    Fans every sample out to all sinks. sinks are Sink objects or specs as
+    in config.SINKS. Samples left over by the previous run are taken from
+    spool (a path) and sent first.
+    '''
+
+    def __init__(self, sinks, spool=None):
+        self._runners = [ _SinkRunner(makeSink(s) if isinstance(s, dict) else s) for s in sinks ]
+        self.spool = spool
+        if spool:
+            self._unspool()
+        for runner in self._runners:
+            runner.start()
+
+    def _key(self, i):
+        # sinks are told apart by position and type, a changed config.SINKS drops the spool
+        return "%d %s" % (i, self._runners[i].sink.name)
+
+    def _unspool(self):
+        spooled = readSpool(self.spool)
+        for (i, runner) in enumerate(self._runners):
+            samples = spooled.pop(self._key(i), [])
+            if samples:
+                logging.info("Resending %d spooled samples to %s" % (len(samples), runner.sink.name))
+                runner.requeue(samples)
+                metrics.incr("sinks.unspooled", len(samples), device=runner.sink.name)
+        for (key, samples) in spooled.items():
+            logging.warning("Dropping %d spooled samples of %s, it is not configured anymore" % (len(samples), key))
+        if os.path.exists(self.spool):
+            os.remove(self.spool)
+
+    @property
+    def sinks(self):
+        return [ r.sink for r in self._runners ]
+
+    def send(self, sample):
+        metrics.incr("sinks.samples")
+        for runner in self._runners:
+            runner.put(sample)
+
+    def close(self, timeout=10.0):
+        '''
+        Writes out what is queued (for at most timeout seconds) and closes all
+        sinks. What is left goes to the spool.
+        '''
+        for runner in self._runners:
+            runner.close()
+        deadline = time.time() + timeout
+        spooled = {}
+        for (i, runner) in enumerate(self._runners):
+            runner.join(max(deadline - time.time(), 0))
+            if runner.is_alive():
+                logging.warning("%s did not finish in time" % runner.sink.name)
+            samples = runner.leftover()
+            if samples:
+                spooled[self._key(i)] = samples
+                metrics.incr("sinks.spooled", len(samples), device=runner.sink.name)
+        if not spooled:
+            return
+        n = sum([ len(s) for s in spooled.values() ])
+        if not self.spool:
+            logging.warning("%d samples could not be sent and are lost (no spool configured)" % n)
+            return
+        try:
+            writeSpool(self.spool, spooled)
+            logging.info("Spooled %d samples to %s" % (n, self.spool))
+        except (IOError, OSError) as e:
+            logging.error("Could not write spool %s, %d samples are lost: %s" % (self.spool, n, e))
+
+
+_pipeline = None
+_lock = threading.Lock()
+
+def getPipeline(sinks, aggregation=None, spool=None, deadband=None):
+    '''
+    Returns the Pipeline shared by all devices of the process. With
+    aggregation (the options of bpcore.aggregate.Aggregator, as in
+    config.AGGREGATION) window aggregates are sent instead of the samples.
+    spool is the path of the spool file (config.SPOOL). With deadband (the
+    options of bpcore.deadband.DeadbandFilter, as in config.DEADBAND) only
+    what changed is sent.
+    '''
+    global _pipeline
+    with _lock:
+        if _pipeline == None:
+            _pipeline = Pipeline(sinks, spool)
+            if deadband:
+                from bpcore.deadband import DeadbandFilter
+                _pipeline = DeadbandFilter(_pipeline, **deadband)
+            if aggregation:
+                from bpcore.aggregate import Aggregator
+                _pipeline = Aggregator(_pipeline, **aggregation)
+        return _pipeline
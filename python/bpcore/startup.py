@@ -0,0 +1,165 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Getting many devices connected quickly.
+
+All device threads start at once, but connection setup and discovery on
+one adapter serialize in the kernel anyway; if every thread tries at the
+same time they mostly time out and back off. StartupOrchestrator lets at
+most concurrency connects run at a time and starts them at least stagger
+seconds apart. It measures the time until every device was connected and
+initialized (gauge startup.seconds).
+
+DiscoveryCache keeps the discovered services, characteristics and handles
+of every device in a JSON file, so a restarted gateway does not have to
+discover them again.
+'''
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from bpcore import metrics
+
+
+class StartupOrchestrator(object):
+    '''
+    Gates the connects of devices and tracks when all of them are up.
+    '''
+
+    def __init__(self, devices, concurrency=4, stagger=0.2):
+        self.devices = set(devices)
+        self.concurrency = concurrency
+        self.stagger = stagger
+        self.started = time.time()
+        self.finished = None
+        self._ready = set()
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._lock = threading.Lock()
+        self._next = self.started # earliest start of the next connect
+        self._done = threading.Event()
+        metrics.setGauge("startup.connected", 0)
+        if not self.devices:
+            self._finish()
+
+    @contextmanager
+    def connecting(self, addr):
+        '''
+        Context of one connect attempt of addr, waits for a free slot.
+        '''
+        if self._slots != None:
+            self._slots.acquire()
+        try:
+            with self._lock:
+                start = max(self._next, time.time())
+                self._next = start + self.stagger
+            if start > time.time():
+                time.sleep(start - time.time())
+            yield
+        finally:
+            if self._slots != None:
+                self._slots.release()
+
+    def ready(self, addr):
+        '''
+        Called when addr is connected and initialized.
+        '''
+        with self._lock:
+            if addr in self._ready or addr not in self.devices:
+                return
+            self._ready.add(addr)
+            n = len(self._ready)
+        metrics.setGauge("startup.connected", n)
+        logging.info("%s ready after %.1fs (%d/%d)" % (addr, time.time() - self.started, n, len(self.devices)))
+        if n == len(self.devices):
+            self._finish()
+
+    def _finish(self):
+        self.finished = time.time()
+        metrics.setGauge("startup.seconds", self.finished - self.started)
+        logging.info("All %d devices connected in %.1fs" % (len(self.devices), self.finished - self.started))
+        self._done.set()
+
+    def wait(self, timeout=None):
+        '''
+        Waits until all devices are connected, returns False on timeout.
+        '''
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def pending(self):
+        with self._lock:
+            return sorted(self.devices - self._ready)
+
+
+class DiscoveryCache(object):
+    '''
+    Discovery results per device address, stored in a JSON file. Entries
+    are plain dicts; what goes into them is up to the Peripheral.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self):
+        # other processes may have added devices in the meantime
+        entries = self._load()
+        entries.update(self._entries)
+        for addr in [ a for (a, e) in entries.items() if e == None ]:
+            del entries[addr]
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            logging.warning("Could not write discovery cache %s: %s" % (self.path, e))
+
+    def get(self, addr):
+        with self._lock:
+            entry = self._entries.get(addr)
+        metrics.incr("discovery.cache_hits" if entry else "discovery.cache_misses")
+        return entry
+
+    def put(self, addr, entry):
+        with self._lock:
+            self._entries[addr] = entry
+            self._save()
+
+    def drop(self, addr):
+        with self._lock:
+            if self._entries.get(addr) != None:
+                self._entries[addr] = None # removed from the file by _save
+                self._save()
+
+
+_caches = {}
+_cachesLock = threading.Lock()
+
+def getDiscoveryCache(path):
+    '''
+    Returns the DiscoveryCache of path shared by the process, None if path is None.
+    '''
+    if not path:
+        return None
+    with _cachesLock:
+        if path not in _caches:
+            _caches[path] = DiscoveryCache(path)
+        return _caches[path]
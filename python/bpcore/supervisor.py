@@ -0,0 +1,109 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Connection supervision for notification driven devices.
+
+A device that has been quiet for a while is not necessarily gone. The
+supervisor waits silenceFactor times the expected notification interval,
+then probes the link with a cheap read before it declares the connection
+lost. Reconnects draw from a budget so that a flapping device can't eat
+all of the radio time.
+'''
+
+import time
+import logging
+
+from bpcore import metrics
+from bpcore.gatt import BTLEException
+
+
+class ConnectionSupervisor(object):
+    '''
+    Supervises the connection to one device.
+
+    probe is a callable doing a cheap read on the device; it must raise
+    BTLEException if the link is gone. The reconnect budget allows
+    reconnectBudget reconnects per reconnectWindow seconds, further ones are
+    delayed until the budget has refilled.
+    '''
+
+    def __init__(self, name, expectedInterval, probe=None, silenceFactor=3.0,
+                 reconnectBudget=5, reconnectWindow=300.0):
+        self.name = name
+        self.expectedInterval = expectedInterval
+        self.probe = probe
+        self.silenceFactor = silenceFactor
+        self.reconnectBudget = reconnectBudget
+        self.reconnectWindow = reconnectWindow
+        self._observedInterval = None
+        self._lastNotification = None
+        self._tokens = float(reconnectBudget)
+        self._lastRefill = time.time()
+
+    def timeout(self):
+        '''
+        How long to wait for the next notification before the link is checked.
+        '''
+        interval = self.expectedInterval
+        if self._observedInterval != None:
+            interval = max(interval, self._observedInterval)
+        return self.silenceFactor * interval
+
+    def notified(self, now=None):
+        '''
+        Must be called for every notification received.
+        '''
+        now = time.time() if now == None else now
+        if self._lastNotification != None:
+            gap = now - self._lastNotification
+            if self._observedInterval == None:
+                self._observedInterval = gap
+            else:
+                self._observedInterval += 0.1 * (gap - self._observedInterval)
+        self._lastNotification = now
+
+    def isAlive(self):
+        '''
+        Called when timeout() passed without a notification. Probes the link
+        and returns False only if the probe failed.
+        '''
+        if self.probe == None:
+            return False
+        metrics.incr("supervisor.probes", device=self.name)
+        try:
+            self.probe()
+        except BTLEException as e:
+            metrics.incr("supervisor.probe_failures", device=self.name)
+            logging.debug("%s: liveness probe failed (%s)" % (self.name, e))
+            return False
+        # Quiet, but connected: no reconnect needed
+        metrics.incr("supervisor.reconnects_avoided", device=self.name)
+        logging.debug("%s: quiet for %.1fs but still connected" % (self.name, self.timeout()))
+        return True
+
+    def connected(self):
+        '''
+        Must be called once a (re)connect succeeded.
+        '''
+        self._lastNotification = None
+
+    def reconnectDelay(self):
+        '''
+        Takes one reconnect from the budget and returns how many seconds to
+        wait before it may be attempted.
+        '''
+        now = time.time()
+        self._tokens = min(float(self.reconnectBudget),
+            self._tokens + (now - self._lastRefill) * self.reconnectBudget / self.reconnectWindow)
+        self._lastRefill = now
+        metrics.incr("supervisor.reconnects", device=self.name)
+        self._tokens -= 1.0
+        if self._tokens >= 0:
+            return 0.0
+        metrics.incr("supervisor.reconnects_delayed", device=self.name)
+        return -self._tokens * self.reconnectWindow / self.reconnectBudget
@@ -0,0 +1,164 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+The interface every BLE backend implements, and the backend registry.
+
+Backends are imported only when they are requested, so e.g. pexpect is
+only needed when the gatttool backend is actually used.
+'''
+
+import importlib
+
+from bpcore.gatt import BTLEException
+
+# Requests that can be submitted (see Transport.submit)
+PIPELINED = ("discoverServices", "discoverCharacteristics", "discoverDescriptors", "read", "write")
+
+
+class Future(object):
+    '''
+    The result of a submitted request. result() waits for it (settle is
+    called until it is there) and returns it, or raises its BTLEException.
+    '''
+
+    def __init__(self, settle=None):
+        self._settle = settle
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def done(self):
+        return self._done
+
+    def set(self, value):
+        (self._value, self._done) = (value, True)
+
+    def fail(self, error):
+        (self._error, self._done) = (error, True)
+
+    def result(self):
+        while not self._done:
+            self._settle()
+        if self._error != None:
+            raise self._error
+        return self._value
+
+
+class Transport(object):
+    '''
+    One connection to one peripheral.
+
+    Handles are ints, values are byte strings and uuids are hex strings
+    (anything bpcore.gatt.UUID accepts). Failures are reported as
+    BTLEException; DISCONNECTED means the link is gone and connect() has
+    to be called again.
+    '''
+
+    name = None
+
+    def __init__(self, iface=None):
+        # Local adapter to use, e.g. "hci1". None means the system default.
+        self.iface = iface
+
+    def connect(self, addr):
+        raise NotImplementedError('Transport must implement this method')
+
+    def disconnect(self):
+        raise NotImplementedError('Transport must implement this method')
+
+    def isConnected(self):
+        raise NotImplementedError('Transport must implement this method')
+
+    def discoverServices(self, uuid=None):
+        '''
+        Returns a list of (startHnd, endHnd, uuid) of the primary services,
+        only those with the given uuid if it is not None.
+        '''
+        raise NotImplementedError('Transport must implement this method')
+
+    def discoverCharacteristics(self, startHnd=1, endHnd=0xFFFF):
+        '''
+        Returns a list of (handle, properties, valueHandle, uuid).
+        '''
+        raise NotImplementedError('Transport must implement this method')
+
+    def discoverDescriptors(self, startHnd=1, endHnd=0xFFFF):
+        '''
+        Returns a list of (handle, uuid).
+        '''
+        raise NotImplementedError('Transport must implement this method')
+
+    def read(self, handle):
+        raise NotImplementedError('Transport must implement this method')
+
+    def write(self, handle, value, withResponse=True):
+        raise NotImplementedError('Transport must implement this method')
+
+    def waitForNotification(self, timeout):
+        '''
+        Returns the next (handle, value) notification, or None if none
+        arrived within timeout seconds.
+        '''
+        raise NotImplementedError('Transport must implement this method')
+
+    def submit(self, method, *args):
+        '''
+        Starts the request method(*args), one of PIPELINED, and returns a
+        Future of its result. Backends that can keep several requests
+        outstanding send it right away and answer them in order; the others
+        (this default) run it before returning.
+        '''
+        if method not in PIPELINED:
+            raise ValueError("%s can't be submitted" % method)
+        future = Future()
+        try:
+            future.set(getattr(self, method)(*args))
+        except BTLEException as e:
+            future.fail(e)
+        return future
+
+    def interrupt(self):
+        '''
+        Makes a waitForNotification() of another thread (or the next one)
+        return None right away, e.g. to stop the thread. Backends that can't
+        wake it up return after their timeout as usual.
+        '''
+        pass
+
+    def setSecurityLevel(self, level):
+        raise BTLEException(BTLEException.INTERNAL_ERROR, "%s backend can't set the security level" % self.name)
+
+    def setMTU(self, mtu):
+        raise BTLEException(BTLEException.INTERNAL_ERROR, "%s backend can't set the MTU" % self.name)
+
+
+# name -> "module.Class", imported on first use
+TRANSPORTS = {
+    "helper": "bpcore.helper.HelperTransport",
+    "gatttool": "bpcore.gatttool.GatttoolTransport",
+    "att": "bpcore.att.AttTransport",
+    "sim": "bpcore.sim.SimTransport",
+    "replay": "bpcore.capture.ReplayTransport",
+}
+
+def getTransportClass(name):
+    if name not in TRANSPORTS:
+        raise ValueError("Unknown transport '%s', expected one of %s" % (name, ", ".join(sorted(TRANSPORTS))))
+    (modName, clsName) = TRANSPORTS[name].rsplit(".", 1)
+    return getattr(importlib.import_module(modName), clsName)
+
+def getTransport(name, capture=None, **kwargs):
+    '''
+    Creates a new, unconnected transport of the given backend. With
+    capture (a file name) all its traffic is recorded, see bpcore.capture.
+    '''
+    t = getTransportClass(name)(**kwargs)
+    if capture:
+        from bpcore.capture import RecordingTransport, getWriter
+        t = RecordingTransport(t, getWriter(capture))
+    return t
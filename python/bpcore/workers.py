@@ -0,0 +1,286 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Multi-process worker mode.
+
+The devices are split into shards, each served by its own worker process,
+so parsing and encoding run on all cores instead of behind one GIL. A
+worker runs the client's usual device threads for its shard; whatever they
+want to upload is batched and sent to the parent over a pipe. The parent
+hands the samples to its sink, collects the workers' metrics and restarts
+workers that died.
+
+Messages on the pipe are tuples:
+    worker -> parent: ("samples", [sample, ...]), ("metrics", snapshot), ("stopped",)
+    parent -> worker: ("stop",), ("add", addr), ("remove", addr), ("command", addr, name, args)
+'''
+
+import os
+import time
+import select
+import signal
+import logging
+import threading
+import multiprocessing
+
+from bpcore import metrics
+
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 0.5
+METRICS_INTERVAL = 5.0
+RESTART_DELAY = 5.0
+
+
+class SampleBatcher(object):
+    '''
+    Collects samples in the worker and sends them to the parent in batches
+    of batchSize, or after flushInterval at the latest (see flush()).
+    '''
+
+    def __init__(self, conn, batchSize=BATCH_SIZE):
+        self.conn = conn
+        self.batchSize = batchSize
+        self._batch = []
+        self._lock = threading.Lock()
+
+    def put(self, *sample):
+        with self._lock:
+            self._batch.append(sample)
+            if len(self._batch) < self.batchSize:
+                return
+            batch = self._batch
+            self._batch = []
+            self.conn.send(("samples", batch))
+
+    def flush(self):
+        with self._lock:
+            if self._batch:
+                self.conn.send(("samples", self._batch))
+                self._batch = []
+
+    def send(self, msg):
+        # the device threads send through the same pipe
+        with self._lock:
+            self.conn.send(msg)
+
+
+def _workerMain(index, shard, conn, target, batchSize, flushInterval):
+    # Entry point of a worker process. target(shard, emit) starts serving the
+    # devices of shard and returns an object with stop(), add(addr), remove(addr)
+    # and command(addr, name, **args) (see bpcore/control.py).
+    # the parent decides when to stop, also when a service manager signals the whole group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    metrics.resetAfterFork()
+    batcher = SampleBatcher(conn, batchSize)
+    fleet = target(shard, batcher.put)
+    logging.info("Worker %d (pid %d) serving %s" % (index, os.getpid(), ", ".join(shard)))
+    nextMetrics = time.time()
+    try:
+        while True:
+            try:
+                if conn.poll(flushInterval):
+                    msg = conn.recv()
+                    if msg[0] == "stop":
+                        break
+                    elif msg[0] == "add":
+                        fleet.add(msg[1])
+                    elif msg[0] == "remove":
+                        fleet.remove(msg[1])
+                    elif msg[0] == "command":
+                        fleet.command(msg[1], msg[2], **msg[3])
+            except (EOFError, IOError):
+                break # the parent is gone
+            batcher.flush()
+            if time.time() >= nextMetrics:
+                batcher.send(("metrics", metrics.snapshot()))
+                nextMetrics = time.time() + METRICS_INTERVAL
+    finally:
+        fleet.stop()
+        try:
+            batcher.flush()
+            batcher.send(("metrics", metrics.snapshot()))
+            batcher.send(("stopped",))
+        except (EOFError, IOError):
+            pass
+
+
+class _Worker(object):
+    def __init__(self, index, shard):
+        self.index = index
+        self.shard = shard
+        self.process = None
+        self.conn = None
+        self.metrics = {}
+        self.restartAt = 0
+
+
+class WorkerPool(object):
+    '''
+    Runs target(shard, emit) for every shard of devices in its own process.
+    emit(*sample) in a worker ends up as sink(*sample) in the parent, which
+    must call run() (or poll() in its own loop) to receive the samples.
+    Devices can be added to and removed from the running workers.
+    '''
+
+    def __init__(self, devices, target, sink, workers=None, batchSize=BATCH_SIZE,
+                 flushInterval=FLUSH_INTERVAL, restartDelay=RESTART_DELAY):
+        if not workers:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(devices)))
+        self.target = target
+        self.sink = sink
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.restartDelay = restartDelay
+        self.workers = [ _Worker(i, list(devices[i::workers])) for i in range(workers) ]
+        self.running = False
+
+    def _spawn(self, worker):
+        (parentConn, childConn) = multiprocessing.Pipe()
+        worker.process = multiprocessing.Process(target=_workerMain, name="bpart-worker-%d" % worker.index,
+            args=(worker.index, worker.shard, childConn, self.target, self.batchSize, self.flushInterval))
+        worker.process.daemon = True
+        worker.process.start()
+        childConn.close()
+        worker.conn = parentConn
+        worker.metrics = {}
+
+    def start(self):
+        self.running = True
+        for worker in self.workers:
+            self._spawn(worker)
+        metrics.setGauge("workers.alive", len(self.workers))
+
+    def _send(self, worker, msg):
+        try:
+            worker.conn.send(msg)
+        except (IOError, ValueError):
+            pass # died; the restarted worker gets the current shard
+
+    def add(self, addr):
+        '''
+        Starts serving addr in the worker with the fewest devices.
+        '''
+        if any([ addr in w.shard for w in self.workers ]):
+            return
+        worker = min(self.workers, key=lambda w: len(w.shard))
+        worker.shard.append(addr)
+        self._send(worker, ("add", addr))
+
+    def remove(self, addr):
+        '''
+        Stops serving addr.
+        '''
+        for worker in self.workers:
+            if addr in worker.shard:
+                worker.shard.remove(addr)
+                self._send(worker, ("remove", addr))
+
+    def command(self, addr, name, **args):
+        '''
+        Passes a command to the worker serving addr, False if none does.
+        '''
+        for worker in self.workers:
+            if addr in worker.shard:
+                self._send(worker, ("command", addr, name, args))
+                return True
+        return False
+
+    def devices(self):
+        return [ addr for w in self.workers for addr in w.shard ]
+
+    def _handle(self, worker, msg):
+        if msg[0] == "samples":
+            metrics.incr("workers.batches")
+            metrics.incr("workers.samples", len(msg[1]))
+            for sample in msg[1]:
+                try:
+                    self.sink(*sample)
+                except Exception:
+                    logging.exception("Sink failed for a sample of worker %d" % worker.index)
+        elif msg[0] == "metrics":
+            worker.metrics = msg[1]
+
+    def _supervise(self):
+        alive = 0
+        for worker in self.workers:
+            if worker.process.is_alive():
+                alive += 1
+                continue
+            if not worker.restartAt:
+                logging.warning("Worker %d died (exit code %s), restarting in %gs"
+                    % (worker.index, worker.process.exitcode, self.restartDelay))
+                metrics.incr("workers.restarts")
+                worker.restartAt = time.time() + self.restartDelay
+            elif time.time() >= worker.restartAt:
+                worker.restartAt = 0
+                if not worker.conn.closed:
+                    worker.conn.close()
+                self._spawn(worker)
+        metrics.setGauge("workers.alive", alive)
+
+    def poll(self, timeout):
+        '''
+        Receives and dispatches the messages of all workers for up to timeout
+        seconds, then restarts dead workers.
+        '''
+        conns = dict([ (w.conn.fileno(), w) for w in self.workers if not w.conn.closed ])
+        try:
+            (readable, _, _) = select.select(conns.keys(), [], [], timeout)
+        except select.error:
+            readable = []
+        for fd in readable:
+            worker = conns[fd]
+            try:
+                while worker.conn.poll():
+                    self._handle(worker, worker.conn.recv())
+            except (EOFError, IOError):
+                worker.conn.close() # process has exited, _supervise restarts it
+        if self.running:
+            self._supervise()
+
+    def run(self):
+        '''
+        Serves the workers until stop() is called.
+        '''
+        while self.running:
+            self.poll(self.flushInterval)
+
+    def stop(self, timeout=10.0):
+        '''
+        Stops all workers; samples they still send are passed to the sink.
+        '''
+        self.running = False
+        for worker in self.workers:
+            try:
+                worker.conn.send(("stop",))
+            except (IOError, ValueError):
+                pass
+        deadline = time.time() + timeout
+        while time.time() < deadline and any(w.process.is_alive() for w in self.workers):
+            self.poll(0.1)
+        self.poll(0)
+        for worker in self.workers:
+            if worker.process.is_alive():
+                logging.warning("Worker %d did not stop, terminating it" % worker.index)
+                worker.process.terminate()
+            worker.process.join(1)
+        metrics.setGauge("workers.alive", 0)
+
+    def collectMetrics(self):
+        '''
+        Returns the metrics of the parent plus the sum of the last metrics
+        reported by each worker.
+        '''
+        result = metrics.snapshot()
+        for worker in self.workers:
+            for (key, value) in worker.metrics.items():
+                if isinstance(value, (int, long, float)):
+                    result[key] = result.get(key, 0) + value
+        return result
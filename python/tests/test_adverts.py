@@ -0,0 +1,59 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the advertisement parsing and decoding of bpcore.adverts, with an
+hcidump capture in tests/data. Run from the python directory:
+
+    python -m unittest discover tests
+'''
+
+import os
+import unittest
+
+from bpcore import adverts
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+class AdvertTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(DATA, "hcidump.txt")) as f:
+            self.lines = [ l.rstrip('\n') for l in f ]
+
+    def testParseHcidump(self):
+        # the sent command and the header lines are skipped, packets span several lines
+        reports = list(adverts.parseHcidump(self.lines))
+        self.assertEqual([ (r.addr, r.rssi) for r in reports ], [ ("00:07:80:78:FA:5A", -67), ("5C:F3:70:11:22:33", -81) ])
+        self.assertEqual(adverts.adField(reports[0].data, adverts.AD_COMPLETE_NAME), "bPart")
+
+    def testDecodeBPartAdvert(self):
+        (bpart, other) = list(adverts.parseHcidump(self.lines))
+        (temperature, humidity, light, (x, y, z)) = adverts.decodeBPartAdvert(bpart)
+        self.assertAlmostEqual(temperature, 23.456)
+        self.assertEqual((humidity, light), (41, 312))
+        self.assertEqual((x, y, z), (0.0, -0.5, 1.0))
+        self.assertEqual(adverts.decodeBPartAdvert(other), None)
+
+    def testEncodeDecode(self):
+        adv = adverts.Advertisement("00:07:80:78:F5:C3", -50, 0.0,
+                                    adverts.encodeBPartAdvert(-4.5, 80, 0, (0.25, 0.0, -1.0)))
+        self.assertEqual(adverts.decodeBPartAdvert(adv), (-4.5, 80, 0, (0.25, 0.0, -1.0)))
+
+    def testFileScanner(self):
+        scanner = adverts.FileScanner(os.path.join(DATA, "hcidump.txt"))
+        self.assertEqual([ r.addr for r in scanner.reports() ], ["00:07:80:78:FA:5A", "5C:F3:70:11:22:33"])
+
+    def testParseReportLine(self):
+        adv = adverts.parseReportLine("1400000000.5 00:07:80:78:fa:5a -70 020106")
+        self.assertEqual((adv.addr, adv.rssi, adv.timestamp, adv.data), ("00:07:80:78:FA:5A", -70, 1400000000.5, "\x02\x01\x06"))
+        self.assertEqual(adverts.parseReportLine("> 04 3E 1A"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the window aggregation (bpcore.aggregate). Windows are closed by
+the samples and by explicit tick() calls; the Aggregator's own timer is
+set to tick once an hour. Run from the python directory:
+
+    python -m unittest discover tests
+'''
+
+import math
+import unittest
+
+from bpcore.aggregate import Aggregator
+from bpcore.samples import Sample
+
+A = "00:07:80:78:FA:5A"
+B = "00:07:80:78:F5:C3"
+
+
+def sample(device, t, temperature, light=300):
+    return Sample(device, t, temperature, 40, light, (0.0, 0.0, 1.0))
+
+
+class Downstream(object):
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, aggregate):
+        self.sent.append(aggregate)
+
+    def close(self, timeout=10.0):
+        self.closed = True
+
+
+class AggregatorTest(unittest.TestCase):
+
+    def makeAggregator(self, **options):
+        self.downstream = Downstream()
+        aggregator = Aggregator(self.downstream, tick=3600, **options)
+        self.addCleanup(self.closeAggregator, aggregator)
+        return aggregator
+
+    def closeAggregator(self, aggregator):
+        aggregator.close()
+        aggregator._timer.join(1.0) # not to have it woken by the interpreter shutdown
+
+    def testTumbling(self):
+        aggregator = self.makeAggregator(window=10)
+        for (t, v) in ((1000, 10.0), (1002, 20.0), (1004, 30.0)):
+            aggregator.send(sample(A, t, v))
+        aggregator.send(sample(B, 1005, 5.0)) # windows are per device
+        self.assertEqual(self.downstream.sent, [])
+
+        aggregator.send(sample(A, 1011, 40.0))
+        (aggregate,) = self.downstream.sent
+        self.assertEqual((aggregate.device, aggregate.timestamp, aggregate.window, aggregate.count),
+                         (A, 1010, (1000, 1010), 3))
+        self.assertEqual(aggregate.temperature, 20.0)
+        stats = aggregate.stats["temperature"]
+        self.assertEqual((stats["min"], stats["max"], stats["mean"]), (10.0, 30.0, 20.0))
+        self.assertAlmostEqual(stats["rms"], math.sqrt(1400.0 / 3))
+        self.assertEqual(aggregate.stats["accelMagnitude"]["mean"], 1.0)
+
+        # windows of quiet devices are closed by tick()
+        aggregator.tick(1100)
+        self.assertEqual(sorted([ (a.device, a.timestamp, a.count) for a in self.downstream.sent[1:] ]),
+                         sorted([ (A, 1020, 1), (B, 1010, 1) ]))
+        aggregator.close()
+        self.assertEqual(len(self.downstream.sent), 3)
+        self.assertTrue(self.downstream.closed)
+
+    def testSliding(self):
+        aggregator = self.makeAggregator(window=10, step=5)
+        self.assertTrue(aggregator.sliding)
+        for (t, v) in ((1000, 1.0), (1003, 2.0), (1006, 3.0), (1008, 4.0), (1012, 5.0)):
+            aggregator.send(sample(A, t, v))
+        # every step the last window seconds
+        self.assertEqual([ (a.window, a.count) for a in self.downstream.sent ],
+                         [ ((995, 1005), 2), ((1000, 1010), 4) ])
+        stats = self.downstream.sent[1].stats["temperature"]
+        self.assertEqual((stats["min"], stats["max"], stats["mean"]), (1.0, 4.0, 2.5))
+
+        # the values older than the window are gone, min and max with them
+        aggregator.tick(1100)
+        aggregate = self.downstream.sent[2]
+        self.assertEqual((aggregate.window, aggregate.count), ((1005, 1015), 3))
+        stats = aggregate.stats["temperature"]
+        self.assertEqual((stats["min"], stats["max"]), (3.0, 5.0))
+
+        aggregator.close() # nothing left in the window
+        self.assertEqual(len(self.downstream.sent), 3)
+
+    def testLateness(self):
+        # a window is closed lateness seconds after its end, samples still on their way make it in
+        aggregator = self.makeAggregator(window=10, lateness=2)
+        aggregator.send(sample(A, 1000, 10.0))
+        aggregator.tick(1011)
+        self.assertEqual(self.downstream.sent, [])
+        aggregator.send(sample(A, 1009, 20.0))
+        aggregator.tick(1012.5)
+        self.assertEqual([ (a.window, a.count, a.temperature) for a in self.downstream.sent ],
+                         [ ((1000, 1010), 2, 15.0) ])
+
+    def testEvents(self):
+        aggregator = self.makeAggregator(window=10, events={"temperature": 25, "light": {"below": 100}})
+        aggregator.send(sample(A, 1000, 20.0, light=50))
+        aggregator.send(sample(A, 1001, 30.0))
+        aggregator.send(sample(B, 1000, 20.0))
+        aggregator.tick(1100)
+        flags = dict([ (a.device, sorted(a.flags)) for a in self.downstream.sent ])
+        self.assertEqual(flags, {A: ["light<100", "temperature>25"], B: []})
+        self.assertRaises(ValueError, Aggregator, Downstream(), events={"pressure": 1})
+        self.assertRaises(ValueError, Aggregator, Downstream(), window=10, step=20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of bpcore.att: the PDU codec, and AttClient driven through one end
+of a socketpair. Run from the python directory:
+
+    python -m unittest discover tests
+'''
+
+import time
+import socket
+import threading
+import unittest
+
+from bpcore import att
+
+LIGHT_SERVICE = "4b822f00-3941-4a4b-a3cc-b2602ffe0d00"
+
+
+class AttCodecTest(unittest.TestCase):
+
+    def testUUID(self):
+        self.assertEqual(att.packUUID(0x2800), "\x00\x28")
+        self.assertEqual(att.packUUID("00002902-0000-1000-8000-00805f9b34fb"), "\x02\x29")
+        packed = att.packUUID(LIGHT_SERVICE)
+        self.assertEqual(len(packed), 16)
+        self.assertEqual(att.unpackUUID(packed), LIGHT_SERVICE.replace('-', ''))
+        self.assertEqual(att.unpackUUID(att.packUUID(0x2803)), "00002803" + att.BASE_UUID_SUFFIX)
+
+    def testErrorAndMtu(self):
+        pdu = att.encodeErrorRsp(att.ATT_OP_READ_REQ, 0x0013, att.ATT_ECODE_INVALID_HANDLE)
+        self.assertEqual(att.opcode(pdu), att.ATT_OP_ERROR_RSP)
+        self.assertEqual(att.decodeErrorRsp(pdu), (att.ATT_OP_READ_REQ, 0x0013, att.ATT_ECODE_INVALID_HANDLE))
+        self.assertEqual(att.decodeMtu(att.encodeMtuReq(247)), 247)
+        self.assertEqual(att.decodeMtu(att.encodeMtuRsp(att.ATT_DEFAULT_MTU)), att.ATT_DEFAULT_MTU)
+
+    def testRangeRequests(self):
+        self.assertEqual(att.decodeRangeReq(att.encodeFindInfoReq(0x0014, 0x0020)), (0x0014, 0x0020, None))
+        (start, end, uuid) = att.decodeRangeReq(att.encodeReadByGroupReq(0x0001, 0xFFFF, att.GATT_PRIM_SVC_UUID))
+        self.assertEqual((start, end, uuid), (0x0001, 0xFFFF, "00002800" + att.BASE_UUID_SUFFIX))
+        (start, end, uuid) = att.decodeRangeReq(att.encodeReadByTypeReq(0x0010, 0x0020, LIGHT_SERVICE))
+        self.assertEqual((start, end, uuid), (0x0010, 0x0020, LIGHT_SERVICE.replace('-', '')))
+        value = att.packUUID(LIGHT_SERVICE)
+        pdu = att.encodeFindByTypeReq(0x0001, 0xFFFF, att.GATT_PRIM_SVC_UUID, value)
+        self.assertEqual(att.decodeFindByTypeReq(pdu), (0x0001, 0xFFFF, att.GATT_PRIM_SVC_UUID, value))
+
+    def testResponses(self):
+        infos = [ (0x0014, 0x2902), (0x0015, 0x2901) ]
+        self.assertEqual(att.decodeFindInfoRsp(att.encodeFindInfoRsp(infos)),
+                         [ (h, att.unpackUUID(att.packUUID(u))) for (h, u) in infos ])
+        infos = [ (0x0013, LIGHT_SERVICE) ]
+        self.assertEqual(att.decodeFindInfoRsp(att.encodeFindInfoRsp(infos)), [ (0x0013, LIGHT_SERVICE.replace('-', '')) ])
+
+        ranges = [ (0x0010, 0x0014), (0x0015, 0x0018) ]
+        self.assertEqual(att.decodeFindByTypeRsp(att.encodeFindByTypeRsp(ranges)), ranges)
+
+        items = [ (0x0012, "\x12\x13\x00\x01\x2f"), (0x0016, "\x12\x17\x00\x11\x2f") ]
+        self.assertEqual(att.decodeReadByTypeRsp(att.encodeReadByTypeRsp(items)), items)
+
+        groups = [ (0x0001, 0x0007, "\x00\x18"), (0x0008, 0x000b, "\x01\x18") ]
+        self.assertEqual(att.decodeReadByGroupRsp(att.encodeReadByGroupRsp(groups)), groups)
+
+    def testHandleValue(self):
+        self.assertEqual(att.decodeHandleValue(att.encodeNotification(0x001b, "\x48\x5f")), (0x001b, "\x48\x5f"))
+        self.assertEqual(att.decodeHandleValue(att.encodeIndication(0x001f, "\x2a\x00")), (0x001f, "\x2a\x00"))
+        self.assertEqual(att.decodeHandleValue(att.encodeWriteReq(0x0014, "\x01\x00")), (0x0014, "\x01\x00"))
+        self.assertEqual(att.decodeHandleValue(att.encodeWriteCmd(0x0014, "\x00\x00")), (0x0014, "\x00\x00"))
+        self.assertEqual(att.decodeHandleValue(att.encodeReadReq(0x0013)), (0x0013, ""))
+        self.assertEqual(att.opcode(att.encodeWriteRsp()), att.ATT_OP_WRITE_RSP)
+
+
+class AttClientTest(unittest.TestCase):
+    '''
+    The test plays the peripheral on the other end of the socketpair. The
+    client handles one request at a time, so the responses can be queued
+    before the request is made.
+    '''
+
+    def setUp(self):
+        (ours, self.peer) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.client = att.AttClient(ours, timeout=0.5)
+
+    def tearDown(self):
+        self.client.close()
+        self.peer.close()
+
+    def respond(self, *pdus):
+        for pdu in pdus:
+            self.peer.send(pdu)
+
+    def received(self):
+        # the PDUs the client sent so far
+        pdus = []
+        self.peer.settimeout(0.1)
+        try:
+            while True:
+                pdus.append(self.peer.recv(att.ATT_MAX_MTU))
+        except socket.timeout:
+            return pdus
+
+    def testRequestSkipsUnsolicitedAndStray(self):
+        self.respond(att.encodeNotification(0x001b, "\x01\x02"),
+                     att.encodeWriteRsp(), # answers an earlier request
+                     att.encodeErrorRsp(att.ATT_OP_WRITE_REQ, 0x0014, att.ATT_ECODE_INVALID_HANDLE),
+                     att.encodeIndication(0x001f, "\x03"),
+                     att.encodeReadRsp("\x2a\x00"))
+        self.assertEqual(self.client.read(0x0013), "\x2a\x00")
+        # the indication is confirmed, both are kept for waitForNotification
+        self.assertEqual(self.received(), [ att.encodeReadReq(0x0013), chr(att.ATT_OP_HANDLE_CNF) ])
+        self.assertEqual(self.client.waitForNotification(0.1), (0x001b, "\x01\x02"))
+        self.assertEqual(self.client.waitForNotification(0.1), (0x001f, "\x03"))
+        self.assertEqual(self.client.waitForNotification(0.05), None)
+
+    def testErrorAndTimeout(self):
+        self.respond(att.encodeErrorRsp(att.ATT_OP_READ_REQ, 0x0013, att.ATT_ECODE_INVALID_HANDLE))
+        try:
+            self.client.read(0x0013)
+            self.fail("AttError expected")
+        except att.AttError as e:
+            self.assertEqual(e.ecode, att.ATT_ECODE_INVALID_HANDLE)
+        self.assertRaises(att.AttTimeout, self.client.read, 0x0013)
+
+    def testWaitForNotification(self):
+        self.respond(att.encodeNotification(0x0020, "\x10"), att.encodeNotification(0x0024, "\x11"))
+        self.assertEqual(self.client.waitForNotification(0.5), (0x0020, "\x10"))
+        self.assertEqual(self.client.waitForNotification(0.5), (0x0024, "\x11"))
+        self.assertEqual(self.client.waitForNotification(0.05), None)
+        self.peer.close()
+        self.assertRaises(socket.error, self.client.waitForNotification, 0.5)
+
+    def testInterrupt(self):
+        # interrupt() ends a wait right away, also one that has not started yet
+        self.client.interrupt()
+        start = time.time()
+        self.assertEqual(self.client.waitForNotification(5.0), None)
+        self.assertTrue(time.time() - start < 1.0)
+        timer = threading.Timer(0.1, self.client.interrupt)
+        timer.start()
+        self.assertEqual(self.client.waitForNotification(5.0), None)
+        timer.join()
+        # the wake pipe is drained, the next wait lasts its timeout
+        start = time.time()
+        self.assertEqual(self.client.waitForNotification(0.2), None)
+        self.assertTrue(time.time() - start >= 0.15)
+        # requests are not interrupted
+        self.client.interrupt()
+        self.respond(att.encodeReadRsp("\x01"))
+        self.assertEqual(self.client.read(0x0013), "\x01")
+
+    def testClosed(self):
+        self.client.close()
+        self.client.interrupt()
+        self.assertRaises(socket.error, self.client.waitForNotification, 0.1)
+        self.assertRaises(socket.error, self.client.read, 0x0013)
+
+    def testBlobRead(self):
+        # a full first PDU (mtu - 1 bytes) makes the client ask for the rest
+        value = "".join([ chr(i) for i in range(30) ])
+        self.respond(att.encodeReadRsp(value[:22]), att.encodeReadBlobRsp(value[22:]))
+        self.assertEqual(self.client.read(0x0030), value)
+        self.assertEqual(self.received(), [ att.encodeReadReq(0x0030), att.encodeReadBlobReq(0x0030, 22) ])
+
+        # exactly a full PDU long: the peripheral says there is no more
+        self.respond(att.encodeReadRsp(value[:22]), att.encodeErrorRsp(att.ATT_OP_READ_BLOB_REQ, 0x0030, 0x0B))
+        self.assertEqual(self.client.read(0x0030), value[:22])
+
+    def testIterateDiscovery(self):
+        self.respond(att.encodeReadByGroupRsp([ (0x0001, 0x0007, "\x00\x18"), (0x0008, 0x000b, "\x01\x18") ]),
+                     att.encodeReadByGroupRsp([ (0x000c, 0x0012, att.packUUID(LIGHT_SERVICE)) ]),
+                     att.encodeErrorRsp(att.ATT_OP_READ_BY_GROUP_REQ, 0x0013, att.ATT_ECODE_ATTR_NOT_FOUND))
+        self.assertEqual(self.client.discoverPrimaryServices(),
+                         [ (0x0001, 0x0007, "00001800" + att.BASE_UUID_SUFFIX),
+                           (0x0008, 0x000b, "00001801" + att.BASE_UUID_SUFFIX),
+                           (0x000c, 0x0012, LIGHT_SERVICE.replace('-', '')) ])
+        # every request continues after the last handle of the previous response
+        self.assertEqual([ att.decodeRangeReq(pdu)[:2] for pdu in self.received() ],
+                         [ (0x0001, 0xFFFF), (0x000c, 0xFFFF), (0x0013, 0xFFFF) ])
+
+    def testIterateStopsAtEnd(self):
+        chars = [ (0x0012, "\x12\x13\x00\x01\x2f"), (0x0016, "\x10\x17\x00\x11\x2f") ]
+        self.respond(att.encodeReadByTypeRsp(chars))
+        self.assertEqual(self.client.discoverCharacteristics(0x0010, 0x0016),
+                         [ (0x0012, 0x12, 0x0013, "00002f01" + att.BASE_UUID_SUFFIX),
+                           (0x0016, 0x10, 0x0017, "00002f11" + att.BASE_UUID_SUFFIX) ])
+        self.assertEqual(len(self.received()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the binary uplink frames (bpcore.binframe) and their Receiver.
+Run from the python directory:
+
+    python -m unittest discover tests
+'''
+
+import httplib
+import unittest
+
+from bpcore import binframe
+from bpcore.samples import Sample
+
+
+def samples():
+    return [ Sample("00:07:80:78:FA:5A", 1400000000.0, 23.456, 41, 312, (0.0, -0.5, 1.0)),
+             Sample("00:07:80:78:F5:C3", 1400000000.25, -4.5, 80, 0, (0.25, 0.0, -1.0)),
+             Sample("00:07:80:78:FA:5A", 1400000001.0, 23.5, 42, 300, (0.0625, -0.5, 1.0)) ]
+
+
+class BinframeTest(unittest.TestCase):
+
+    def assertSamplesEqual(self, decoded, samples):
+        self.assertEqual(len(decoded), len(samples))
+        for (d, s) in zip(decoded, samples):
+            self.assertEqual(d.device, s.device)
+            self.assertAlmostEqual(d.timestamp, s.timestamp, places=3)
+            self.assertAlmostEqual(d.temperature, s.temperature, places=3)
+            self.assertEqual((d.humidity, d.light), (s.humidity, s.light))
+            for (a, b) in zip(d.acceleration, s.acceleration):
+                self.assertAlmostEqual(a, b, places=4)
+
+    def testRoundTrip(self):
+        for compress in (False, True):
+            frame = binframe.encode(samples(), compress)
+            self.assertSamplesEqual(binframe.decode(frame), samples())
+
+    def testEmpty(self):
+        self.assertEqual(binframe.decode(binframe.encode([])), [])
+
+    def testMalformed(self):
+        frame = binframe.encode(samples())
+        self.assertRaises(binframe.FrameError, binframe.decode, "XYZ" + frame[3:])
+        self.assertRaises(binframe.FrameError, binframe.decode, frame[:10])
+        self.assertRaises(binframe.FrameError, binframe.decode, frame[:-3])
+
+
+class ReceiverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = binframe.Receiver().start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, body):
+        conn = httplib.HTTPConnection(*self.server.server_address)
+        try:
+            conn.request('POST', '/', body, {'Content-Type': 'application/octet-stream'})
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        finally:
+            conn.close()
+
+    def testFrames(self):
+        frame = binframe.encode(samples(), True)
+        self.assertEqual(self.post(frame), 204)
+        self.assertEqual([ s.device for s in self.server.samples ], [ s.device for s in samples() ])
+        self.assertEqual(self.server.bytes, len(frame))
+        self.assertEqual(self.post("XYZ" + frame[3:]), 400)
+        self.assertEqual(len(self.server.samples), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
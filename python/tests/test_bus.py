@@ -0,0 +1,95 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the shared memory sample bus (bpcore.bus). Run from the python
+directory:
+
+    python -m unittest discover tests
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from bpcore import bus
+from bpcore.bus import SampleBus, BusReader, BusError
+from bpcore.samples import Sample
+
+
+def sample(n):
+    return Sample("00:07:80:78:FA:5A", 1400000000.0 + n, 20.0 + n, 40, 300, (0.0, -0.5, 1.0))
+
+
+class BusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "bpart.bus")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testRoundTrip(self):
+        writer = SampleBus(self.path, slots=8)
+        writer.publish(sample(0))
+        reader = BusReader(self.path) # starts with the next sample
+        old = BusReader(self.path, fromStart=True)
+        for n in (1, 2):
+            writer.publish(sample(n))
+        self.assertEqual(reader.readAvailable(), [ sample(1), sample(2) ])
+        self.assertEqual(old.readAvailable(), [ sample(0), sample(1), sample(2) ])
+        self.assertEqual(reader.poll(), None)
+        self.assertEqual((reader.missed, old.missed), (0, 0))
+
+    def testWraparound(self):
+        writer = SampleBus(self.path, slots=4)
+        reader = BusReader(self.path)
+        for n in range(10):
+            writer.publish(sample(n))
+        # only the last slots samples are left, the others are counted as missed
+        self.assertEqual(reader.readAvailable(), [ sample(n) for n in range(6, 10) ])
+        self.assertEqual(reader.missed, 6)
+        for n in range(10, 13):
+            writer.publish(sample(n))
+        self.assertEqual(reader.readAvailable(), [ sample(n) for n in range(10, 13) ])
+        self.assertEqual(reader.missed, 6)
+        self.assertEqual(BusReader(self.path, fromStart=True).readAvailable(), [ sample(n) for n in range(9, 13) ])
+
+    def testRead(self):
+        writer = SampleBus(self.path, slots=4)
+        reader = BusReader(self.path)
+        self.assertEqual(reader.read(timeout=0.05), None)
+        timer = threading.Timer(0.05, writer.publish, (sample(0),))
+        timer.start()
+        self.assertEqual(reader.read(timeout=2.0), sample(0))
+        timer.join()
+
+    def testReplaced(self):
+        # a restarted gateway writes a new file, the readers switch over
+        SampleBus(self.path, slots=4).publish(sample(0))
+        reader = BusReader(self.path)
+        writer = SampleBus(self.path, slots=4)
+        writer.publish(sample(1))
+        interval = bus.REOPEN_INTERVAL
+        bus.REOPEN_INTERVAL = 0
+        try:
+            self.assertEqual(reader.readAvailable(), [ sample(1) ])
+        finally:
+            bus.REOPEN_INTERVAL = interval
+        self.assertEqual(reader.epoch, writer.epoch)
+
+    def testNotABus(self):
+        with open(self.path, 'wb') as f:
+            f.write("\0" * 128)
+        self.assertRaises(BusError, BusReader, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
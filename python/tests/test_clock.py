@@ -0,0 +1,105 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the reception clock and the drift estimate (bpcore.clock). Run
+from the python directory:
+
+    python -m unittest discover tests
+'''
+
+import time
+import random
+import unittest
+
+from bpcore import clock
+from bpcore.clock import DriftEstimator
+
+START = 5000.0
+
+
+def receptions(period, jitter, rounds, seed=1):
+    # (ideal, received) times of a device notifying every period seconds
+    rnd = random.Random(seed)
+    return [ (START + n * period, START + n * period + rnd.uniform(0, jitter)) for n in range(rounds) ]
+
+
+class GatewayClockTest(unittest.TestCase):
+
+    def testWallTime(self):
+        c = clock.GatewayClock()
+        self.assertTrue(abs(c.wallTime(c.now()) - time.time()) < 0.05)
+        later = c.now() + 10
+        self.assertAlmostEqual(c.wallTime(later) - c.wallTime(c.now()), 10, places=1)
+
+
+class DriftEstimatorTest(unittest.TestCase):
+
+    def testEstimate(self):
+        # 100 ppm slow, received up to 2 ms late
+        estimator = DriftEstimator("00:07:80:78:FA:5A", 1.0)
+        times = receptions(1.0001, 0.002, 64)
+        fitted = [ estimator.add(t) for (ideal, t) in times ]
+        self.assertTrue(abs(estimator.driftPpm - 100) < 20, estimator.driftPpm)
+        self.assertAlmostEqual(estimator.period, 1.0001, places=5)
+        self.assertTrue(0.0003 < estimator.jitter < 0.001, estimator.jitter)
+        # the fitted times are nearer to the sending times (plus the mean delay) than the reception times
+        late = times[clock.DRIFT_MIN_SAMPLES:]
+        offFit = [ abs(f - ideal - 0.001) for (f, (ideal, t)) in zip(fitted[clock.DRIFT_MIN_SAMPLES:], late) ]
+        offRaw = [ abs(t - ideal - 0.001) for (ideal, t) in late ]
+        self.assertTrue(sum(offFit) < sum(offRaw) / 2)
+
+    def testUntilMinSamples(self):
+        estimator = DriftEstimator("00:07:80:78:FA:5A", 1.0, minSamples=8)
+        for (ideal, t) in receptions(1.0, 0.002, 7):
+            self.assertEqual(estimator.add(t), t)
+        self.assertEqual(estimator.period, None)
+        estimator.add(START + 7.0)
+        self.assertNotEqual(estimator.period, None)
+
+    def testMissedAndSplitRounds(self):
+        estimator = DriftEstimator("00:07:80:78:FA:5A", 0.5)
+        times = [ t for (n, (ideal, t)) in enumerate(receptions(0.5, 0.001, 60)) if n % 7 not in (3, 4) ]
+        for t in times:
+            estimator.add(t)
+        self.assertAlmostEqual(estimator.period, 0.5, places=4)
+        # a second sample within the same round is left out
+        self.assertEqual(estimator.add(times[-1] + 0.1), times[-1] + 0.1)
+        self.assertAlmostEqual(estimator.period, 0.5, places=4)
+
+    def testOutliers(self):
+        estimator = DriftEstimator("00:07:80:78:FA:5A", 1.0)
+        times = receptions(1.0, 0.001, 20)
+        for (ideal, t) in times:
+            estimator.add(t)
+        period = estimator.period
+        # a late delivery is passed through and kept out of the fit
+        self.assertEqual(estimator.add(START + 20.3), START + 20.3)
+        estimator.add(START + 21.0005)
+        self.assertAlmostEqual(estimator.period, period, places=6)
+
+        # a shifted phase restarts the estimate after a few rounds
+        shifted = [ START + n + 0.4 for n in range(22, 22 + clock.OUTLIERS) ]
+        for t in shifted:
+            self.assertEqual(estimator.add(t), t)
+        self.assertEqual(len(estimator._points), 1)
+        for n in range(22 + clock.OUTLIERS, 22 + clock.OUTLIERS + clock.DRIFT_MIN_SAMPLES):
+            estimator.add(START + n + 0.4)
+        self.assertAlmostEqual(estimator.period, 1.0, places=6)
+
+    def testReset(self):
+        estimator = DriftEstimator("00:07:80:78:FA:5A", 1.0)
+        for (ideal, t) in receptions(1.0, 0.001, 20):
+            estimator.add(t)
+        estimator.reset()
+        # the rounds restart, nothing is fitted until there are enough of them again
+        self.assertEqual(estimator.add(START + 100.25), START + 100.25)
+        self.assertEqual(estimator.add(START + 101.25), START + 101.25)
+
+
+if __name__ == "__main__":
+    unittest.main()
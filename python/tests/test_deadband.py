@@ -0,0 +1,93 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the deadband filter (bpcore.deadband). Run from the python
+directory:
+
+    python -m unittest discover tests
+'''
+
+import unittest
+
+from bpcore import metrics
+from bpcore.deadband import DeadbandFilter
+from bpcore.samples import Sample
+
+A = "00:07:80:78:FA:5A"
+B = "00:07:80:78:F5:C3"
+
+
+def sample(t, temperature=20.0, humidity=40, light=300, acceleration=(0.0, 0.0, 1.0), device=A):
+    return Sample(device, t, temperature, humidity, light, acceleration)
+
+
+class Downstream(object):
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, sample):
+        self.sent.append(sample)
+
+    def close(self, timeout=10.0):
+        self.closed = True
+
+
+class DeadbandTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.downstream = Downstream()
+
+    def passed(self, thresholds, samples, heartbeat=300.0):
+        # the timestamps of the samples passed on
+        self.downstream.sent = []
+        deadband = DeadbandFilter(self.downstream, thresholds, heartbeat)
+        for s in samples:
+            deadband.send(s)
+        return [ s.timestamp for s in self.downstream.sent ]
+
+    def testAbsolute(self):
+        samples = [ sample(0), sample(1, 20.05), sample(2, 20.11), sample(3, 20.15), sample(4, 20.0) ]
+        # compared with the value last passed on, not the previous one
+        self.assertEqual(self.passed({"temperature": 0.1}, samples), [0, 2, 4])
+        self.assertEqual(metrics.get("deadband.suppressed", device=A), 2)
+
+    def testRelative(self):
+        samples = [ sample(0, light=300), sample(1, light=310), sample(2, light=320), sample(3, light=0),
+                    sample(4, light=1), sample(5, light=5) ]
+        # 5 % of the last value, but at least 2 lux around zero
+        self.assertEqual(self.passed({"light": {"relative": 0.05, "absolute": 2}}, samples), [0, 2, 3, 5])
+
+    def testAcceleration(self):
+        samples = [ sample(0), sample(1, acceleration=(0.03, 0.03, 1.0)), sample(2, acceleration=(0.04, 0.04, 1.0)) ]
+        self.assertEqual(self.passed({"acceleration": 0.05}, samples), [0, 2])
+
+    def testWithoutThreshold(self):
+        # values without a threshold pass on any change
+        samples = [ sample(0), sample(1), sample(2, humidity=41), sample(3, 20.001, humidity=41) ]
+        self.assertEqual(self.passed({"temperature": 0.1}, samples), [0, 2])
+        self.assertEqual(self.passed({}, samples[:1] + samples[3:]), [0, 3])
+
+    def testHeartbeat(self):
+        samples = [ sample(t) for t in (0, 100, 200, 300, 400, 599, 600) ]
+        self.assertEqual(self.passed({}, samples, heartbeat=300), [0, 300, 600])
+
+    def testDevices(self):
+        samples = [ sample(0), sample(1, device=B), sample(2), sample(3, device=B, temperature=25) ]
+        self.assertEqual(self.passed({}, samples), [0, 1, 3])
+
+    def testConfig(self):
+        self.assertRaises(ValueError, DeadbandFilter, self.downstream, {"pressure": 1})
+        DeadbandFilter(self.downstream).close()
+        self.assertTrue(self.downstream.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
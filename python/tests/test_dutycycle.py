@@ -0,0 +1,122 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the EDF duty-cycle scheduler (bpcore.dutycycle). Run from the
+python directory:
+
+    python -m unittest discover tests
+'''
+
+import time
+import threading
+import unittest
+
+from bpcore import metrics
+from bpcore.dutycycle import DutyCycleScheduler
+
+
+class Visits(object):
+    # visit() of the scheduler; records the visits, fails for the devices in failing
+
+    def __init__(self, duration=0.0, failing=()):
+        self.duration = duration
+        self.failing = failing
+        self.visited = []
+        self._cond = threading.Condition()
+
+    def __call__(self, addr):
+        time.sleep(self.duration)
+        with self._cond:
+            self.visited.append(addr)
+            self._cond.notify_all()
+        if addr in self.failing:
+            raise IOError("not in range")
+
+    def waitFor(self, n, timeout=2.0):
+        deadline = time.time() + timeout
+        with self._cond:
+            while len(self.visited) < n and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+            return list(self.visited[:n])
+
+
+class DutyCycleTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def scheduler(self, visits, slots=1):
+        scheduler = DutyCycleScheduler(visits, slots)
+        self.addCleanup(scheduler.stop)
+        return scheduler
+
+    def testEarliestDeadlineFirst(self):
+        visits = Visits()
+        scheduler = self.scheduler(visits)
+        now = time.time()
+        # all released, the shortest period has the earliest deadline
+        scheduler.add("00:07:80:00:00:0A", 10.0, now - 1)
+        scheduler.add("00:07:80:00:00:0B", 2.0, now - 1)
+        scheduler.add("00:07:80:00:00:0C", 5.0, now - 1)
+        # one released later, with a deadline before all others
+        scheduler.add("00:07:80:00:00:0D", 0.5, now + 0.2)
+        scheduler.start()
+        self.assertEqual(visits.waitFor(4), ["00:07:80:00:00:0B", "00:07:80:00:00:0C",
+                                             "00:07:80:00:00:0A", "00:07:80:00:00:0D"])
+
+    def testPeriodsAndRemove(self):
+        visits = Visits()
+        scheduler = self.scheduler(visits)
+        scheduler.add("00:07:80:00:00:0A", 0.1)
+        scheduler.add("00:07:80:00:00:0B", 0.1)
+        scheduler.add("00:07:80:00:00:0B", 10.0) # only changes the period
+        scheduler.add("00:07:80:00:00:0C", 0.1)
+        scheduler.remove("00:07:80:00:00:0C")
+        self.assertEqual(scheduler.devices(), ["00:07:80:00:00:0A", "00:07:80:00:00:0B"])
+        scheduler.start()
+        time.sleep(0.45)
+        scheduler.stop()
+        # once per period
+        self.assertTrue(4 <= visits.visited.count("00:07:80:00:00:0A") <= 6, visits.visited)
+        self.assertEqual(visits.visited.count("00:07:80:00:00:0B"), 1)
+        self.assertFalse("00:07:80:00:00:0C" in visits.visited)
+
+    def testFailedVisit(self):
+        # a failed visit is tried again in the next period
+        visits = Visits(failing=("00:07:80:00:00:0A",))
+        scheduler = self.scheduler(visits)
+        scheduler.add("00:07:80:00:00:0A", 0.05)
+        scheduler.start()
+        visits.waitFor(2)
+        scheduler.stop()
+        self.assertTrue(metrics.get("dutycycle.failures", device="00:07:80:00:00:0A") >= 2)
+
+    def testUtilizationAndMissed(self):
+        # two devices with visits of 0.1 s every 0.15 s need more than one slot
+        visits = Visits(duration=0.1)
+        scheduler = self.scheduler(visits)
+        scheduler.add("00:07:80:00:00:0A", 0.15)
+        scheduler.add("00:07:80:00:00:0B", 0.15)
+        scheduler.start()
+        visits.waitFor(6)
+        scheduler.stop()
+        self.assertTrue(metrics.get("dutycycle.utilization") > 1)
+        self.assertTrue(metrics.get("dutycycle.missed") > 0)
+
+        visits = Visits(duration=0.1)
+        scheduler = self.scheduler(visits, slots=2)
+        scheduler.add("00:07:80:00:00:0A", 0.5)
+        scheduler.add("00:07:80:00:00:0B", 0.5)
+        scheduler.start()
+        visits.waitFor(2)
+        scheduler.stop()
+        self.assertTrue(0.15 < metrics.get("dutycycle.utilization") < 0.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
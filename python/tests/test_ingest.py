@@ -0,0 +1,137 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the notification queues (bpcore.ingest). The single processing
+thread is held up by a gate item while the queues are filled, so the
+order it takes them in is known. Run from the python directory:
+
+    python -m unittest discover tests
+'''
+
+import time
+import threading
+import unittest
+
+from bpcore import ingest, metrics
+from bpcore.ingest import FairScheduler, IngestMixIn
+
+
+def waitFor(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class FairSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.scheduler = FairScheduler(1)
+        self.processed = []
+        self.open = threading.Event()
+        gate = self.scheduler.register("gate", lambda item: self.open.wait(5.0))
+        gate.put(None)
+        waitFor(lambda: not len(gate)) # taken, the thread waits for open
+
+    def tearDown(self):
+        self.open.set()
+        self.scheduler.stop(2.0)
+
+    def register(self, name, **options):
+        return self.scheduler.register(name, lambda item: self.processed.append((name, item)), **options)
+
+    def testWeights(self):
+        a = self.register("a", weight=1)
+        b = self.register("b", weight=3)
+        for i in range(6):
+            a.put(i)
+            b.put(i)
+        self.open.set()
+        self.assertTrue(waitFor(lambda: len(self.processed) == 12))
+        self.assertEqual([ name for (name, item) in self.processed ], list("abbbabbbaaaa"))
+        self.assertEqual([ item for (name, item) in self.processed if name == "b" ], range(6))
+        self.assertEqual(metrics.get("ingest.processed", device="b"), 6)
+
+    def testDropOldest(self):
+        queue = self.register("a", capacity=3, overflow="drop-oldest")
+        self.assertEqual([ queue.put(i) for i in range(5) ], [True, True, True, False, False])
+        self.open.set()
+        self.assertTrue(waitFor(lambda: len(self.processed) == 3))
+        self.assertEqual(self.processed, [ ("a", 2), ("a", 3), ("a", 4) ])
+        self.assertEqual(metrics.get("ingest.dropped", device="a"), 2)
+
+    def testDropNewest(self):
+        queue = self.register("a", capacity=3, overflow="drop-newest")
+        self.assertEqual([ queue.put(i) for i in range(5) ], [True, True, True, False, False])
+        self.open.set()
+        self.assertTrue(waitFor(lambda: len(self.processed) == 3))
+        self.assertEqual(self.processed, [ ("a", 0), ("a", 1), ("a", 2) ])
+        self.assertEqual(metrics.get("ingest.dropped", device="a"), 2)
+
+    def testBlock(self):
+        queue = self.register("a", capacity=2, overflow="block")
+        producer = threading.Thread(target=lambda: [ queue.put(i) for i in range(4) ])
+        producer.start()
+        self.assertTrue(waitFor(lambda: metrics.get("ingest.blocked", device="a")))
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(len(queue), 2)
+        self.open.set()
+        producer.join(2.0)
+        self.assertTrue(waitFor(lambda: len(self.processed) == 4))
+        self.assertEqual(self.processed, [ ("a", i) for i in range(4) ])
+        self.assertEqual(metrics.get("ingest.dropped", device="a"), 0)
+
+    def testClose(self):
+        queue = self.register("a")
+        queue.put(0)
+        queue.close()
+        self.assertFalse(queue.put(1))
+        self.open.set()
+        self.assertTrue(waitFor(lambda: len(self.processed) == 1))
+        self.assertEqual(self.processed, [ ("a", 0) ])
+        self.assertRaises(ValueError, self.scheduler.register, "b", None, overflow="drop-all")
+
+
+class Device(IngestMixIn):
+
+    def __init__(self, threads):
+        self.deviceAddr = "00:07:80:78:FA:5A"
+        self.handled = []
+        self._setupIngest(threads, 8, "drop-newest")
+
+    def _handleNotification(self, handle, data, received):
+        self.handled.append((handle, data, received, threading.current_thread()))
+
+
+class IngestMixInTest(unittest.TestCase):
+
+    def tearDown(self):
+        ingest.stopScheduler(2.0)
+
+    def testWithoutThreads(self):
+        device = Device(0)
+        device._ingest(0x1b, "\x01", 1.0)
+        self.assertEqual(device.handled, [ (0x1b, "\x01", 1.0, threading.current_thread()) ])
+        self.assertEqual(device.ingestQueue, None)
+        device._closeIngest()
+
+    def testWithThreads(self):
+        device = Device(1)
+        for i in range(3):
+            device._ingest(0x1b, chr(i), float(i))
+        self.assertTrue(waitFor(lambda: len(device.handled) == 3))
+        self.assertEqual([ h[1] for h in device.handled ], ["\x00", "\x01", "\x02"])
+        self.assertNotEqual(device.handled[0][3], threading.current_thread())
+        self.assertEqual(device.ingestQueue.capacity, 8)
+        device._closeIngest()
+        self.assertFalse(device.ingestQueue.put((0x1b, "\x03", 3.0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the device list file (bpcore.registry). Run from the python
+directory:
+
+    python -m unittest discover tests
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from bpcore import registry, metrics
+
+A = "00:07:80:78:FA:5A"
+B = "00:07:80:78:F5:C3"
+C = "00:07:80:05:00:01"
+
+
+class Fleet(object):
+    # records what the registry does to it
+
+    def __init__(self):
+        self.calls = []
+
+    def add(self, addr):
+        self.calls.append(("add", addr))
+
+    def remove(self, addr):
+        self.calls.append(("remove", addr))
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "devices.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def testReadDevices(self):
+        self.write("# the lab\n%s\n  %s  # by the window\n\nnot-an-address\n%s\n" % (A, B.lower(), A))
+        self.assertEqual(registry.readDevices(self.path), [A, B])
+        self.assertRaises(IOError, registry.readDevices, os.path.join(self.dir, "missing.txt"))
+
+    def testLoadDevices(self):
+        # created with the default the first time, read afterwards
+        self.assertEqual(registry.loadDevices(self.path, [A, B]), [A, B])
+        self.assertEqual(registry.loadDevices(self.path, [C]), [A, B])
+
+    def testCheck(self):
+        registry.writeDevices(self.path, [A, B])
+        fleet = Fleet()
+        reg = registry.DeviceRegistry(self.path, fleet, [A, B])
+        self.assertEqual(reg.check(), ([], []))
+
+        registry.writeDevices(self.path, [B, C])
+        self.assertEqual(reg.check(), ([C], [A]))
+        self.assertEqual(fleet.calls, [("remove", A), ("add", C)])
+        self.assertEqual(reg.devices, [B, C])
+        self.assertEqual(metrics.get("registry.devices"), 2)
+
+        # only a changed file counts, and a missing one changes nothing
+        self.assertEqual(reg.check(), ([], []))
+        os.remove(self.path)
+        self.assertEqual(reg.check(), ([], []))
+        self.assertEqual(len(fleet.calls), 2)
+        self.assertEqual(metrics.get("registry.changes"), 1)
+
+    def testWatch(self):
+        registry.writeDevices(self.path, [A])
+        fleet = Fleet()
+        reg = registry.DeviceRegistry(self.path, fleet, [A], interval=0.05)
+        reg.start()
+        try:
+            registry.writeDevices(self.path, [A, B])
+            deadline = time.time() + 2.0
+            while not fleet.calls and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            reg.stop()
+            reg.join(1.0)
+        self.assertEqual(fleet.calls, [("add", B)])
+        self.assertFalse(reg.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
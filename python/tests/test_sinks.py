@@ -0,0 +1,310 @@
+# Copyright (c) 2013, 2014 All Right Reserved, TECO, http://www.teco.edu
+#
+# THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+# KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+# PARTICULAR PURPOSE.
+
+'''
+Tests of the sink pipeline (bpcore.sinks), with the in-process Receiver
+and MQTT Broker as servers. Run from the python directory:
+
+    python -m unittest discover tests
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import SocketServer
+import BaseHTTPServer
+
+from bpcore import sinks, metrics, binframe
+from bpcore.mqtt import Broker
+from bpcore.samples import Sample
+
+
+def samples(n, device="00:07:80:78:FA:5A"):
+    return [ Sample(device, 1400000000.0 + i, 20.0 + i, 40, 300, (0.0, 0.0, 1.0)) for i in range(n) ]
+
+
+class Recorder(sinks.Sink):
+    # Keeps what it is given; fails on the samples failing(sample) is true for
+
+    def __init__(self, failing=None, **options):
+        sinks.Sink.__init__(self, **options)
+        self.failing = failing
+        self.batches = []
+        self.written = []
+        self.closed = False
+
+    def write(self, samples):
+        self.batches.append(len(samples))
+        self._writeEach(samples, self._write)
+
+    def _write(self, sample):
+        if self.failing != None and self.failing(sample):
+            raise IOError("refused")
+        self.written.append(sample)
+
+    def close(self):
+        self.closed = True
+
+
+def waitFor(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def testBatches(self):
+        sink = Recorder(batch=3, interval=0.05)
+        pipeline = sinks.Pipeline([sink])
+        for sample in samples(7):
+            pipeline.send(sample)
+        pipeline.close()
+        self.assertEqual(sink.written, samples(7))
+        self.assertTrue(max(sink.batches) <= 3)
+        self.assertTrue(sink.closed)
+        self.assertEqual(metrics.get("sinks.samples"), 7)
+        self.assertEqual(metrics.get("sinks.written", device=sink.name), 7)
+
+    def testFanOut(self):
+        (first, second) = (Recorder(interval=0.05), Recorder(interval=0.05))
+        pipeline = sinks.Pipeline([first, second])
+        for sample in samples(4):
+            pipeline.send(sample)
+        pipeline.close()
+        self.assertEqual(first.written, samples(4))
+        self.assertEqual(second.written, samples(4))
+
+    def testQueueFull(self):
+        # the runner is not started, nothing takes from its queue
+        runner = sinks._SinkRunner(Recorder(queue=2))
+        for sample in samples(3):
+            runner.put(sample)
+        self.assertEqual(metrics.get("sinks.dropped", device="Recorder"), 1)
+
+    def testFailedBatch(self):
+        sink = Recorder(failing=lambda s: True, batch=4, interval=5)
+        pipeline = sinks.Pipeline([sink])
+        for sample in samples(4):
+            pipeline.send(sample)
+        waitFor(lambda: metrics.get("sinks.errors", device=sink.name))
+        pipeline.close()
+        self.assertEqual(sink.written, [])
+        self.assertEqual(metrics.get("sinks.errors", device=sink.name), 1)
+        self.assertEqual(metrics.get("sinks.dropped", device=sink.name), 4)
+
+    def testPartialWrite(self):
+        # only the samples after the failed one are dropped
+        sink = Recorder(failing=lambda s: s.temperature == 22.0, batch=4, interval=5)
+        pipeline = sinks.Pipeline([sink])
+        for sample in samples(4):
+            pipeline.send(sample)
+        waitFor(lambda: metrics.get("sinks.errors", device=sink.name))
+        pipeline.close()
+        self.assertEqual(sink.written, samples(2))
+        self.assertEqual(metrics.get("sinks.written", device=sink.name), 2)
+        self.assertEqual(metrics.get("sinks.dropped", device=sink.name), 2)
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.dir = tempfile.mkdtemp()
+        self.spool = os.path.join(self.dir, "spool")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testSpoolAndResend(self):
+        # what a sink can't write before close is sent by the next pipeline, first
+        down = Recorder(failing=lambda s: True, batch=10, interval=5)
+        pipeline = sinks.Pipeline([down], self.spool)
+        for sample in samples(3):
+            pipeline.send(sample)
+        pipeline.close()
+        self.assertEqual(sinks.readSpool(self.spool), {"0 Recorder": samples(3)})
+        self.assertEqual(metrics.get("sinks.spooled", device="Recorder"), 3)
+
+        up = Recorder(interval=0.05)
+        pipeline = sinks.Pipeline([up], self.spool)
+        self.assertFalse(os.path.exists(self.spool))
+        pipeline.send(samples(4)[3])
+        pipeline.close()
+        self.assertEqual(up.written, samples(4))
+        self.assertFalse(os.path.exists(self.spool))
+
+    def testPartialWriteOnClose(self):
+        # only the samples after the failed one are spooled
+        sink = Recorder(failing=lambda s: s.temperature >= 22.0, batch=10, interval=5)
+        pipeline = sinks.Pipeline([sink], self.spool)
+        for sample in samples(4):
+            pipeline.send(sample)
+        pipeline.close()
+        self.assertEqual(sink.written, samples(2))
+        self.assertEqual(sinks.readSpool(self.spool), {"0 Recorder": samples(4)[2:]})
+
+    def testSinkGone(self):
+        sinks.writeSpool(self.spool, {"0 HttpSink": samples(2)})
+        sink = Recorder(interval=0.05)
+        sinks.Pipeline([sink], self.spool).close()
+        self.assertEqual(sink.written, [])
+        self.assertFalse(os.path.exists(self.spool))
+
+    def testNoSpool(self):
+        sink = Recorder(failing=lambda s: True, batch=10, interval=5)
+        pipeline = sinks.Pipeline([sink])
+        pipeline.send(samples(1)[0])
+        pipeline.close()
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+class _StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Answers with the status the server is set to, keeps the connection
+    # open unless the server drops connections after every response
+
+    protocol_version = "HTTP/1.1"
+
+    def _answer(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append(self.command)
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        if self.server.dropConnections:
+            self.close_connection = 1
+
+    do_PUT = do_POST = _answer
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class _StatusServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, status=200, dropConnections=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _StatusHandler)
+        self.status = status
+        self.dropConnections = dropConnections
+        self.requests = []
+
+    @property
+    def url(self):
+        return "http://%s:%d/" % self.server_address
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+
+class HttpSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def serve(self, server):
+        self.servers.append(server)
+        return server.start()
+
+    def testFormats(self):
+        receiver = self.serve(binframe.Receiver())
+        sink = sinks.HttpSink(receiver.url)
+        sink.write(samples(2))
+        sink.close()
+        self.assertEqual([ (s.device, s.temperature) for s in receiver.samples ],
+                         [ (s.device, s.temperature) for s in samples(2) ])
+
+        del receiver.samples[:]
+        sink = sinks.HttpSink(receiver.url, format="binary")
+        sink.write(samples(3))
+        sink.close()
+        self.assertEqual([ s.timestamp for s in receiver.samples ], [ s.timestamp for s in samples(3) ])
+
+    def testServerError(self):
+        # 5xx fail the write, so the samples are dropped or spooled
+        server = self.serve(_StatusServer(503))
+        sink = sinks.HttpSink(server.url)
+        try:
+            sink.write(samples(2))
+            self.fail("PartialWrite expected")
+        except sinks.PartialWrite as e:
+            self.assertEqual(e.sent, 0)
+        sink.close()
+        self.assertRaises(IOError, sinks.HttpSink(server.url, format="binary").write, samples(2))
+        self.assertEqual(server.requests, ['PUT', 'POST'])
+
+    def testClientError(self):
+        # 4xx would fail again, they are counted and the samples go
+        server = self.serve(_StatusServer(404))
+        sink = sinks.HttpSink(server.url)
+        sink.write(samples(2))
+        self.assertEqual(server.requests, ['PUT', 'PUT'])
+        self.assertEqual(metrics.get("sinks.errors", device=sink.name), 2)
+
+    def testRetryOnReusedConnection(self):
+        # the server closes the connection after every response without saying so
+        server = self.serve(_StatusServer(200, dropConnections=True))
+        sink = sinks.HttpSink(server.url)
+        sink.write(samples(2))
+        self.assertEqual(server.requests, ['PUT', 'PUT'])
+
+        # a POST that went out may have been taken, it is not sent again
+        del server.requests[:]
+        sink = sinks.HttpSink(server.url, format="binary")
+        sink.write(samples(1))
+        self.assertRaises(Exception, sink.write, samples(1))
+        self.assertEqual(server.requests, ['POST'])
+        sink.write(samples(1)) # on a new connection
+        self.assertEqual(server.requests, ['POST', 'POST'])
+
+
+class MqttSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = Broker().start()
+
+    def tearDown(self):
+        self.broker.shutdown()
+        self.broker.server_close()
+
+    def waitForMessages(self, n):
+        deadline = time.time() + 2.0
+        while len(self.broker.messages) < n and time.time() < deadline:
+            time.sleep(0.01)
+        return self.broker.messages
+
+    def testFormats(self):
+        sink = sinks.MqttSink("127.0.0.1", self.broker.port)
+        sink.write(samples(2) + samples(1, "00:07:80:78:F5:C3"))
+        self.assertEqual([ topic for (topic, payload) in self.waitForMessages(3) ],
+                         ["bpart/00078078FA5A", "bpart/00078078FA5A", "bpart/00078078F5C3"])
+        del self.broker.messages[:]
+        sink = sinks.MqttSink("127.0.0.1", self.broker.port, format="binary")
+        sink.write(samples(3))
+        ((topic, frame),) = self.waitForMessages(1)
+        self.assertEqual(topic, "bpart/all")
+        self.assertEqual(len(binframe.decode(frame)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()